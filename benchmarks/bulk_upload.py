@@ -0,0 +1,42 @@
+"""
+Time to import a ZIP archive of pages with the bulk upload of the admin,
+into a library that already has some pages, half of which get a new version.
+"""
+from io import BytesIO
+import tempfile
+import time
+import zipfile
+
+from .utils import parser, populate, test_database
+
+
+def main():
+    arguments = parser(__doc__, volumes=1, pages=250)
+    arguments.add_argument("--files", type=int, default=500)
+    arguments.add_argument("--workers", type=int, default=4)
+    args = arguments.parse_args()
+    with open("pcdl_docs/test_pdf.pdf", "rb") as f:
+        content = f.read()
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w") as f:
+        for page_no in range(1, args.files + 1):
+            f.writestr(f"volume_1_page_{page_no}_scanned.pdf", content)
+    with test_database(), tempfile.TemporaryDirectory() as media_root:
+        from django.test import override_settings
+
+        from books.importing import import_zip
+
+        total = populate(args.volumes, args.pages)
+        print(f"{total} pages, importing {args.files} files with {args.workers} workers")
+        with override_settings(MEDIA_ROOT=media_root + "/"), zipfile.ZipFile(archive) as f:
+            start = time.perf_counter()
+            results = import_zip(f, workers=args.workers)
+            elapsed = time.perf_counter() - start
+        statuses = {}
+        for result in results:
+            statuses[result.status] = statuses.get(result.status, 0) + 1
+        print(f"{statuses} in {elapsed:.2f} s, {len(results) / elapsed:.0f} files/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Latency of a deep page of the page list: offset pagination against
+cursor pagination, for the rows query alone and for the whole view.
+"""
+from .utils import measure, parser, populate, report, test_database
+
+
+def main():
+    arguments = parser(__doc__)
+    arguments.add_argument("--page", type=int, default=1000)
+    arguments.add_argument("--per-page", type=int, default=100)
+    args = arguments.parse_args()
+    with test_database():
+        from django.contrib.auth import get_user_model
+        from django.test import Client
+        from django.urls import reverse
+
+        from books.models import Page
+        from books.pagination import CursorPaginator, _after
+
+        total = populate(args.volumes, args.pages)
+        print(f"{total} pages in {args.volumes} volumes, page {args.page} of {args.per_page} rows")
+        offset = (args.page - 1) * args.per_page
+        ordering = ("volume_no", "page_no", "type")
+        queryset = Page.objects.order_by(*ordering)
+        last = queryset[offset - 1]
+        key = [getattr(last, field) for field in ordering]
+
+        report(
+            "rows: OFFSET",
+            measure(lambda: list(queryset[offset:offset + args.per_page]), args.repeat),
+        )
+        report(
+            "rows: keyset",
+            measure(lambda: list(queryset.filter(_after(ordering, key))[:args.per_page + 1]), args.repeat),
+        )
+
+        client = Client()
+        client.force_login(get_user_model().objects.create_superuser(username="benchmark"))
+        url = reverse("page_list")
+        paginator = CursorPaginator.__new__(CursorPaginator)
+        paginator.sort, paginator.ordering = None, ordering
+        cursor = paginator.make_cursor(last)
+        report(
+            "view: page numbers",
+            measure(lambda: client.get(url, {"per_page": args.per_page, "page": args.page}), args.repeat),
+        )
+        report(
+            "view: cursor",
+            measure(
+                lambda: client.get(
+                    url, {"per_page": args.per_page, "pagination": "cursor", "cursor": cursor}
+                ),
+                args.repeat,
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Latency of the page list view with the rendered rows cached against
+rendering them on every request, for staff and for readers.
+"""
+from .utils import measure, parser, populate, report, test_database
+
+
+def main():
+    arguments = parser(__doc__, pages=2000)
+    arguments.add_argument("--per-page", type=int, default=100)
+    args = arguments.parse_args()
+    with test_database():
+        from django.contrib.auth import get_user_model
+        from django.test import Client
+        from django.urls import reverse
+
+        from books import cache
+
+        total = populate(args.volumes, args.pages)
+        print(f"{total} pages in {args.volumes} volumes, {args.per_page} rows per page")
+        url = reverse("page_list")
+        query = {"per_page": args.per_page, "volume_no": 3, "sort": "page_no"}
+        User = get_user_model()
+        for label, user in (
+            ("staff", User.objects.create_superuser(username="staff")),
+            ("reader", User.objects.create_user(username="reader")),
+        ):
+            client = Client()
+            client.force_login(user)
+
+            def uncached():
+                cache.bump_generation()
+                return client.get(url, query)
+
+            report(f"{label}: rendered", measure(uncached, args.repeat))
+            report(
+                f"{label}: cached rows",
+                measure(lambda: client.get(url, query), args.repeat),
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Latency of the reader page list query: the previous OR-of-Exists
+deduplication against the is_reader_canonical flag.
+"""
+from django.db.models import Exists, OuterRef
+
+from .utils import measure, parser, populate, report, test_database
+
+
+def old_reader_queryset(parent):
+    typed = parent.filter(type="Typed")
+    scanned = parent.filter(type="Scanned")
+    duplicates = typed.annotate(
+        is_duplicate=Exists(
+            scanned.filter(page_no=OuterRef("page_no"), volume_no=OuterRef("volume_no"))
+        )
+    )
+    return scanned | duplicates.filter(is_duplicate=False)
+
+
+def main():
+    args = parser(__doc__).parse_args()
+    with test_database():
+        from books.models import Page
+
+        total = populate(args.volumes, args.pages)
+        print(f"{total} pages in {args.volumes} volumes")
+        querysets = {
+            "OR of Exists": old_reader_queryset(Page.objects.all()),
+            "is_reader_canonical": Page.objects.filter(is_reader_canonical=True),
+        }
+        volume_no = min(7, args.volumes)
+        assert querysets["OR of Exists"].count() == querysets["is_reader_canonical"].count()
+        for label, queryset in querysets.items():
+            report(label + ": count", measure(queryset.count, args.repeat))
+            report(
+                label + ": first 100",
+                measure(lambda: list(queryset[:100]), args.repeat),
+            )
+            report(
+                f"{label}: volume {volume_no}, 100 rows",
+                measure(lambda: list(queryset.filter(volume_no=volume_no)[args.pages // 2:args.pages // 2 + 100]), args.repeat),
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Peak memory of validating an upload: the previous validator, which read
+the whole file to sniff its type, against the streaming FileValidator.
+Uploads are spooled to disk like the ones above FILE_UPLOAD_MAX_MEMORY_SIZE.
+"""
+import argparse
+import os
+import tracemalloc
+
+import magic
+
+from . import utils  # noqa: F401, sets up Django
+
+from django.core.files.uploadedfile import TemporaryUploadedFile  # noqa: E402
+
+from core.validators import FileValidator  # noqa: E402
+
+
+def old_validator(data):
+    magic.from_buffer(data.read(), mime=True)
+    data.seek(0)
+
+
+def upload(size):
+    data = TemporaryUploadedFile("page.pdf", "application/pdf", size, None)
+    with open("pcdl_docs/test_pdf.pdf", "rb") as f:
+        data.write(f.read())
+    data.write(os.urandom(size - data.tell()))
+    data.seek(0)
+    return data
+
+
+def peak_memory(function, data):
+    tracemalloc.start()
+    try:
+        function(data)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50], help="MB")
+    args = parser.parse_args()
+    validators = {
+        "read whole file": old_validator,
+        "FileValidator": FileValidator(content_types=("application/pdf",)),
+    }
+    for size in args.sizes:
+        data = upload(size * 1024 * 1024)
+        for label, validator in validators.items():
+            peak = peak_memory(validator, data)
+            print(f"{label + f', {size} MB':<40} peak {peak / 1024:10.1f} KiB")
+        data.close()
+
+
+if __name__ == "__main__":
+    main()
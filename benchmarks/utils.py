@@ -0,0 +1,113 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Benchmarks run from the project root against a throwaway test database,
+so they never touch the development data, e.g.:
+
+    python -m benchmarks.reader_list --volumes 21 --pages 10000
+"""
+import argparse
+from contextlib import contextmanager
+import os
+import statistics
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pcdl.settings")
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+
+def parser(description, volumes=21, pages=10000):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--volumes", type=int, default=volumes)
+    parser.add_argument("--pages", type=int, default=pages, help="pages per volume")
+    parser.add_argument("--repeat", type=int, default=20)
+    return parser
+
+
+@contextmanager
+def test_database():
+    """
+    Create a test database for the duration of the benchmark.
+    """
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def populate(volumes, pages, batch_size=5000):
+    """
+    Bulk create a library of pages. Every page has a scanned version, and
+    every third page also a typed one. Files are not written to disk.
+    The navigation index is filled in directly, as rows come in order, with
+    the sparse ordinals navigation.rebuild gives them.
+    """
+    from books import navigation
+    from books.models import Page
+
+    # as many versions per volume as rebuild counts
+    step = min(navigation.ORDER_STEP, navigation.VOLUME_SPAN // (pages + pages // 3 + 1))
+
+    def rows():
+        for volume_no in range(1, volumes + 1):
+            staff_order = reader_order = volume_no * navigation.VOLUME_SPAN
+            for page_no in range(1, pages + 1):
+                name = f"volume_{volume_no}/page_{page_no}/volume_{volume_no}_page_{page_no}"
+                reader_order += step
+                staff_order += step
+                yield Page(
+                    volume_no=volume_no,
+                    page_no=page_no,
+                    type=Page.TYPE_SCANNED,
+                    scanned_text=name + "_scanned.pdf",
+                    version_no=1,
+                    staff_order=staff_order,
+                    reader_order=reader_order,
+                    is_reader_canonical=True,
+                )
+                if page_no % 3 == 0:
+                    staff_order += step
+                    yield Page(
+                        volume_no=volume_no,
+                        page_no=page_no,
+                        type=Page.TYPE_TYPED,
+                        typed_text=name + "_typed.pdf",
+                        version_no=1,
+                        staff_order=staff_order,
+                        reader_order=reader_order,
+                    )
+
+    batch = []
+    for page in rows():
+        batch.append(page)
+        if len(batch) >= batch_size:
+            Page.objects.bulk_create(batch)
+            batch = []
+    Page.objects.bulk_create(batch)
+    return Page.objects.count()
+
+
+def measure(function, repeat):
+    """
+    Median and best wall time of function, in milliseconds.
+    """
+    function()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), min(timings)
+
+
+def report(label, timings):
+    median, best = timings
+    print(f"{label:<40} median {median:9.2f} ms   best {best:9.2f} ms")
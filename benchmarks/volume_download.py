@@ -0,0 +1,54 @@
+"""
+Throughput of the ZIP download of a whole volume, as read by a client, and
+the memory it takes while streaming.
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+from .utils import parser, populate, test_database
+
+
+def main():
+    arguments = parser(__doc__, volumes=1, pages=1000)
+    arguments.add_argument("--size", type=int, default=256, help="KiB per file")
+    args = arguments.parse_args()
+    with open("pcdl_docs/test_pdf.pdf", "rb") as f:
+        content = f.read().ljust(args.size * 1024, b"\n")
+    with test_database(), tempfile.TemporaryDirectory() as media_root:
+        from django.contrib.auth import get_user_model
+        from django.test import Client, override_settings
+        from django.urls import reverse
+
+        from books.models import Page
+
+        total = populate(args.volumes, args.pages)
+        for name in Page.objects.values_list("scanned_text", flat=True):
+            if name:
+                path = os.path.join(media_root, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(content)
+        client = Client()
+        client.force_login(get_user_model().objects.create_user(username="reader"))
+        print(f"{total} pages, {args.size} KiB per file")
+
+        with override_settings(MEDIA_ROOT=media_root + "/"):
+            for _ in range(max(args.repeat // 10, 1)):
+                tracemalloc.start()
+                start = time.perf_counter()
+                response = client.get(reverse("page_download"), {"volume_no": 1})
+                size = sum(len(chunk) for chunk in response.streaming_content)
+                response.close()
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print(
+                    f"{size / 2**20:8.1f} MiB in {elapsed:.2f} s, "
+                    f"{size / 2**20 / elapsed:7.1f} MiB/s, peak {peak / 2**20:.1f} MiB"
+                )
+
+
+if __name__ == "__main__":
+    main()
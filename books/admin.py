@@ -1,21 +1,247 @@
+import mimetypes
+from pathlib import Path
+
+from django.conf import settings
 from django.contrib import admin
-from django.core.exceptions import ValidationError
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.datastructures import MultiValueDict
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_http_methods
 # from simple_history.admin import SimpleHistoryAdmin
 
-from .models import Page
-from .forms import PageForm
+from . import importing, uploads, versions
+from .models import Page, PageUpload
+from .forms import BulkUploadForm, PageForm
 from core.admin import CustomHistoryAdmin
+from core.sendfile import sendfile
+from core.uploadhandlers import uploaded_files
 
 class PageAdmin(CustomHistoryAdmin):
     list_display = ("page_no", "volume_no", "type", "comments")
     exclude = ("version_no",)
-    history_list_display = ["type"]
+    history_list_display = ["type", "download"]
     search_fields = ["page_no"]
     list_filter = ("type", "volume_no")
     search_help_text = "Give a page number"
     readonly_fields = ("type",)
     form = PageForm
 
+    def is_current_version(self, record, name):
+        return Page.objects.filter(
+            Q(scanned_text=name) | Q(typed_text=name),
+            pk=record.id,
+            version_no=record.version_no,
+        ).exists()
+
+    def has_history_file(self, record):
+        name = record.typed_text or record.scanned_text
+        return bool(name) and (
+            versions.find(name, record.version_no) is not None
+            or self.is_current_version(record, name)
+        )
+
+    def history_file_response(self, request, record):
+        """
+        The file of the page as of the record: the live file for the
+        current version, an archived one for earlier versions.
+        """
+        name = record.typed_text or record.scanned_text
+        if not name:
+            raise Http404("No file for this record")
+        if self.is_current_version(record, name):
+            return sendfile(request, name, as_attachment=True)
+        file = versions.open_version(name, record.version_no)
+        if file is None:
+            raise Http404("This version is no longer kept")
+        path = Path(name)
+        return FileResponse(
+            file,
+            as_attachment=True,
+            filename=f"{path.stem}.v{record.version_no}{path.suffix}",
+            content_type=mimetypes.guess_type(name)[0],
+        )
+
+    def get_urls(self):
+        return [
+            path(
+                "bulk-upload/",
+                self.admin_site.admin_view(self.bulk_upload_view),
+                name="books_page_bulk_upload",
+            ),
+            path(
+                "uploads/",
+                self.admin_site.admin_view(self.upload_create_view),
+                name="books_page_upload_create",
+            ),
+            path(
+                "uploads/<uuid:upload_id>/",
+                self.admin_site.admin_view(self.upload_view),
+                name="books_page_upload",
+            ),
+            path(
+                "uploads/<uuid:upload_id>/finalize/",
+                self.admin_site.admin_view(self.upload_finalize_view),
+                name="books_page_upload_finalize",
+            ),
+        ] + super().get_urls()
+
+    def get_form(self, request, obj=None, **kwargs):
+        if request.method == "POST":
+            # files rejected while they arrived stop the request early, and
+            # are added back for the form to report their error
+            uploaded_files(request)
+        form = super().get_form(request, obj, **kwargs)
+        form.upload_url = reverse(
+            "admin:books_page_upload_create", current_app=self.admin_site.name
+        )
+        return form
+
+    def bulk_upload_view(self, request):
+        """
+        Create or update the pages of the files of a ZIP archive, and
+        report the result of every file.
+        """
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            raise PermissionDenied
+        form = BulkUploadForm(request.POST or None, request.FILES or None)
+        results = []
+        if request.method == "POST" and form.is_valid():
+            with form.cleaned_data["zip"] as archive:
+                results = importing.import_zip(
+                    archive,
+                    user=request.user,
+                    comments=form.cleaned_data["comments"],
+                    workers=settings.PAGE_BULK_UPLOAD_WORKERS,
+                )
+            with transaction.atomic():
+                for result in results:
+                    if result.status == importing.CREATED:
+                        self.log_addition(request, result.page, [{"added": {}}])
+                    elif result.status == importing.UPDATED:
+                        self.log_change(request, result.page, [{"changed": {"fields": ["File"]}}])
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title="Bulk upload",
+            form=form,
+            results=results,
+            summary={
+                status: sum(result.status == status for result in results)
+                for status in (importing.CREATED, importing.UPDATED, importing.FAILED)
+            },
+        )
+        return TemplateResponse(request, "admin/books/page/bulk_upload.html", context)
+
+    def get_upload(self, request, upload_id):
+        return get_object_or_404(PageUpload, pk=upload_id, user=request.user)
+
+    def upload_response(self, upload, offset, status=204):
+        response = HttpResponse(status=status)
+        response["Upload-Offset"] = offset
+        response["Upload-Length"] = upload.length
+        response["Cache-Control"] = "no-store"
+        return response
+
+    def upload_error_response(self, error):
+        response = HttpResponse(str(error), status=error.status, content_type="text/plain")
+        if error.offset is not None:
+            response["Upload-Offset"] = error.offset
+        return response
+
+    @method_decorator(require_http_methods(["POST"]))
+    def upload_create_view(self, request):
+        """
+        Start a resumable upload of the file of a page form field.
+        """
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        try:
+            upload = uploads.create(
+                request.user,
+                request.POST.get("field", ""),
+                request.POST.get("filename", ""),
+                int(request.POST.get("length", "")),
+            )
+        except ValueError:
+            return HttpResponse("Give the length of the upload.", status=400)
+        except uploads.UploadError as e:
+            return self.upload_error_response(e)
+        response = self.upload_response(upload, 0, status=201)
+        response["Location"] = reverse(
+            "admin:books_page_upload", args=[upload.pk], current_app=self.admin_site.name
+        )
+        return response
+
+    @method_decorator(require_http_methods(["HEAD", "PATCH", "DELETE"]))
+    def upload_view(self, request, upload_id):
+        """
+        HEAD gives the offset to resume from, PATCH appends the request body
+        at the Upload-Offset header, DELETE abandons the upload.
+        """
+        upload = self.get_upload(request, upload_id)
+        if request.method == "HEAD":
+            return self.upload_response(upload, uploads.get_offset(upload), status=200)
+        if request.method == "DELETE":
+            uploads.discard(upload)
+            return HttpResponse(status=204)
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+        except ValueError:
+            return HttpResponse("Give the Upload-Offset header.", status=400)
+        try:
+            # the body is streamed, never loaded into memory
+            offset = uploads.append(upload, offset, request)
+        except uploads.UploadError as e:
+            return self.upload_error_response(e)
+        return self.upload_response(upload, offset)
+
+    @method_decorator(require_http_methods(["POST"]))
+    def upload_finalize_view(self, request, upload_id):
+        """
+        Save a complete upload through the page form, as a new page or as a
+        new version of the page given by the page parameter.
+        """
+        upload = self.get_upload(request, upload_id)
+        page = None
+        add = not request.POST.get("page")
+        if not add:
+            page = get_object_or_404(Page, pk=request.POST["page"])
+            if not self.has_change_permission(request, page):
+                raise PermissionDenied
+        try:
+            file = uploads.finalize(upload)
+        except uploads.UploadError as e:
+            return self.upload_error_response(e)
+        with file:
+            form = self.get_form(request, page, change=not add)(
+                request.POST, MultiValueDict({upload.field: [file]}), instance=page
+            )
+            if not form.is_valid():
+                return JsonResponse({"errors": form.errors.get_json_data()}, status=400)
+            page = form.save()
+        uploads.discard(upload)
+        message = self.construct_change_message(request, form, None, add)
+        if add:
+            self.log_addition(request, page, message)
+        else:
+            self.log_change(request, page, message)
+        return JsonResponse(
+            {
+                "page": page.pk,
+                "version_no": page.version_no,
+                "url": reverse(
+                    "admin:books_page_change", args=[page.pk], current_app=self.admin_site.name
+                ),
+            },
+            status=201,
+        )
+
     def has_module_permission(self, request, *args, **kwargs):
         return (request.user.is_superuser or request.user.is_staff)
 
@@ -0,0 +1,200 @@
+"""
+Caching helpers for page data.
+
+Cache keys include a generation number that is bumped whenever a page is
+saved or deleted, so entries computed from older data are never read again
+and simply expire. Only the cache operations every Django backend has are
+used, so locmem, file-based and Redis caches all work. The generation only
+reaches every process through a shared cache, though: with locmem, each
+process keeps its own and serves stale entries after another one writes,
+which the books.W001 check warns about.
+
+Lookups count their hits and misses by key prefix. The counts are kept per
+process and added to shared counters in the cache every STATS_FLUSH_EVERY
+lookups; the cache_stats command shows them.
+"""
+from collections import Counter
+import hashlib
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+
+GENERATION_KEY = "books:page-generation"
+
+STATS_KEY = "books:stats:{}:{}"
+
+STATS_PREFIXES_KEY = "books:stats"
+
+STATS_FLUSH_EVERY = 100
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # start from the clock, so that a generation evicted from the cache
+        # is not reused with entries still cached under it
+        cache.add(GENERATION_KEY, time.time_ns() // 1000, timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        get_generation()
+
+
+def invalidate():
+    """
+    Invalidate cached page data now and once the current transaction
+    commits, so that a request racing with the write cannot cache data
+    read before the commit under the new generation.
+    """
+    bump_generation()
+    transaction.on_commit(bump_generation)
+
+
+def make_key(prefix, *parts):
+    """
+    Cache key for the current generation, with a digest of the parts.
+    """
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f"books:{prefix}:{get_generation()}:{digest}"
+
+
+def _count(prefix, outcome):
+    with _stats_lock:
+        _stats[prefix, outcome] += 1
+        if sum(_stats.values()) < STATS_FLUSH_EVERY:
+            return
+        pending = dict(_stats)
+        _stats.clear()
+    flush_stats(pending)
+
+
+def flush_stats(pending=None):
+    """
+    Add the counts of this process to the shared counters.
+    """
+    if pending is None:
+        with _stats_lock:
+            pending = dict(_stats)
+            _stats.clear()
+    for (prefix, outcome), count in pending.items():
+        key = STATS_KEY.format(prefix, outcome)
+        if not cache.add(key, count, timeout=None):
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                cache.set(key, count, timeout=None)
+        prefixes = cache.get(STATS_PREFIXES_KEY, set())
+        if prefix not in prefixes:
+            cache.set(STATS_PREFIXES_KEY, prefixes | {prefix}, timeout=None)
+
+
+def stats():
+    """
+    Hits and misses of the lookups of every process, by key prefix.
+    """
+    flush_stats()
+    prefixes = sorted(cache.get(STATS_PREFIXES_KEY, set()))
+    counts = cache.get_many(
+        [STATS_KEY.format(p, o) for p in prefixes for o in ("hits", "misses")]
+    )
+    return {
+        prefix: {
+            outcome: counts.get(STATS_KEY.format(prefix, outcome), 0)
+            for outcome in ("hits", "misses")
+        }
+        for prefix in prefixes
+    }
+
+
+def reset_stats():
+    """
+    Start counting hits and misses from zero.
+    """
+    with _stats_lock:
+        _stats.clear()
+    prefixes = cache.get(STATS_PREFIXES_KEY, set())
+    cache.delete_many(
+        [STATS_KEY.format(p, o) for p in prefixes for o in ("hits", "misses")]
+        + [STATS_PREFIXES_KEY]
+    )
+
+
+def get_or_set(key, default, timeout=None):
+    """
+    Return the cached value for key, computing it with default() on a miss.
+    Values are wrapped, so that None is cached too.
+    """
+    prefix = key.split(":")[1]
+    cached = cache.get(key)
+    if cached is not None:
+        _count(prefix, "hits")
+        return cached[0]
+    _count(prefix, "misses")
+    value = default()
+    cache.set(key, (value,), timeout)
+    return value
+
+
+def lookup(prefix, parts, default):
+    """
+    Read-through lookup of page data, for PAGE_CACHE_TIMEOUT at most.
+    """
+    return get_or_set(
+        make_key(prefix, *parts), default, timeout=settings.PAGE_CACHE_TIMEOUT
+    )
+
+
+def _numbers(*values):
+    try:
+        return tuple(int(value) for value in values)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_with_neighbours(volume_no, page_no, type=None, is_staff=False):
+    """
+    Cached PageQuerySet.get_with_neighbours: the (previous, page, next)
+    pages seen by staff or readers.
+    """
+    Page = apps.get_model("books", "Page")
+    numbers = _numbers(volume_no, page_no)
+    if numbers is None:
+        return None, None, None
+    return lookup(
+        "neighbours",
+        (is_staff, *numbers, type if is_staff else None),
+        lambda: Page.objects.get_with_neighbours(*numbers, type, is_staff=is_staff),
+    )
+
+
+def get_file_version(name, is_staff=False):
+    """
+    The (version number, SHA-256) of the page with the file name, among the
+    pages staff or readers may see, or None.
+    """
+    Page = apps.get_model("books", "Page")
+    pages = Page.objects.all()
+    if not is_staff:
+        pages = pages.filter(is_reader_canonical=True)
+    return lookup(
+        "file",
+        (is_staff, name),
+        lambda: pages.filter(
+            Q(scanned_text=name) | Q(typed_text=name)
+        ).values_list("version_no", "sha256").first(),
+    )
+
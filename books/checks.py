@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import register, Tags, Warning
+
+
+LOCAL_CACHE_BACKENDS = ("django.core.cache.backends.locmem.LocMemCache",)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Cached page data is invalidated through the cache itself, which only
+    works when all processes share it.
+    """
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if settings.DEBUG or backend not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [
+        Warning(
+            "The default cache is local to each process, so page writes in "
+            "one process do not invalidate the cached pages, counts and "
+            "tables of the others.",
+            hint="Set CACHE_URL to a shared cache, e.g. redis:// or file://, "
+            "unless the site runs in a single process.",
+            id="books.W001",
+        )
+    ]
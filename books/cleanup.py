@@ -0,0 +1,192 @@
+"""
+Removal of the files of deleted pages.
+
+Deleting a page only writes the name of its file to the FileCleanup journal,
+in the same transaction, so the files are kept if the deletion rolls back
+and are not forgotten if the process dies. The journal is processed in
+batches after the transaction commits, by a background thread when
+MEDIA_CLEANUP_ON_COMMIT is set and by the process_file_cleanup command.
+
+collect_media reconciles MEDIA_ROOT with the pages and removes the files
+no page refers to, e.g. those of earlier crashes.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import logging
+import os
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import Q
+
+from core.storage import BLOB_DIRECTORY, STALE_TEMPORARY_AGE, TEMPORARY_PREFIX
+from core.uploadhandlers import UPLOAD_DIRECTORY
+from . import previews, versions, volumes
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+_executor = None
+_scheduled = threading.Event()
+
+
+def derived_files(name):
+    """
+    Paths of the files made from the file name, i.e. its previews.
+    """
+    return glob.glob(glob.escape(os.path.join(settings.MEDIA_ROOT, name)) + ".v*")
+
+
+def remove_files(name):
+    default_storage.delete(name)
+    for path in derived_files(name):
+        os.remove(path)
+
+
+def process(batch_size=BATCH_SIZE):
+    """
+    Remove the files of the journal, a batch at a time.
+    Files a page uses again are kept. Failures stay in the journal.
+    Returns the number of entries processed and failed.
+    """
+    FileCleanup = apps.get_model("books", "FileCleanup")
+    Page = apps.get_model("books", "Page")
+    processed = failed = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            entries = list(
+                FileCleanup.objects.select_for_update()
+                .filter(pk__gt=last_pk)
+                .order_by("pk")[:batch_size]
+            )
+            if not entries:
+                break
+            last_pk = entries[-1].pk
+            names = {entry.name for entry in entries}
+            in_use = set(
+                Page.objects.filter(Q(scanned_text__in=names) | Q(typed_text__in=names))
+                .values_list("scanned_text", "typed_text")
+                .iterator()
+            )
+            in_use = {name for pair in in_use for name in pair}
+            done, errors = [], []
+            for entry in entries:
+                try:
+                    if entry.name not in in_use:
+                        remove_files(entry.name)
+                except OSError as e:
+                    entry.attempts += 1
+                    entry.last_error = str(e)
+                    errors.append(entry)
+                else:
+                    done.append(entry.pk)
+            FileCleanup.objects.filter(pk__in=done).delete()
+            FileCleanup.objects.bulk_update(errors, ["attempts", "last_error"])
+        processed += len(done)
+        failed += len(errors)
+    return processed, failed
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1)
+    return _executor
+
+
+def _run():
+    _scheduled.clear()
+    try:
+        process()
+    except Exception:
+        logger.exception("Removing the files of deleted pages failed")
+    finally:
+        connections.close_all()
+
+
+def schedule():
+    """
+    Process the journal in the background once the current transaction
+    commits. Deleting many pages schedules a single run.
+    """
+    if not getattr(settings, "MEDIA_CLEANUP_ON_COMMIT", True):
+        return
+
+    def submit():
+        if not _scheduled.is_set():
+            _scheduled.set()
+            get_executor().submit(_run)
+
+    transaction.on_commit(submit)
+
+
+def _scan(directory, root):
+    """
+    Names and modification times of the files under directory.
+    """
+    files = []
+    for path, directories, names in os.walk(directory):
+        for file in names:
+            full_path = os.path.join(path, file)
+            try:
+                mtime = os.lstat(full_path).st_mtime
+            except FileNotFoundError:
+                continue
+            name = os.path.relpath(full_path, root).replace(os.sep, "/")
+            files.append((name, mtime))
+    return files
+
+
+def is_in_flight(name):
+    """
+    Whether name is a file still being written: a temporary file of the
+    storage or the uploads, or a preview being rendered.
+    """
+    return os.path.basename(name).startswith(TEMPORARY_PREFIX) or name.endswith(".part")
+
+
+def orphans(min_age=STALE_TEMPORARY_AGE, workers=8):
+    """
+    Names of the files of MEDIA_ROOT no page refers to, scanning the
+    directories of volumes in parallel. Files younger than min_age seconds
+    are left alone, as their page may not be saved yet, and files being
+    written younger than STALE_TEMPORARY_AGE whatever min_age is.
+    """
+    Page = apps.get_model("books", "Page")
+    root = settings.MEDIA_ROOT
+    # uploads in progress are expired by the expire_uploads command, and
+    # merged volumes replaced by their next build
+    skipped = {
+        BLOB_DIRECTORY,
+        UPLOAD_DIRECTORY,
+        versions.VERSIONS_DIRECTORY,
+        volumes.VOLUME_DIRECTORY,
+    }
+    directories = [
+        entry.path for entry in os.scandir(root)
+        if entry.is_dir(follow_symlinks=False) and entry.name not in skipped
+    ] if os.path.isdir(root) else []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        scans = list(executor.map(lambda d: _scan(d, root), directories))
+
+    referenced = set()
+    for scanned, typed in Page.objects.values_list("scanned_text", "typed_text").iterator():
+        referenced.add(scanned or typed)
+    now = time.time()
+    cutoff = now - min_age
+    in_flight_cutoff = now - max(min_age, STALE_TEMPORARY_AGE)
+    found = []
+    for files in scans:
+        for name, mtime in files:
+            if mtime > (in_flight_cutoff if is_in_flight(name) else cutoff):
+                continue
+            if (previews.source_name(name) or name) not in referenced:
+                found.append(name)
+    return sorted(found)
@@ -0,0 +1,167 @@
+"""
+Streaming ZIP downloads of the files of a volume or a range of its pages.
+
+The archive is written while it is sent: entries are stored, not
+compressed, since PDFs hardly compress, and each file is read and passed on
+in CHUNK_SIZE pieces. Nothing is written to disk and the memory used does
+not grow with the size of the archive. As the output cannot seek, the sizes
+and checksums of the entries follow their data in data descriptors.
+
+A download holds a worker for as long as the client reads, so at most
+PAGE_DOWNLOAD_CONCURRENCY of them run at once in each process; further
+requests are turned away until one ends.
+"""
+import logging
+import os
+import threading
+import time
+import zipfile
+
+from django.conf import settings
+
+from core.files import CHUNK_SIZE
+from .models import page_file_name
+
+
+logger = logging.getLogger(__name__)
+
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+_active = 0
+_lock = threading.Lock()
+
+
+def acquire():
+    """
+    Take a download slot, if one is free.
+    """
+    global _active
+    with _lock:
+        if _active >= settings.PAGE_DOWNLOAD_CONCURRENCY:
+            return False
+        _active += 1
+        return True
+
+
+def release():
+    global _active
+    with _lock:
+        _active = max(_active - 1, 0)
+
+
+class _Output:
+    """
+    The unseekable file the archive is written to, collecting the bytes
+    until they are sent.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self.parts:
+            data, self.parts = b"".join(self.parts), []
+            yield data
+
+
+def entries(pages):
+    """
+    (file name, entry name) of the files of pages, in the order of the
+    pages. Entries are named like the files of the pages, which is also
+    what the bulk upload expects.
+    """
+    rows = pages.order_by("volume_no", "page_no", "type").values_list(
+        "volume_no", "page_no", "type", "scanned_text", "typed_text"
+    )
+    result = []
+    for volume_no, page_no, type, scanned, typed in rows:
+        name = scanned or typed
+        suffix = os.path.splitext(name)[1]
+        entry_name = page_file_name(volume_no, page_no, type, suffix)
+        result.append((name, os.path.basename(entry_name)))
+    return result
+
+
+def archive_name(volume_no, page_ranges=()):
+    """
+    volume_<volume_no>.zip, or volume_<volume_no>_pages_<ranges>.zip
+    """
+    if not page_ranges:
+        return f"volume_{volume_no}.zip"
+    ranges = "_".join(
+        str(start) if start == end else f"{start}-{end}"
+        for start, end in page_ranges
+    )
+    return f"volume_{volume_no}_pages_{ranges}.zip"
+
+
+def zip_stream(entries, chunk_size=CHUNK_SIZE):
+    """
+    Yield a ZIP archive of the (file name, entry name) entries, with file
+    names relative to MEDIA_ROOT. Files removed since they were listed are
+    left out.
+    """
+    output = _Output()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED) as archive:
+        for name, entry_name in entries:
+            try:
+                f = open(os.path.join(settings.MEDIA_ROOT, name), "rb")
+            except FileNotFoundError:
+                logger.warning("Left %s out of a download, it is missing", name)
+                continue
+            with f:
+                stat = os.fstat(f.fileno())
+                info = zipfile.ZipInfo(
+                    entry_name,
+                    # ZIP dates start in 1980
+                    date_time=max(time.localtime(stat.st_mtime)[:6], ZIP_EPOCH),
+                )
+                info.compress_type = zipfile.ZIP_STORED
+                info.file_size = stat.st_size
+                info.external_attr = 0o644 << 16
+                with archive.open(info, "w") as entry:
+                    while chunk := f.read(chunk_size):
+                        entry.write(chunk)
+                        yield from output.drain()
+            # the data descriptor
+            yield from output.drain()
+    # the central directory
+    yield from output.drain()
+
+
+class LimitedStream:
+    """
+    A stream holding a download slot, given back when the response is
+    closed, whether or not the stream was read to the end.
+    """
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.released = False
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            close = getattr(self.iterable, "close", None)
+            if close is not None:
+                close()
+        finally:
+            if not self.released:
+                self.released = True
+                release()
+
+
+def download_pages(pages):
+    """
+    The stream of the archive of pages, holding a slot taken with acquire().
+    """
+    return LimitedStream(zip_stream(entries(pages)))
@@ -1,5 +1,4 @@
 from crispy_forms.helper import FormHelper
-from django.db.models import Exists, OuterRef
 from django_filters import CharFilter, ChoiceFilter, FilterSet
 from django import forms
 
@@ -9,7 +8,7 @@ from .models import Page
 
 class PageFilterUser(FilterSet):
 
-    page_no = PageRangeFilter(lookup_expr="in")
+    page_no = PageRangeFilter()
 
     class Meta:
         model = Page
@@ -26,12 +25,8 @@ class PageFilterUser(FilterSet):
 
     @property
     def qs(self):
-        # return super().qs.distinct("volume_no", "page_no")
-        parent = super().qs
-        typed = parent.filter(type=Page.TYPE_TYPED)
-        scanned = parent.filter(type=Page.TYPE_SCANNED)
-        duplicates = typed.annotate(is_duplicate=Exists(scanned.filter(page_no=OuterRef("page_no"), volume_no=OuterRef("volume_no"))))
-        return scanned | duplicates.filter(is_duplicate=False)
+        # readers see the scanned version of a page if it exists
+        return super().qs.filter(is_reader_canonical=True)
 
 
 class PageFilterStaff(PageFilterUser):
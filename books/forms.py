@@ -1,10 +1,15 @@
-from django.forms import ModelForm, FileField, FileInput
+import zipfile
+
+from django.core.validators import FileExtensionValidator
+from django.forms import CharField, FileField, FileInput, Form, ModelForm, Textarea, ValidationError
 
 from .models import Page
 from core.widgets import FileValueInput
 
 
 class PageForm(ModelForm):
+    # set by the admin: files are then sent in resumable chunks
+    upload_url = None
 
     class Meta:
         model = Page
@@ -13,7 +18,11 @@ class PageForm(ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields["comments"].widget.attrs["placeholder"] = "Please describe the reason for the upload"
-        self.fields["scanned_text"].widget = self.fields["typed_text"].widget = FileValueInput()
+        attrs = {}
+        if self.upload_url:
+            attrs = {"data-upload-url": self.upload_url, "data-page": self.instance.pk or ""}
+        for field in ["scanned_text", "typed_text"]:
+            self.fields[field].widget = FileValueInput(attrs=attrs)
         if self.instance.pk:
             disabled_file_field = (
                 "typed_text" if self.instance.type == Page.TYPE_SCANNED
@@ -34,3 +43,24 @@ class PageForm(ModelForm):
             page._change_reason = "No change."
         page.save()
         return page
+
+
+class BulkUploadForm(Form):
+    archive = FileField(
+        label="ZIP archive",
+        validators=[FileExtensionValidator(["zip"])],
+        help_text="Files named like volume_3_page_12_scanned.pdf or volume_3_page_12_typed.pdf."
+        " Pages that already exist get a new version.",
+    )
+    comments = CharField(
+        required=False,
+        widget=Textarea(attrs={"rows": 2, "placeholder": "Please describe the reason for the upload"}),
+    )
+
+    def clean_archive(self):
+        archive = self.cleaned_data["archive"]
+        try:
+            self.cleaned_data["zip"] = zipfile.ZipFile(archive)
+        except zipfile.BadZipFile:
+            raise ValidationError("The file is not a ZIP archive.", code="invalid")
+        return archive
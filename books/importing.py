@@ -0,0 +1,381 @@
+"""
+Bulk import of pages from a manifest.
+
+A manifest lists one page version per row, either as CSV with a header
+
+    volume,page,type,file
+    1,1,scanned,scans/volume_1/0001.pdf
+
+or as NDJSON with the same keys. Relative file paths are resolved from the
+directory of the manifest.
+
+Rows are read lazily and imported in batches: the files are checked by
+worker processes with the validators of the model, copied to
+MEDIA_ROOT/.uploads by a pool of threads, and saved through the file
+storage in the transaction that inserts the pages and their history rows
+with a few bulk queries. Pages that already exist are skipped before any
+work is done on them, so an interrupted import resumes by running it again.
+
+Bulk inserts bypass the model signals: the navigation index has to be
+rebuilt afterwards, and the previews and search text backfilled with the
+render_previews and index_pages commands.
+
+ZIP archives of files named like volume_<v>_page_<p>_scanned.pdf are
+imported by import_zip, for the bulk upload of the admin. Entries are
+streamed one at a time to MEDIA_ROOT/.uploads by a pool of threads, which
+validate them there, and moved into place when the pages are saved. Pages
+that already exist get a new version; only the navigation index of the
+volumes that got new pages is rebuilt.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import json
+import os
+from pathlib import Path
+import re
+import shutil
+import tempfile
+import zipfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from core.files import CHUNK_SIZE
+from core.storage import TEMPORARY_PREFIX
+from core.uploadhandlers import StoredUploadedFile, UPLOAD_DIRECTORY
+from core.validators import FileValidator
+from . import cache, navigation, previews, search, versions, volumes
+from .models import Page, page_file_name
+
+
+TYPES = {"typed": Page.TYPE_TYPED, "scanned": Page.TYPE_SCANNED}
+FILE_FIELDS = {Page.TYPE_TYPED: "typed_text", Page.TYPE_SCANNED: "scanned_text"}
+
+ImportRow = namedtuple(
+    "ImportRow", ["line", "volume_no", "page_no", "type", "source", "error"]
+)
+
+ENTRY_NAME_RE = re.compile(
+    r"(?:^|/)volume_(?P<volume>\d+)_page_(?P<page>\d+)_(?P<type>scanned|typed)\.pdf$",
+    re.IGNORECASE,
+)
+
+# outcomes of the entries of a ZIP archive
+CREATED, UPDATED, FAILED = "created", "updated", "failed"
+
+EntryResult = namedtuple("EntryResult", ["name", "status", "message", "page"])
+
+
+def manifest_format(path):
+    return "csv" if Path(path).suffix.lower() == ".csv" else "ndjson"
+
+
+def read_manifest(path, format=None):
+    """
+    Yield the rows of a manifest, one at a time.
+    """
+    path = Path(path)
+    base_dir = path.parent
+    format = format or manifest_format(path)
+    with open(path, newline="", encoding="utf-8") as f:
+        if format == "csv":
+            reader = csv.DictReader(f)
+            for values in reader:
+                yield parse_row(reader.line_num, values, base_dir)
+        else:
+            for line, text in enumerate(f, 1):
+                if not text.strip():
+                    continue
+                try:
+                    values = json.loads(text)
+                except ValueError as e:
+                    yield ImportRow(line, None, None, None, None, f"Invalid JSON: {e}")
+                    continue
+                yield parse_row(line, values, base_dir)
+
+
+def parse_row(line, values, base_dir):
+    """
+    Check the fields of a row that do not need the file.
+    """
+    def error(message):
+        return ImportRow(line, None, None, None, None, message)
+
+    if not isinstance(values, dict):
+        return error("A row must be an object.")
+    missing = [key for key in ("volume", "page", "type", "file") if not values.get(key)]
+    if missing:
+        return error("Missing " + ", ".join(missing) + ".")
+    try:
+        volume_no = int(values["volume"])
+        page_no = int(values["page"])
+        Page._meta.get_field("volume_no").run_validators(volume_no)
+    except ValueError:
+        return error("The volume and page numbers must be integers.")
+    except ValidationError as e:
+        return error(" ".join(e.messages))
+    type = TYPES.get(str(values["type"]).strip().lower())
+    if type is None:
+        return error("The type must be typed or scanned.")
+    source = base_dir / values["file"]
+    return ImportRow(line, volume_no, page_no, type, str(source), None)
+
+
+def check_file(source, type):
+    """
+    Run the validators of the file field of the page type on a file.
+    Runs in worker processes; returns an error message or None, and the
+    SHA-256 of the file computed by the validators.
+    """
+    field = Page._meta.get_field(FILE_FIELDS[type])
+    try:
+        with open(source, "rb") as f:
+            file = File(f, name=source)
+            field.run_validators(file)
+    except OSError as e:
+        return str(e), None
+    except ValidationError as e:
+        return " ".join(e.messages), None
+    return None, file.sha256
+
+
+def copy_file(source):
+    """
+    Copy a file to a temporary file under MEDIA_ROOT, to be saved from
+    there. Runs in worker threads; returns an error message or None, and
+    the temporary file.
+    """
+    directory = os.path.join(settings.MEDIA_ROOT, UPLOAD_DIRECTORY)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=directory, prefix=TEMPORARY_PREFIX, suffix=".pdf")
+    except OSError as e:
+        return str(e), None
+    try:
+        with open(fd, "wb") as target, open(source, "rb") as f:
+            shutil.copyfileobj(f, target, CHUNK_SIZE)
+    except OSError as e:
+        os.remove(path)
+        return str(e), None
+    return None, path
+
+
+def import_batch(rows, executor, copier, change_reason=None, chunksize=16):
+    """
+    Import a batch of rows. Validation runs on the process pool executor
+    and copying on the thread pool copier.
+    Returns the number of pages imported and skipped, and the errors as
+    (line, message) pairs.
+    """
+    errors = [(row.line, row.error) for row in rows if row.error]
+    rows = [row for row in rows if not row.error]
+    existing = set(
+        Page.objects.filter(
+            volume_no__in={row.volume_no for row in rows},
+            page_no__in={row.page_no for row in rows},
+        ).values_list("volume_no", "page_no", "type")
+    )
+    new_rows = {}
+    skipped = 0
+    for row in rows:
+        key = (row.volume_no, row.page_no, row.type)
+        if key in existing:
+            skipped += 1
+        elif key in new_rows:
+            errors.append((row.line, f"Duplicate of line {new_rows[key].line}."))
+        else:
+            new_rows[key] = row
+    rows = list(new_rows.values())
+
+    checks = executor.map(
+        check_file,
+        [row.source for row in rows],
+        [row.type for row in rows],
+        chunksize=chunksize,
+    )
+    valid, digests = [], []
+    for row, (error, digest) in zip(rows, checks):
+        if error:
+            errors.append((row.line, error))
+        else:
+            valid.append(row)
+            digests.append(digest)
+
+    copies = list(copier.map(copy_file, [row.source for row in valid]))
+    pages = []
+    try:
+        with transaction.atomic():
+            for row, digest, (error, path) in zip(valid, digests, copies):
+                if error:
+                    errors.append((row.line, error))
+                    continue
+                name = page_file_name(
+                    row.volume_no, row.page_no, row.type, Path(row.source).suffix
+                )
+                try:
+                    with StoredUploadedFile(path, os.path.basename(row.source)) as file:
+                        file.sha256 = digest
+                        name = default_storage.save(name, file)
+                except OSError as e:
+                    errors.append((row.line, str(e)))
+                    continue
+                pages.append(
+                    Page(
+                        volume_no=row.volume_no,
+                        page_no=row.page_no,
+                        type=row.type,
+                        version_no=1,
+                        sha256=digest,
+                        **{FILE_FIELDS[row.type]: name},
+                    )
+                )
+            bulk_create_with_history(pages, Page, default_change_reason=change_reason)
+    finally:
+        # saved files are moved or copied into place by the storage
+        for _, path in copies:
+            if path and os.path.exists(path):
+                os.remove(path)
+    return len(pages), skipped, sorted(errors)
+
+
+def read_zip(archive):
+    """
+    Yield a row for every file of a ZIP archive, numbered from 1.
+    """
+    files = (info for info in archive.infolist() if not info.is_dir())
+    for line, info in enumerate(files, 1):
+        match = ENTRY_NAME_RE.search(info.filename)
+        if match is None:
+            yield ImportRow(
+                line, None, None, None, info.filename,
+                "The name must be like volume_<v>_page_<p>_scanned.pdf"
+                " or volume_<v>_page_<p>_typed.pdf.",
+            )
+            continue
+        values = dict(match.groupdict(), file=info.filename)
+        row = parse_row(line, values, Path())
+        yield row._replace(source=info.filename)
+
+
+def extract_entry(archive, row):
+    """
+    Stream an entry of the archive to a temporary file under MEDIA_ROOT
+    and run the validators of its field on it. Runs in worker threads;
+    returns an error message or None, the temporary file and its SHA-256.
+    """
+    field = Page._meta.get_field(FILE_FIELDS[row.type])
+    info = archive.getinfo(row.source)
+    for validator in field.validators:
+        if isinstance(validator, FileValidator) and validator.max_size is not None:
+            if info.file_size > validator.max_size:
+                return validator.size_error(info.file_size).messages[0], None, None
+    directory = os.path.join(settings.MEDIA_ROOT, UPLOAD_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, prefix=TEMPORARY_PREFIX, suffix=".pdf")
+    try:
+        with open(fd, "wb") as target, archive.open(info) as source:
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+        with open(path, "rb") as f:
+            file = File(f, name=path)
+            field.run_validators(file)
+    except (OSError, ValidationError, zipfile.BadZipFile) as e:
+        os.remove(path)
+        if isinstance(e, ValidationError):
+            return " ".join(e.messages), None, None
+        return str(e), None, None
+    return None, path, file.sha256
+
+
+def import_zip(archive, user=None, comments="", workers=4):
+    """
+    Create or update the pages of the files of a ZIP archive, in a single
+    transaction. Returns an EntryResult for every file of the archive.
+    """
+    results = {}
+    rows = []
+    seen = {}
+    for row in read_zip(archive):
+        key = (row.volume_no, row.page_no, row.type)
+        if row.error:
+            results[row.line] = EntryResult(row.source, FAILED, row.error, None)
+        elif key in seen:
+            results[row.line] = EntryResult(
+                row.source, FAILED, f"Duplicate of {seen[key].source}.", None
+            )
+        else:
+            seen[key] = row
+            rows.append(row)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        extracted = list(executor.map(lambda row: extract_entry(archive, row), rows))
+
+    existing = {
+        navigation.navigation_key(page): page
+        for page in Page.objects.filter(
+            volume_no__in={row.volume_no for row in rows},
+            page_no__in={row.page_no for row in rows},
+        )
+    }
+    created, updated = [], []
+    try:
+        with transaction.atomic():
+            for row, (error, path, digest) in zip(rows, extracted):
+                if error:
+                    results[row.line] = EntryResult(row.source, FAILED, error, None)
+                    continue
+                key = (row.volume_no, row.page_no, row.type)
+                field = FILE_FIELDS[row.type]
+                page = existing.get(key)
+                if page is None:
+                    page = Page(volume_no=row.volume_no, page_no=row.page_no, type=row.type)
+                else:
+                    versions.archive_on_commit(getattr(page, field).name, page.version_no)
+                page.version_no += 1
+                name = page_file_name(row.volume_no, row.page_no, row.type, ".pdf")
+                try:
+                    with StoredUploadedFile(path, os.path.basename(row.source)) as file:
+                        name = default_storage.save(name, file)
+                except OSError as e:
+                    results[row.line] = EntryResult(row.source, FAILED, str(e), None)
+                    continue
+                setattr(page, field, name)
+                page.sha256 = digest
+                page.checksum_verified = None
+                page._change_reason = f"Upload {page.version_no}" + (
+                    f": {comments}" if comments else ""
+                )
+                if page.pk is None:
+                    created.append(page)
+                else:
+                    updated.append(page)
+                results[row.line] = EntryResult(
+                    row.source, CREATED if page.pk is None else UPDATED, "", page
+                )
+
+            bulk_create_with_history(created, Page, default_user=user)
+            bulk_update_with_history(
+                updated,
+                Page,
+                ["scanned_text", "typed_text", "version_no", "sha256", "checksum_verified"],
+                default_user=user,
+            )
+            if created:
+                navigation.rebuild(Page, volumes={page.volume_no for page in created})
+            for page in created + updated:
+                previews.schedule(page)
+                search.schedule(page)
+            for volume_no in {page.volume_no for page in created + updated}:
+                volumes.schedule(volume_no)
+            cache.invalidate()
+    finally:
+        # saved files are moved or copied into place by the storage; remove
+        # what is left, e.g. when saving failed
+        for _, path, _ in extracted:
+            if path and os.path.exists(path):
+                os.remove(path)
+    return [results[line] for line in sorted(results)]
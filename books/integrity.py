@@ -0,0 +1,103 @@
+"""
+Integrity checks of the page files, run by the verify_media command.
+
+Every file is hashed in one streaming pass and compared with the checksum
+stored with its page. A file is reported as
+
+missing
+    when the page has no file on disk,
+corrupt
+    when it is not a whole PDF,
+mismatch
+    when its content differs from the stored checksum,
+orphaned
+    when no page refers to it.
+
+Files whose page has no checksum yet get theirs recorded. Pages whose file
+matches are marked as verified; in incremental mode, files that were not
+modified since are not read again.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+
+from core.files import inspect_pdf
+from . import cleanup
+
+
+BATCH_SIZE = 500
+
+MISSING = "missing"
+CORRUPT = "corrupt"
+MISMATCH = "mismatch"
+ORPHANED = "orphaned"
+RECORDED = "recorded"
+VERIFIED = "verified"
+SKIPPED = "skipped"
+
+PROBLEMS = (MISSING, CORRUPT, MISMATCH, ORPHANED)
+
+
+def check_page(row, incremental=False):
+    """
+    Check the file of a page, given as a
+    (pk, scanned_text, typed_text, sha256, checksum_verified) row.
+    Returns the status and the result to report.
+    """
+    pk, scanned_text, typed_text, expected, verified = row
+    name = typed_text or scanned_text
+    result = {"page": pk, "name": name}
+    try:
+        stat = os.stat(os.path.join(settings.MEDIA_ROOT, name))
+    except OSError:
+        return MISSING, result
+    # the change time also covers files whose modification time was kept
+    if incremental and verified and max(stat.st_mtime, stat.st_ctime) < verified.timestamp():
+        return SKIPPED, result
+    digest, is_pdf = inspect_pdf(os.path.join(settings.MEDIA_ROOT, name))
+    result["sha256"] = digest
+    if not is_pdf:
+        return CORRUPT, result
+    if not expected:
+        return RECORDED, result
+    if digest != expected:
+        result["expected"] = expected
+        return MISMATCH, result
+    return VERIFIED, result
+
+
+def verify(incremental=False, workers=None, batch_size=BATCH_SIZE):
+    """
+    Check every page file and look for orphaned files.
+    Yields (status, result) pairs, and stores the recorded checksums and
+    the verification dates.
+    """
+    Page = apps.get_model("books", "Page")
+    started = timezone.now()
+    rows = (
+        Page.objects.exclude(scanned_text="", typed_text="")
+        .order_by("pk")
+        .values_list("pk", "scanned_text", "typed_text", "sha256", "checksum_verified")
+        .iterator(chunk_size=batch_size)
+    )
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        while batch := list(islice(rows, batch_size)):
+            verified, recorded = [], []
+            for status, result in executor.map(
+                lambda row: check_page(row, incremental), batch
+            ):
+                if status == VERIFIED:
+                    verified.append(result["page"])
+                elif status == RECORDED:
+                    recorded.append(
+                        Page(pk=result["page"], sha256=result["sha256"], checksum_verified=started)
+                    )
+                yield status, result
+            Page.objects.filter(pk__in=verified).update(checksum_verified=started)
+            Page.objects.bulk_update(recorded, ["sha256", "checksum_verified"])
+    for name in cleanup.orphans(min_age=0, workers=workers or os.cpu_count()):
+        yield ORPHANED, {"name": name}
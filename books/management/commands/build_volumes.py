@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import volumes
+from ...models import Page, VolumeBuild
+
+
+class Command(BaseCommand):
+    help = "Build the merged PDFs of volumes whose pages changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "volumes", nargs="*", type=int,
+            help="The volumes to build, all of them by default.",
+        )
+
+    def handle(self, *args, **options):
+        if not volumes.is_available():
+            raise CommandError("pdfunite is not installed; install poppler-utils.")
+        volume_numbers = options["volumes"] or sorted(
+            set(Page.objects.values_list("volume_no", flat=True))
+            | set(VolumeBuild.objects.values_list("volume_no", flat=True))
+        )
+        failed = 0
+        for volume_no in volume_numbers:
+            # builds that failed before are tried again
+            record = volumes.build(volume_no, force=True)
+            if record is None:
+                self.stdout.write(f"Volume {volume_no}: no pages.")
+            elif record.status == VolumeBuild.STATUS_FAILED:
+                failed += 1
+                self.stderr.write(f"Volume {volume_no}: {record.error}")
+            else:
+                self.stdout.write(
+                    f"Volume {volume_no}: {record.pages} pages in {record.chunks} chunks."
+                )
+        self.stdout.write(
+            self.style.SUCCESS(f"Built {len(volume_numbers) - failed} volumes, {failed} failed.")
+        )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from ... import cache
+
+
+class Command(BaseCommand):
+    help = "Show the hits and misses of the cached page lookups."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true",
+            help="Set the counters back to zero after showing them.",
+        )
+
+    def handle(self, *args, **options):
+        for prefix, counts in cache.stats().items():
+            lookups = counts["hits"] + counts["misses"]
+            ratio = counts["hits"] / lookups if lookups else 0
+            self.stdout.write(
+                f"{prefix}: {counts['hits']} hits, {counts['misses']} misses "
+                f"({ratio:.0%} hit rate)"
+            )
+        if options["reset"]:
+            cache.reset_stats()
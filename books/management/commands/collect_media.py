@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from core.storage import STALE_TEMPORARY_AGE
+from ... import cleanup
+
+
+class Command(BaseCommand):
+    help = "Remove the files of MEDIA_ROOT that no page refers to."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only list the orphaned files.",
+        )
+        parser.add_argument(
+            "--min-age", type=int, default=STALE_TEMPORARY_AGE,
+            help="Leave files younger than this many seconds alone.",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=8,
+            help="Number of threads scanning and deleting files.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Scan the volume directories in parallel against the names of the
+        page files. Previews count as used while their page file is.
+        """
+        orphans = cleanup.orphans(options["min_age"], options["workers"])
+        for name in orphans:
+            self.stdout.write(name)
+        if options["dry_run"]:
+            self.stdout.write(self.style.SUCCESS(f"Found {len(orphans)} orphaned files."))
+            return
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            list(executor.map(default_storage.delete, orphans))
+        collected = 0
+        if hasattr(default_storage, "collect_garbage"):
+            collected = default_storage.collect_garbage()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Removed {len(orphans)} orphaned files and {collected} unused blobs."
+            )
+        )
@@ -0,0 +1,53 @@
+from concurrent.futures import as_completed, ProcessPoolExecutor
+import os
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from ... import versions
+from ...models import Page
+
+
+class Command(BaseCommand):
+    help = "Compress the files of earlier page versions and delete the expired ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep", type=int, default=None,
+            help="Versions of each file to keep, PAGE_VERSIONS_KEEP by default.",
+        )
+        parser.add_argument(
+            "--max-age", type=int, default=None,
+            help="Days to keep replaced versions, PAGE_VERSIONS_MAX_AGE by default.",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=None,
+            help="Number of processes compressing files, the number of CPUs by default.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Run periodically, e.g. from cron. Expired versions are deleted
+        first, then the retained ones compressed in parallel.
+        """
+        remove, retain = versions.expired(
+            Page.history, options["keep"], options["max_age"]
+        )
+        for path in remove:
+            os.remove(path)
+        saved = failed = 0
+        uncompressed = [path for path in retain if not path.endswith(".gz")]
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            futures = {executor.submit(versions.compress, path): path for path in uncompressed}
+            for future in as_completed(futures):
+                try:
+                    saved += future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{futures[future]}: {e}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Deleted {len(remove)} expired versions, compressed {len(uncompressed) - failed} "
+                f"saving {filesizeformat(max(saved, 0))}, {failed} failed."
+            )
+        )
@@ -0,0 +1,87 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from core.files import sha256_file
+from core.storage import BLOB_DIRECTORY, ContentAddressedStorage, TEMPORARY_PREFIX
+from core.uploadhandlers import UPLOAD_DIRECTORY
+from ... import versions, volumes
+
+
+# files that are written in place or replaced by their own commands
+SKIPPED_DIRECTORIES = {
+    BLOB_DIRECTORY,
+    UPLOAD_DIRECTORY,
+    versions.VERSIONS_DIRECTORY,
+    volumes.VOLUME_DIRECTORY,
+}
+
+
+class Command(BaseCommand):
+    help = "Convert MEDIA_ROOT in place to content-addressed, deduplicated storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all", action="store_true",
+            help="Also hash the files that are already linked to a blob.",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Only report the space that would be freed.",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=None,
+            help="Number of processes hashing files, the number of CPUs by default.",
+        )
+
+    def files(self, storage, include_linked):
+        for directory, directories, files in os.walk(storage.location):
+            if directory == storage.location:
+                directories[:] = [d for d in directories if d not in SKIPPED_DIRECTORIES]
+            for file in files:
+                if file.startswith(TEMPORARY_PREFIX):
+                    continue
+                path = os.path.join(directory, file)
+                stat = os.lstat(path)
+                if os.path.stat.S_ISREG(stat.st_mode) and (
+                    include_linked or stat.st_nlink == 1
+                ):
+                    yield path, stat.st_size
+
+    def handle(self, *args, **options):
+        """
+        Hash the files in parallel, then make each one a hard link to the
+        blob of its content: the first copy of a content becomes its blob
+        without being copied, and the other copies are replaced with links
+        to it. Every replacement is atomic, so the tree stays servable
+        during the conversion, and the command can be run again at any
+        time, e.g. after import_pages.
+        """
+        storage = ContentAddressedStorage()
+        files = list(self.files(storage, options["all"]))
+        seen = set()
+        converted = freed = 0
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            digests = executor.map(sha256_file, [path for path, _ in files], chunksize=32)
+            for (path, size), digest in zip(files, digests):
+                if options["dry_run"]:
+                    blob = storage.blob_path(digest)
+                    if digest in seen or (
+                        os.path.exists(blob) and not os.path.samefile(blob, path)
+                    ):
+                        freed += size
+                    seen.add(digest)
+                else:
+                    freed += storage.adopt(path, digest)
+                converted += 1
+        if options["dry_run"]:
+            message = f"Checked {converted} files, {filesizeformat(freed)} can be freed."
+        else:
+            collected = storage.collect_garbage()
+            message = (
+                f"Converted {converted} files, {filesizeformat(freed)} freed, "
+                f"{collected} unused blobs removed."
+            )
+        self.stdout.write(self.style.SUCCESS(message))
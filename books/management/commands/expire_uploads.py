@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ... import uploads
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove the resumable page uploads not continued for"
+        " PAGE_UPLOAD_EXPIRY hours, and the files of interrupted uploads."
+    )
+
+    def handle(self, *args, **options):
+        removed = uploads.expire()
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} uploads."))
@@ -0,0 +1,87 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+import os
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import cache, importing, navigation
+from ...models import Page
+
+
+class Command(BaseCommand):
+    help = "Import pages and their files from a CSV or NDJSON manifest."
+
+    def add_arguments(self, parser):
+        parser.add_argument("manifest", help="Path of the manifest.")
+        parser.add_argument(
+            "--format", choices=("csv", "ndjson"),
+            help="Format of the manifest, guessed from its extension by default.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--workers", type=int, default=None,
+            help="Number of processes validating files, the number of CPUs by default.",
+        )
+        parser.add_argument(
+            "--copy-threads", type=int, default=8,
+            help="Number of threads copying files to MEDIA_ROOT/.uploads.",
+        )
+        parser.add_argument(
+            "--change-reason", default="Imported",
+            help="Change reason of the history rows.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Import the manifest in batches and rebuild the navigation index of
+        the volumes with new pages. Pages that already exist are skipped, so
+        an interrupted import is resumed by running the command again.
+        """
+        if not os.path.isfile(options["manifest"]):
+            raise CommandError(f"No manifest at {options['manifest']}.")
+        rows = importing.read_manifest(options["manifest"], options["format"])
+
+        imported = skipped = failed = 0
+        start = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=options["workers"], initializer=django.setup
+        ) as executor, ThreadPoolExecutor(options["copy_threads"]) as copier:
+            batch = list(islice(rows, options["batch_size"]))
+            while batch:
+                done, already, errors = importing.import_batch(
+                    batch, executor, copier, options["change_reason"]
+                )
+                imported += done
+                skipped += already
+                failed += len(errors)
+                for line, message in errors:
+                    self.stderr.write(f"Line {line}: {message}")
+                rate = (imported + skipped + failed) / (time.perf_counter() - start)
+                self.stdout.write(
+                    f"{imported} imported, {skipped} skipped, {failed} failed ({rate:.0f} rows/s)"
+                )
+                batch = list(islice(rows, options["batch_size"]))
+
+        # pages imported by this run, or by one interrupted before it got
+        # here, have no place in the navigation index yet
+        unnumbered = set(
+            Page.objects.filter(staff_order__isnull=True).values_list("volume_no", flat=True)
+        )
+        if unnumbered:
+            navigation.rebuild(Page, volumes=unnumbered)
+            cache.invalidate()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {imported} pages in {elapsed:.1f}s "
+                f"({imported / elapsed if elapsed else 0:.0f} pages/s), "
+                f"{skipped} already there, {failed} failed."
+            )
+        )
+        if imported:
+            self.stdout.write(
+                "Run render_previews, index_pages and build_volumes to backfill"
+                " the previews, the search text and the merged volumes."
+            )
@@ -0,0 +1,66 @@
+from concurrent.futures import as_completed, ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+
+from ... import search
+from ...models import Page, PageText
+
+
+class Command(BaseCommand):
+    help = "Extract the text of typed pages for the full-text search."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--volume", type=int, help="Only index this volume.")
+        parser.add_argument(
+            "--all", action="store_true",
+            help="Extract the text of every page, not only the new and changed ones.",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=None,
+            help="Number of worker processes, the number of CPUs by default.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Extract the text in parallel and store it from this process.
+        Pages whose text comes from their current version are skipped
+        unless --all is given.
+        """
+        if not search.is_available():
+            raise CommandError("pdftotext is not installed; install poppler-utils.")
+        stale = PageText.objects.exclude(page__type=Page.TYPE_TYPED)
+        pages = Page.objects.filter(type=Page.TYPE_TYPED).exclude(typed_text="")
+        if options["volume"]:
+            stale = stale.filter(page__volume_no=options["volume"])
+            pages = pages.filter(volume_no=options["volume"])
+        if not options["all"]:
+            pages = pages.filter(
+                Q(text__isnull=True) | ~Q(text__version_no=F("version_no"))
+            )
+        removed, _ = stale.delete()
+
+        indexed = failed = 0
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            futures = {
+                executor.submit(search.extract_text, page.typed_text.path): page
+                for page in pages.only("type", "version_no", "typed_text").iterator()
+            }
+            for future in as_completed(futures):
+                page = futures[future]
+                try:
+                    content = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{page}: {e}")
+                    continue
+                PageText.objects.update_or_create(
+                    page=page,
+                    defaults={"version_no": page.version_no, "content": content},
+                )
+                indexed += 1
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {indexed} pages, removed {removed} stale texts, {failed} failed."
+            )
+        )
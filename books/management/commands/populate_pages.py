@@ -1,20 +1,18 @@
 from random import sample
 from itertools import product
+import json
 import os
-from PIL import Image
 import tempfile
 
 from django.conf import settings
-from django.core.files import File
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 
-from ...models import Page
-
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
         """
-        Populate the basic database with pages.
+        Populate the basic database with pages, through import_pages.
         """
         if not settings.DEBUG:
             raise AssertionError("Do not run this on Production!")
@@ -24,39 +22,24 @@ class Command(BaseCommand):
         page_typed_sample = sample(sample_space,250)
         page_scanned_sample = sample(sample_space, 250)
 
-        with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
-            wrapped_file = File(f)
-            # 25 pages with both scanned and typed text
-            for i in range(0, 25):
-                Page.objects.create(
-                    page_no=i+1,
-                    volume_no=1,
-                    type=Page.TYPE_TYPED,
-                    typed_text=wrapped_file,
-                    version_no=1
-                )
-                Page.objects.create(
-                    page_no=i+1,
-                    volume_no=1,
-                    type=Page.TYPE_SCANNED,
-                    scanned_text=wrapped_file,
-                    version_no=1
-                )
-            # 250 random pages with typed text
-            for page_no, volume_no in page_typed_sample:
-                Page.objects.create(
-                    page_no=page_no,
-                    volume_no=volume_no,
-                    type=Page.TYPE_TYPED,
-                    typed_text=wrapped_file,
-                    version_no=1
-                )
-            # 250 random pages with scanned text
-            for page_no, volume_no in page_scanned_sample:
-                Page.objects.create(
-                    page_no=page_no,
-                    volume_no=volume_no,
-                    type=Page.TYPE_SCANNED,
-                    scanned_text=wrapped_file,
-                    version_no=1
-                )
+        source = os.path.abspath("pcdl_docs/test_pdf.pdf")
+        rows = []
+        # 25 pages with both scanned and typed text
+        for i in range(0, 25):
+            rows.append((1, i+1, "typed"))
+            rows.append((1, i+1, "scanned"))
+        # 250 random pages with typed text
+        for page_no, volume_no in page_typed_sample:
+            rows.append((volume_no, page_no, "typed"))
+        # 250 random pages with scanned text
+        for page_no, volume_no in page_scanned_sample:
+            rows.append((volume_no, page_no, "scanned"))
+
+        with tempfile.TemporaryDirectory() as directory:
+            manifest = os.path.join(directory, "pages.ndjson")
+            with open(manifest, "w") as f:
+                for volume_no, page_no, type in rows:
+                    f.write(json.dumps(
+                        {"volume": volume_no, "page": page_no, "type": type, "file": source}
+                    ) + "\n")
+            call_command("import_pages", manifest, stdout=self.stdout, stderr=self.stderr)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from ... import cleanup
+
+
+class Command(BaseCommand):
+    help = "Remove the files of deleted pages queued in the cleanup journal."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=cleanup.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        """
+        Process the journal, e.g. from cron when MEDIA_CLEANUP_ON_COMMIT is
+        off, or to retry the files that could not be removed.
+        """
+        processed, failed = cleanup.process(options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Removed the files of {processed} pages, {failed} failed.")
+        )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ... import navigation
+from ...models import Page
+
+
+class Command(BaseCommand):
+    help = "Renumber the reading order used for next/previous page navigation."
+
+    def handle(self, *args, **options):
+        """
+        Rebuild the navigation index, e.g. after pages were bulk imported.
+        """
+        count = navigation.rebuild(Page)
+        self.stdout.write(self.style.SUCCESS(f"Reindexed {count} pages."))
@@ -0,0 +1,47 @@
+from concurrent.futures import as_completed, ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import previews
+from ...models import Page
+
+
+class Command(BaseCommand):
+    help = "Render the missing thumbnails and previews of pages."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--volume", type=int, help="Only render this volume.")
+        parser.add_argument(
+            "--workers", type=int, default=None,
+            help="Number of worker processes, the number of CPUs by default.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Backfill the previews of the library in parallel. Pages with
+        previews of their current version are skipped by the workers.
+        """
+        if not previews.is_available():
+            raise CommandError("pdftoppm is not installed; install poppler-utils.")
+        pages = Page.objects.only("type", "version_no", "scanned_text", "typed_text")
+        if options["volume"]:
+            pages = pages.filter(volume_no=options["volume"])
+
+        rendered = failed = 0
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            futures = {
+                executor.submit(previews.render, *previews.render_arguments(page)): page
+                for page in pages.iterator()
+                if previews.page_file(page)
+            }
+            for future in as_completed(futures):
+                try:
+                    rendered += future.result() > 0
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{futures[future]}: {e}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rendered previews of {rendered} pages, {len(futures) - rendered - failed} up to date, {failed} failed."
+            )
+        )
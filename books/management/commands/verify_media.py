@@ -0,0 +1,43 @@
+from collections import Counter
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import integrity
+
+
+class Command(BaseCommand):
+    help = "Check the page files against their checksums and report problems as JSON lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--incremental", action="store_true",
+            help="Only read the files modified since they were last verified.",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=None,
+            help="Number of threads hashing files, the number of CPUs by default.",
+        )
+        parser.add_argument(
+            "--report-all", action="store_true",
+            help="Also report the files that are fine.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Write one JSON object per problem, e.g.
+        {"status": "mismatch", "page": 12, "name": "...", "sha256": "...", "expected": "..."}
+        and a summary object last. Exits with an error when files are
+        missing, corrupt or mismatched.
+        """
+        counts = Counter()
+        for status, result in integrity.verify(options["incremental"], options["workers"]):
+            counts[status] += 1
+            if status in integrity.PROBLEMS or options["report_all"]:
+                self.stdout.write(json.dumps({"status": status, **result}))
+        self.stdout.write(json.dumps({"status": "summary", **counts}))
+        failures = sum(
+            counts[status] for status in (integrity.MISSING, integrity.CORRUPT, integrity.MISMATCH)
+        )
+        if failures:
+            raise CommandError(f"{failures} page files failed verification.")
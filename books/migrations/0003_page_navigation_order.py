@@ -0,0 +1,52 @@
+# Generated by Django 4.0.4 on 2026-10-18 02:18
+
+from django.db import migrations, models
+
+
+
+def build_navigation_order(apps, schema_editor):
+    """
+    Number the pages in reading order, as books.navigation.rebuild did when
+    this migration was written.
+    """
+    Page = apps.get_model("books", "Page")
+    changed = []
+    staff_order = reader_order = 0
+    key = None
+    rows = Page.objects.order_by("volume_no", "page_no", "type").only(
+        "pk", "volume_no", "page_no", "type", "staff_order", "reader_order"
+    )
+    for page in rows.iterator(chunk_size=1000):
+        if (page.volume_no, page.page_no) != key:
+            key = (page.volume_no, page.page_no)
+            reader_order += 1
+        staff_order += 1
+        page.staff_order = staff_order
+        page.reader_order = reader_order
+        changed.append(page)
+        if len(changed) >= 1000:
+            Page.objects.bulk_update(changed, ["staff_order", "reader_order"])
+            changed = []
+    if changed:
+        Page.objects.bulk_update(changed, ["staff_order", "reader_order"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_alter_page_options_alter_historicalpage_scanned_text_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='reader_order',
+            field=models.PositiveIntegerField(db_index=True, editable=False, help_text='Position of the page in the reading order seen by readers.', null=True),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='staff_order',
+            field=models.PositiveIntegerField(db_index=True, editable=False, help_text='Position of the page in the reading order seen by staff.', null=True),
+        ),
+        migrations.RunPython(build_navigation_order, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.0.4 on 2026-10-18 02:21
+
+from django.db import migrations, models
+
+
+
+def flag_reader_pages(apps, schema_editor):
+    """
+    Flag the version of every page readers see: the scanned one if it
+    exists and the typed one otherwise.
+    """
+    Page = apps.get_model("books", "Page")
+    scanned = Page.objects.filter(
+        volume_no=models.OuterRef("volume_no"),
+        page_no=models.OuterRef("page_no"),
+        type="Scanned",
+    )
+    Page.objects.filter(type="Scanned").update(is_reader_canonical=True)
+    Page.objects.filter(type="Typed").exclude(models.Exists(scanned)).update(
+        is_reader_canonical=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_page_navigation_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='is_reader_canonical',
+            field=models.BooleanField(default=False, editable=False, help_text='Whether this is the version of the page shown to readers.'),
+        ),
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(fields=['is_reader_canonical', 'volume_no', 'page_no'], name='books_page_reader_idx'),
+        ),
+        migrations.RunPython(flag_reader_pages, migrations.RunPython.noop),
+    ]
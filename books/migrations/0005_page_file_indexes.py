@@ -0,0 +1,21 @@
+# Generated by Django 4.0.4 on 2026-10-18 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_page_is_reader_canonical'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(fields=['scanned_text'], name='books_page_scanned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(fields=['typed_text'], name='books_page_typed_idx'),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 4.0.4 on 2026-10-18 02:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+SQLITE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE books_pagetext_fts USING fts5(
+        content, content='books_pagetext', content_rowid='page_id'
+    )
+    """,
+    """
+    CREATE TRIGGER books_pagetext_fts_insert AFTER INSERT ON books_pagetext BEGIN
+        INSERT INTO books_pagetext_fts(rowid, content) VALUES (new.page_id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER books_pagetext_fts_delete AFTER DELETE ON books_pagetext BEGIN
+        INSERT INTO books_pagetext_fts(books_pagetext_fts, rowid, content)
+        VALUES ('delete', old.page_id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER books_pagetext_fts_update AFTER UPDATE ON books_pagetext BEGIN
+        INSERT INTO books_pagetext_fts(books_pagetext_fts, rowid, content)
+        VALUES ('delete', old.page_id, old.content);
+        INSERT INTO books_pagetext_fts(rowid, content) VALUES (new.page_id, new.content);
+    END
+    """,
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER books_pagetext_fts_update",
+    "DROP TRIGGER books_pagetext_fts_delete",
+    "DROP TRIGGER books_pagetext_fts_insert",
+    "DROP TABLE books_pagetext_fts",
+]
+
+POSTGRESQL_INDEX = [
+    """
+    ALTER TABLE books_pagetext ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED
+    """,
+    "CREATE INDEX books_pagetext_search_idx ON books_pagetext USING GIN (search_vector)",
+]
+
+POSTGRESQL_DROP = [
+    "DROP INDEX books_pagetext_search_idx",
+    "ALTER TABLE books_pagetext DROP COLUMN search_vector",
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+create_search_index = run_for_vendor(
+    {"sqlite": SQLITE_INDEX, "postgresql": POSTGRESQL_INDEX}
+)
+drop_search_index = run_for_vendor(
+    {"sqlite": SQLITE_DROP, "postgresql": POSTGRESQL_DROP}
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_page_file_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageText',
+            fields=[
+                ('page', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='text', serialize=False, to='books.page')),
+                ('version_no', models.PositiveIntegerField(help_text='The version of the page the text was extracted from.', verbose_name='version number')),
+                ('content', models.TextField(blank=True)),
+            ],
+        ),
+        # full-text index: FTS5 on SQLite, a tsvector column on PostgreSQL
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
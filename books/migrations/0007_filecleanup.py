@@ -0,0 +1,23 @@
+# Generated by Django 4.0.4 on 2026-10-18 02:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_pagetext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileCleanup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+        ),
+    ]
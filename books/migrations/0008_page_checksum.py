@@ -0,0 +1,28 @@
+# Generated by Django 4.0.4 on 2026-10-18 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_filecleanup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalpage',
+            name='sha256',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 of the file, checked by verify_media.', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='checksum_verified',
+            field=models.DateTimeField(editable=False, help_text='When the file was last found to match its checksum.', null=True),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='sha256',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 of the file, checked by verify_media.', max_length=64),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.4 on 2026-10-18 03:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0008_page_checksum'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('field', models.CharField(choices=[('scanned_text', 'Scanned text'), ('typed_text', 'Typed text')], max_length=20)),
+                ('filename', models.CharField(max_length=255)),
+                ('length', models.PositiveIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.4 on 2026-10-18 03:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_pageupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VolumeBuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('volume_no', models.PositiveIntegerField(unique=True, verbose_name='volume number')),
+                ('status', models.CharField(choices=[('building', 'Building'), ('ready', 'Ready'), ('failed', 'Failed')], max_length=10)),
+                ('key', models.CharField(blank=True, help_text='Identifies the page versions of the build.', max_length=64)),
+                ('name', models.CharField(blank=True, help_text='The merged PDF of the latest completed build.', max_length=255)),
+                ('pages', models.PositiveIntegerField(default=0)),
+                ('chunks', models.PositiveIntegerField(default=0)),
+                ('chunks_built', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.0.4 on 2026-10-18 03:22
+
+from django.db import migrations, models
+
+ORDER_STEP = 1024
+
+VOLUME_SPAN = 2 ** 32
+
+
+def renumber_sparsely(apps, schema_editor):
+    """
+    Number the pages of each volume ORDER_STEP apart, within the range of
+    ordinals of the volume, as books.navigation.rebuild does.
+    """
+    Page = apps.get_model("books", "Page")
+    changed = []
+    staff_order = reader_order = 0
+    key = None
+    rows = Page.objects.order_by("volume_no", "page_no", "type").only(
+        "pk", "volume_no", "page_no", "type", "staff_order", "reader_order"
+    )
+    for page in rows.iterator(chunk_size=1000):
+        start = page.volume_no * VOLUME_SPAN
+        if staff_order < start:
+            staff_order = reader_order = start
+        if (page.volume_no, page.page_no) != key:
+            key = (page.volume_no, page.page_no)
+            reader_order += ORDER_STEP
+        staff_order += ORDER_STEP
+        page.staff_order = staff_order
+        page.reader_order = reader_order
+        changed.append(page)
+        if len(changed) >= 1000:
+            Page.objects.bulk_update(changed, ["staff_order", "reader_order"])
+            changed = []
+    if changed:
+        Page.objects.bulk_update(changed, ["staff_order", "reader_order"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_volumebuild'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='page',
+            name='reader_order',
+            field=models.PositiveBigIntegerField(db_index=True, editable=False, help_text='Position of the page in the reading order seen by readers.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='page',
+            name='staff_order',
+            field=models.PositiveBigIntegerField(db_index=True, editable=False, help_text='Position of the page in the reading order seen by staff.', null=True),
+        ),
+        migrations.RunPython(renumber_sparsely, migrations.RunPython.noop),
+    ]
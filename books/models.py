@@ -1,5 +1,6 @@
 from pathlib import Path
-import os
+import hashlib
+import uuid
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
@@ -11,6 +12,21 @@ from django.utils.html import mark_safe
 from simple_history.models import HistoricalRecords
 
 from core.validators import FileValidator
+from . import cache, cleanup, navigation, previews, search, versions, volumes
+
+
+def page_file_name(volume_no, page_no, type, suffix):
+    """
+    volume_<volume_no>/page_<page_no>/volume_<volume_no>_page_<page_no>_<type>.<extension>
+    """
+    return "volume_{}/page_{}/volume_{}_page_{}_{}{}".format(
+        volume_no,
+        page_no,
+        volume_no,
+        page_no,
+        "typed" if type == Page.TYPE_TYPED else "scanned",
+        suffix,
+    )
 
 
 def media_directory_path(instance, filename):
@@ -18,21 +34,22 @@ def media_directory_path(instance, filename):
     file will be uploaded to MEDIA_ROOT/volume_<volume_no>/page_<page_no>/
     volume_<volume_no>_page_<page_no>text.<extension>
     """
-    volume = instance.volume_no
-    page = instance.page_no
-
-    media_path = "volume_{}/page_{}/volume_{}_page_{}_{}{}".format(
-        volume,
-        page,
-        volume,
-        page,
-        "typed" if instance.type == instance.TYPE_TYPED else "scanned",
+    # the storage replaces the existing file once the upload is committed
+    return page_file_name(
+        instance.volume_no,
+        instance.page_no,
+        instance.type,
         Path(filename).suffix,
     )
-    root_path = settings.MEDIA_ROOT + media_path
-    if os.path.isfile(root_path):
-        os.remove(root_path)
-    return media_path
+
+
+class PageQuerySet(models.QuerySet):
+
+    def get_with_neighbours(self, volume_no, page_no, type=None, is_staff=False):
+        """
+        Return the (previous, page, next) pages in a single query.
+        """
+        return navigation.resolve(self, volume_no, page_no, type, is_staff)
 
 
 class Page(models.Model):
@@ -98,11 +115,58 @@ class Page(models.Model):
         ]
     )
     comments = models.TextField(blank=True)
-    history = HistoricalRecords()
+    staff_order = models.PositiveBigIntegerField(
+        help_text="Position of the page in the reading order seen by staff.",
+        null=True,
+        editable=False,
+        db_index=True,
+    )
+    reader_order = models.PositiveBigIntegerField(
+        help_text="Position of the page in the reading order seen by readers.",
+        null=True,
+        editable=False,
+        db_index=True,
+    )
+    is_reader_canonical = models.BooleanField(
+        help_text="Whether this is the version of the page shown to readers.",
+        default=False,
+        editable=False,
+    )
+    sha256 = models.CharField(
+        help_text="SHA-256 of the file, checked by verify_media.",
+        max_length=64,
+        blank=True,
+        editable=False,
+    )
+    checksum_verified = models.DateTimeField(
+        help_text="When the file was last found to match its checksum.",
+        null=True,
+        editable=False,
+    )
+    history = HistoricalRecords(
+        excluded_fields=navigation.NAVIGATION_FIELDS + ("checksum_verified",)
+    )
+
+    objects = PageQuerySet.as_manager()
 
 
     class Meta:
         ordering = ["volume_no", "page_no", "type"]
+        indexes = [
+            models.Index(
+                fields=["is_reader_canonical", "volume_no", "page_no"],
+                name="%(app_label)s_%(class)s_reader_idx",
+            ),
+            # files are looked up by name when served
+            models.Index(
+                fields=["scanned_text"],
+                name="%(app_label)s_%(class)s_scanned_idx",
+            ),
+            models.Index(
+                fields=["typed_text"],
+                name="%(app_label)s_%(class)s_typed_idx",
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['volume_no', 'page_no', 'type'],
@@ -162,55 +226,207 @@ class Page(models.Model):
     def get_absolute_url(self):
         return reverse("page_detail", args=[str(self.volume_no), str(self.page_no), self.type])
 
+    def file_url(self):
+        return previews.page_file(self).url
+
+    def preview_url(self):
+        return previews.preview_url(self, "preview")
+
+    def thumbnail_url(self):
+        return previews.preview_url(self, "thumbnail")
 
     def find_next_page(self, is_staff=False):
         """
         skip typed text for regular users if a scanned version exists
         """
-        if is_staff and self.type == self.TYPE_SCANNED:
-            same_page = Page.objects.filter(volume_no=self.volume_no, page_no=self.page_no, type=self.TYPE_TYPED).first()
-            if same_page:
-                return same_page
-        next_page_same_volume = Page.objects.filter(volume_no=self.volume_no, page_no__gt=self.page_no).first()
-        next_page_other_volume =  Page.objects.filter(volume_no__gt=self.volume_no).first()
-        return (
-            next_page_same_volume if next_page_same_volume
-            else next_page_other_volume if next_page_other_volume
-            else None
-        )
+        return navigation.find_adjacent(Page.objects.all(), self, is_staff, forward=True)
 
     def find_previous_page(self, is_staff=False):
         """
         skip typed text for regular users if a scanned version exists
         """
-        if is_staff and self.type == self.TYPE_TYPED:
-            same_page = Page.objects.filter(volume_no=self.volume_no, page_no=self.page_no, type=self.TYPE_SCANNED).first()
-            if same_page:
-                return same_page
-        previous_page_same_volume = Page.objects.filter(volume_no=self.volume_no, page_no__lt=self.page_no)
-        previous_page_other_volume =  Page.objects.filter(volume_no__lt=self.volume_no)
-        if is_staff:
-            return (
-                previous_page_same_volume.last() if previous_page_same_volume
-                else previous_page_other_volume.last() if previous_page_other_volume
-                else None
-            )
-        else:
-            return (
-                previous_page_same_volume.order_by("volume_no", "page_no", "-type").last() if previous_page_same_volume
-                else previous_page_other_volume.order_by("volume_no", "page_no", "-type").last() if previous_page_other_volume
-                else None
-            )
+        return navigation.find_adjacent(Page.objects.all(), self, is_staff, forward=False)
+
+
+class PageText(models.Model):
+    """
+    Text extracted from the file of a page, for the full-text search.
+    """
+    page = models.OneToOneField(
+        Page,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="text",
+    )
+    version_no = models.PositiveIntegerField(
+        help_text="The version of the page the text was extracted from.",
+        verbose_name="version number",
+    )
+    content = models.TextField(blank=True)
+
+    def __str__(self):
+        return "Text of " + str(self.page)
+
+
+class FileCleanup(models.Model):
+    """
+    Journal of the files of deleted pages, removed after the deletion
+    commits (see books.cleanup).
+    """
+    name = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.name
 
 
-@receiver(models.signals.pre_delete, sender=Page)
-def my_handler(sender, **kwargs):
-    instance = kwargs['instance']
-    path = (
-        instance.typed_text.name if instance.type == instance.TYPE_TYPED
-            else instance.scanned_text.name
+class PageUpload(models.Model):
+    """
+    A resumable upload of a page file, whose bytes are kept under
+    MEDIA_ROOT until it is finalized (see books.uploads).
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    field = models.CharField(
+        max_length=20,
+        choices=[("scanned_text", "Scanned text"), ("typed_text", "Typed text")],
     )
-    dir = settings.MEDIA_ROOT + os.path.split(path)[0]
-    if os.path.isdir(dir):
-        for file in os.listdir(dir):
-            os.remove(os.path.join(dir, file))
+    filename = models.CharField(max_length=255)
+    length = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.filename
+
+
+class VolumeBuild(models.Model):
+    """
+    The merged PDF of a volume, in reading order, and the state of its
+    latest build (see books.volumes).
+    """
+    STATUS_BUILDING = "building"
+    STATUS_READY = "ready"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_BUILDING, "Building"),
+        (STATUS_READY, "Ready"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    volume_no = models.PositiveIntegerField(unique=True, verbose_name="volume number")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    key = models.CharField(
+        help_text="Identifies the page versions of the build.",
+        max_length=64,
+        blank=True,
+    )
+    name = models.CharField(
+        help_text="The merged PDF of the latest completed build.",
+        max_length=255,
+        blank=True,
+    )
+    pages = models.PositiveIntegerField(default=0)
+    chunks = models.PositiveIntegerField(default=0)
+    chunks_built = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return "Volume " + str(self.volume_no)
+
+
+@receiver(models.signals.pre_save, sender=Page)
+def remember_previous_version(sender, instance, raw=False, **kwargs):
+    """
+    Remember where the page was, and keep its file if a new one replaces it.
+    """
+    if raw or instance.pk is None:
+        instance._previous_navigation_key = None
+        return
+    previous = sender.objects.filter(pk=instance.pk).values(
+        "volume_no", "page_no", "type", "version_no", "scanned_text", "typed_text"
+    ).first()
+    if previous is None:
+        instance._previous_navigation_key = None
+        return
+    instance._previous_navigation_key = (
+        previous["volume_no"], previous["page_no"], previous["type"]
+    )
+    if previous["version_no"] != instance.version_no:
+        # registered before the new file is saved, so that its link to the
+        # old file is made before the storage replaces it on commit
+        versions.archive_on_commit(
+            previous["typed_text"] or previous["scanned_text"],
+            previous["version_no"],
+        )
+
+
+@receiver(models.signals.pre_save, sender=Page)
+def record_checksum(sender, instance, raw=False, **kwargs):
+    """
+    Store the checksum of a new file, computed by its validator if it was
+    validated and in one pass over its chunks otherwise.
+    """
+    file = instance.typed_text or instance.scanned_text
+    if raw or not file or file._committed:
+        return
+    digest = getattr(file, "sha256", None) or getattr(file.file, "sha256", None)
+    if digest is None:
+        digest = hashlib.sha256()
+        for chunk in file.chunks():
+            digest.update(chunk)
+        file.seek(0)
+        digest = digest.hexdigest()
+    instance.sha256 = digest
+    instance.checksum_verified = None
+
+
+@receiver(models.signals.post_save, sender=Page)
+def update_navigation(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous_key = getattr(instance, "_previous_navigation_key", None)
+    if created or previous_key != navigation.navigation_key(instance):
+        navigation.place_page(instance, previous_key)
+    cache.invalidate()
+
+
+@receiver(models.signals.post_save, sender=Page)
+def render_previews(sender, instance, raw=False, **kwargs):
+    if not raw:
+        previews.schedule(instance)
+
+
+@receiver(models.signals.post_save, sender=Page)
+def index_text(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.schedule(instance)
+
+
+@receiver(models.signals.post_save, sender=Page)
+def build_volume(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    volumes.schedule(instance.volume_no)
+    previous_key = getattr(instance, "_previous_navigation_key", None)
+    if previous_key and previous_key[0] != instance.volume_no:
+        volumes.schedule(previous_key[0])
+
+
+@receiver(models.signals.post_delete, sender=Page)
+def update_reader_canonical(sender, instance, **kwargs):
+    navigation.update_reader_canonical(sender, instance.volume_no, instance.page_no)
+    cache.invalidate()
+    volumes.schedule(instance.volume_no)
+
+
+@receiver(models.signals.post_delete, sender=Page)
+def queue_file_cleanup(sender, instance, **kwargs):
+    name = instance.typed_text.name or instance.scanned_text.name
+    if name:
+        FileCleanup.objects.create(name=name)
+        cleanup.schedule()
@@ -0,0 +1,269 @@
+"""
+Reading-order navigation index for pages.
+
+Every page keeps two ordinals, so that finding its neighbours is a single
+indexed lookup instead of a series of range queries:
+
+staff_order
+    position of the page in the sequence seen by staff, where the scanned
+    and the typed version of a page are both visible.
+reader_order
+    position of the (volume, page) pair in the sequence seen by readers.
+    The scanned and the typed version of a page share it.
+
+Readers are shown a single version of every page, the scanned one if it
+exists and the typed one otherwise. That version is flagged with
+is_reader_canonical.
+
+Ordinals are sparse and kept per volume: the pages of volume v are numbered
+within [v * VOLUME_SPAN, (v + 1) * VOLUME_SPAN), ORDER_STEP apart after a
+rebuild. Deleting a page leaves a gap, and a new page takes an ordinal in
+the gap between its neighbours. Only when there is none left are the pages
+of its volume renumbered; other volumes are never touched.
+"""
+from django.db import transaction
+from django.db.models import Count, Q, Subquery
+
+
+NAVIGATION_FIELDS = ("staff_order", "reader_order", "is_reader_canonical")
+
+ORDER_STEP = 1024
+
+VOLUME_SPAN = 2 ** 32
+
+
+def navigation_key(page):
+    return (page.volume_no, page.page_no, page.type)
+
+
+def _before(page):
+    """
+    Q object matching the pages that come before the given page.
+    """
+    return (
+        Q(volume_no__lt=page.volume_no)
+        | Q(volume_no=page.volume_no, page_no__lt=page.page_no)
+        | Q(volume_no=page.volume_no, page_no=page.page_no, type__lt=page.type)
+    )
+
+
+def _free_ordinal(volume_no, previous, following, field):
+    """
+    An unused ordinal between the previous and the following page in the
+    volume, either of which may be None, or None if there is no gap left.
+    """
+    start = volume_no * VOLUME_SPAN
+    low = previous[field] if previous else start
+    high = following[field] if following else start + VOLUME_SPAN
+    if low is None or high is None:
+        # numbered by neither the signals nor a rebuild yet
+        return None
+    if not following and low + ORDER_STEP < high:
+        return low + ORDER_STEP
+    ordinal = (low + high) // 2
+    return ordinal if ordinal > low else None
+
+
+def _reader_version(pages):
+    """
+    The version of a page shown to readers, among the given versions.
+    """
+    by_type = {page.type: page for page in pages}
+    return by_type.get("Scanned") or by_type.get("Typed")
+
+
+def update_reader_canonical(model, volume_no, page_no):
+    """
+    Flag the version of a page that readers see.
+    """
+    versions = model.objects.filter(volume_no=volume_no, page_no=page_no)
+    canonical = _reader_version(versions.only("pk", "type"))
+    versions.filter(is_reader_canonical=True).exclude(
+        pk=getattr(canonical, "pk", None)
+    ).update(is_reader_canonical=False)
+    if canonical is not None:
+        versions.filter(pk=canonical.pk).update(is_reader_canonical=True)
+
+
+def place_page(page, previous_key=None):
+    """
+    Give a saved page its ordinals in both sequences.
+    previous_key is the (volume, page, type) the page had before, if any.
+    """
+    model = page.__class__
+    with transaction.atomic():
+        volume = model.objects.filter(volume_no=page.volume_no).exclude(pk=page.pk)
+        previous = (
+            volume.filter(_before(page))
+            .order_by("-page_no", "-type")
+            .values("staff_order", "reader_order")
+            .first()
+        )
+        following = (
+            volume.exclude(_before(page))
+            .order_by("page_no", "type")
+            .values("staff_order", "reader_order")
+            .first()
+        )
+        staff_order = _free_ordinal(page.volume_no, previous, following, "staff_order")
+
+        sibling = (
+            volume.filter(page_no=page.page_no)
+            .values_list("reader_order", flat=True)
+            .first()
+        )
+        if sibling is not None:
+            reader_order = sibling
+        else:
+            reader_order = _free_ordinal(
+                page.volume_no, previous, following, "reader_order"
+            )
+
+        if staff_order is None or reader_order is None:
+            rebuild(model, volumes=[page.volume_no])
+            staff_order, reader_order = model.objects.filter(pk=page.pk).values_list(
+                "staff_order", "reader_order"
+            ).get()
+        else:
+            model.objects.filter(pk=page.pk).update(
+                staff_order=staff_order, reader_order=reader_order
+            )
+            update_reader_canonical(model, page.volume_no, page.page_no)
+        if previous_key and previous_key[:2] != (page.volume_no, page.page_no):
+            update_reader_canonical(model, *previous_key[:2])
+    page.staff_order = staff_order
+    page.reader_order = reader_order
+    page.is_reader_canonical = (
+        model.objects.filter(pk=page.pk, is_reader_canonical=True).exists()
+    )
+
+
+def rebuild(model, batch_size=1000, volumes=None):
+    """
+    Renumber the pages of the given volumes, or of every volume, from
+    scratch. Used after bulk writes, which bypass the model signals, and
+    when a volume runs out of gaps. Returns the number of pages renumbered.
+    """
+    fields = [
+        field for field in NAVIGATION_FIELDS
+        if any(f.name == field for f in model._meta.fields)
+    ]
+    pages = model.objects.all()
+    if volumes is not None:
+        pages = pages.filter(volume_no__in=volumes)
+    # a volume holds VOLUME_SPAN // ORDER_STEP pages before its pages are
+    # packed closer
+    steps = {
+        volume_no: min(ORDER_STEP, VOLUME_SPAN // (count + 1))
+        for volume_no, count in pages.order_by()
+        .values_list("volume_no")
+        .annotate(Count("pk"))
+    }
+    changed = []
+    count = staff_order = reader_order = 0
+
+    def renumber(versions):
+        nonlocal count, staff_order, reader_order
+        volume_no = versions[0].volume_no
+        start, step = volume_no * VOLUME_SPAN, steps[volume_no]
+        if staff_order < start:
+            staff_order = reader_order = start
+        reader_order += step
+        canonical = _reader_version(versions)
+        for page in versions:
+            count += 1
+            staff_order += step
+            values = {
+                "staff_order": staff_order,
+                "reader_order": reader_order,
+                "is_reader_canonical": page is canonical,
+            }
+            if all(getattr(page, field) == values[field] for field in fields):
+                continue
+            for field in fields:
+                setattr(page, field, values[field])
+            changed.append(page)
+
+    rows = (
+        pages.order_by("volume_no", "page_no", "type")
+        .only("pk", "volume_no", "page_no", "type", *fields)
+        .iterator(chunk_size=batch_size)
+    )
+    with transaction.atomic():
+        versions = []
+        for page in rows:
+            if versions and (page.volume_no, page.page_no) != (
+                versions[0].volume_no, versions[0].page_no
+            ):
+                renumber(versions)
+                versions = []
+                if len(changed) >= batch_size:
+                    model.objects.bulk_update(changed, fields)
+                    changed = []
+            versions.append(page)
+        if versions:
+            renumber(versions)
+        if changed:
+            model.objects.bulk_update(changed, fields)
+    return count
+
+
+def _adjacent_pk(queryset, field, target_order, forward):
+    lookup = field + ("__gt" if forward else "__lt")
+    return Subquery(
+        queryset.filter(**{lookup: Subquery(target_order)})
+        .order_by(field if forward else "-" + field)
+        .values("pk")[:1]
+    )
+
+
+def find_adjacent(queryset, page, is_staff=False, forward=True):
+    """
+    The page before or after the given one, in a single query.
+    """
+    field = "staff_order" if is_staff else "reader_order"
+    if not is_staff:
+        queryset = queryset.filter(is_reader_canonical=True)
+    current = queryset.model.objects.filter(pk=page.pk).values(field)
+    return queryset.filter(pk=_adjacent_pk(queryset, field, current, forward)).first()
+
+
+def resolve(queryset, volume_no, page_no, type=None, is_staff=False):
+    """
+    Fetch a page together with its previous and next page in one query.
+
+    Staff get the page of the exact type; readers get the scanned version
+    if there is one and the typed one otherwise.
+    Returns a (previous, page, next) tuple, with None for missing pages.
+    """
+    model = queryset.model
+    field = "staff_order" if is_staff else "reader_order"
+    candidates = model.objects.filter(volume_no=volume_no, page_no=page_no)
+    if is_staff:
+        candidates = candidates.filter(type=type)
+    else:
+        queryset = queryset.filter(is_reader_canonical=True)
+        candidates = candidates.filter(is_reader_canonical=True)
+    target_order = candidates.values(field)[:1]
+
+    rows = list(
+        queryset.filter(
+            Q(pk=Subquery(candidates.values("pk")[:1]))
+            | Q(pk=_adjacent_pk(queryset, field, target_order, True))
+            | Q(pk=_adjacent_pk(queryset, field, target_order, False))
+        )
+    )
+    page = next(
+        (
+            row for row in rows
+            if (row.volume_no, row.page_no) == (int(volume_no), int(page_no))
+            and (not is_staff or row.type == type)
+        ),
+        None,
+    )
+    if page is None:
+        return None, None, None
+    position = getattr(page, field)
+    previous_page = next((row for row in rows if getattr(row, field) < position), None)
+    next_page = next((row for row in rows if getattr(row, field) > position), None)
+    return previous_page, page, next_page
@@ -0,0 +1,169 @@
+from django.core import signing
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django_tables2.rows import BoundRows
+
+from . import cache
+
+
+COUNT_TIMEOUT = 60 * 60
+
+
+class LazyPage(Page):
+    """
+    A page whose truth value does not fetch its rows, so that the table
+    template can test it when the rendered rows come from the cache.
+    """
+
+    def __bool__(self):
+        return True
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator that keeps the total number of objects in the page cache.
+    count_key identifies the result set, e.g. the user role and the filters.
+    """
+
+    def __init__(self, object_list, per_page, count_key=None, **kwargs):
+        self.count_key = count_key
+        super().__init__(object_list, per_page, **kwargs)
+
+    @cached_property
+    def count(self):
+        if self.count_key is None:
+            return Paginator.count.func(self)
+        return cache.get_or_set(
+            cache.make_key("count", self.count_key),
+            lambda: Paginator.count.func(self),
+            timeout=COUNT_TIMEOUT,
+        )
+
+    def _get_page(self, *args, **kwargs):
+        return LazyPage(*args, **kwargs)
+
+
+# Orderings that can be paginated with a cursor, as the table sort parameter
+# and the index-backed key they are paginated on.
+CURSOR_ORDERINGS = {
+    None: ("volume_no", "page_no", "type"),
+    "volume_no": ("volume_no", "page_no", "type"),
+    "-volume_no": ("-volume_no", "-page_no", "-type"),
+}
+
+CURSOR_SALT = "books.pagination.cursor"
+
+
+def _reverse(ordering):
+    return tuple(field[1:] if field.startswith("-") else "-" + field for field in ordering)
+
+
+def _after(ordering, values):
+    """
+    Q object matching the rows that come after values in the given ordering.
+    """
+    query = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip("-")
+        lookup = "__lt" if field.startswith("-") else "__gt"
+        equal = {f.lstrip("-"): v for f, v in zip(ordering[:i], values[:i])}
+        query |= Q(**equal, **{name + lookup: values[i]})
+    # redundant bound on the leading field, so the index is range scanned
+    first = ordering[0]
+    lookup = "__lte" if first.startswith("-") else "__gte"
+    return Q(**{first.lstrip("-") + lookup: values[0]}) & query
+
+
+class CursorPage:
+    """
+    A page of rows, linking to the pages around it with opaque cursors
+    instead of page numbers.
+    """
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class CursorPaginator(CachedCountPaginator):
+    """
+    Keyset pagination: pages start after the key of the last row of the
+    previous page, so deep pages cost the same as the first one instead of
+    an ever larger OFFSET.
+
+    object_list must be the BoundRows of a table backed by a queryset, and
+    sort one of the CURSOR_ORDERINGS.
+    """
+
+    def __init__(self, object_list, per_page, sort=None, cursor=None, **kwargs):
+        self.sort = sort
+        self.ordering = CURSOR_ORDERINGS[sort]
+        self.cursor = cursor
+        super().__init__(object_list, per_page, **kwargs)
+
+    @classmethod
+    def supports(cls, sort):
+        return sort in CURSOR_ORDERINGS
+
+    def make_cursor(self, record, backwards=False):
+        key = [getattr(record, field.lstrip("-")) for field in self.ordering]
+        return signing.dumps(
+            {"sort": self.sort, "key": key, "backwards": backwards},
+            salt=CURSOR_SALT,
+        )
+
+    def read_cursor(self):
+        """
+        The key and direction of the cursor, or None to start from the top.
+        Cursors from another sort order are ignored.
+        """
+        if not self.cursor:
+            return None
+        try:
+            cursor = signing.loads(self.cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            return None
+        if cursor.get("sort") != self.sort:
+            return None
+        return cursor["key"], cursor["backwards"]
+
+    def page(self, number=None):
+        queryset = self.object_list.data.data
+        cursor = self.read_cursor()
+        ordering = self.ordering
+        if cursor is not None:
+            key, backwards = cursor
+            if backwards:
+                ordering = _reverse(ordering)
+            queryset = queryset.filter(_after(ordering, key))
+        else:
+            backwards = False
+        records = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(records) > self.per_page
+        records = records[:self.per_page]
+        if backwards:
+            records.reverse()
+
+        next_cursor = previous_cursor = None
+        if records:
+            if has_more or backwards:
+                next_cursor = self.make_cursor(records[-1])
+            if cursor is not None and (has_more or not backwards):
+                previous_cursor = self.make_cursor(records[0], backwards=True)
+        rows = BoundRows(records, self.object_list.table)
+        return CursorPage(list(rows), self, next_cursor, previous_cursor)
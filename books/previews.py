@@ -0,0 +1,174 @@
+"""
+Thumbnails and previews of the first page of page files.
+
+pdftoppm (poppler-utils) renders the first page of the PDF, and Pillow
+scales it down and encodes it. Rendering runs in a process pool once the
+upload is committed. Previews are stored next to the file and named after
+the version of the page, so they are only rendered again when a new version
+is uploaded, e.g. for the thumbnail of version 2:
+
+    volume_3/page_7/volume_3_page_7_scanned.pdf.v2.thumbnail.webp
+
+Previews are WebP images when Pillow supports it, JPEG otherwise.
+
+Without pdftoppm no previews are rendered.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db import transaction
+from PIL import features, Image
+
+
+logger = logging.getLogger(__name__)
+
+# largest width and height of each preview size
+PREVIEW_SIZES = {
+    "thumbnail": (200, 283),
+    "preview": (800, 1131),
+}
+
+EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg"}
+
+_executor = None
+
+
+def is_available():
+    return shutil.which("pdftoppm") is not None
+
+
+def preview_format():
+    """
+    The configured image format, or WEBP if Pillow supports it and JPEG
+    otherwise.
+    """
+    image_format = getattr(settings, "PAGE_PREVIEW_FORMAT", "")
+    if image_format:
+        return image_format.upper()
+    return "WEBP" if features.check("webp") else "JPEG"
+
+
+def preview_name(name, version_no, size):
+    """
+    Name of a preview of the file name, relative to MEDIA_ROOT.
+    """
+    return "{}.v{}.{}.{}".format(name, version_no, size, EXTENSIONS[preview_format()])
+
+
+def source_name(name):
+    """
+    Name of the page file a preview belongs to, or None if name is not
+    the name of a preview.
+    """
+    parts = name.rsplit(".", 3)
+    if (
+        len(parts) == 4
+        and parts[1][:1] == "v" and parts[1][1:].isdigit()
+        and parts[2] in PREVIEW_SIZES
+        and parts[3] in EXTENSIONS.values()
+    ):
+        return parts[0]
+    return None
+
+
+def page_file(page):
+    return page.scanned_text if page.type == page.TYPE_SCANNED else page.typed_text
+
+
+def preview_url(page, size):
+    """
+    URL of a preview of the current version of a page, or None without
+    pdftoppm. It is served like the file of the page, to whoever may see
+    the page.
+    """
+    file = page_file(page)
+    if not file or not is_available():
+        return None
+    return settings.MEDIA_URL + quote(preview_name(file.name, page.version_no, size))
+
+
+def render(source, targets, image_format, resolution=100):
+    """
+    Render the first page of the PDF source into the targets, a dict of
+    preview size to absolute path, and remove the previews of older
+    versions. Runs in worker processes, so it does not use Django.
+    """
+    missing = {size: path for size, path in targets.items() if not os.path.isfile(path)}
+    if missing:
+        with tempfile.TemporaryDirectory() as tmp:
+            prefix = os.path.join(tmp, "page")
+            subprocess.run(
+                [
+                    "pdftoppm", "-f", "1", "-l", "1", "-r", str(resolution),
+                    "-png", "-singlefile", source, prefix,
+                ],
+                check=True,
+                capture_output=True,
+                timeout=120,
+            )
+            with Image.open(prefix + ".png") as image:
+                image = image.convert("RGB")
+                for size, path in missing.items():
+                    preview = image.copy()
+                    preview.thumbnail(PREVIEW_SIZES[size])
+                    partial = path + ".part"
+                    preview.save(partial, image_format)
+                    os.replace(partial, path)
+
+    current = set(targets.values())
+    for size, path in targets.items():
+        pattern = "{}.v*.{}.*".format(glob.escape(source), size)
+        for old in glob.glob(pattern):
+            if old not in current:
+                os.remove(old)
+    return len(missing)
+
+
+def render_arguments(page):
+    """
+    Arguments of render() for the current version of a page.
+    """
+    name = page_file(page).name
+    targets = {
+        size: os.path.join(settings.MEDIA_ROOT, preview_name(name, page.version_no, size))
+        for size in PREVIEW_SIZES
+    }
+    return os.path.join(settings.MEDIA_ROOT, name), targets, preview_format()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=getattr(settings, "PAGE_PREVIEW_WORKERS", 2),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error("Rendering page previews failed", exc_info=future.exception())
+
+
+def schedule(page):
+    """
+    Render the previews of a page in the background, after the current
+    transaction commits.
+    """
+    if not is_available() or not page_file(page):
+        return
+    arguments = render_arguments(page)
+
+    def submit():
+        get_executor().submit(render, *arguments).add_done_callback(_log_failure)
+
+    transaction.on_commit(submit)
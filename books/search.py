@@ -0,0 +1,261 @@
+"""
+Full-text search over the text of typed pages.
+
+The text of a typed page is extracted with pdftotext (poppler-utils) in a
+background thread once its upload is committed, or with the index_pages
+command, and stored in PageText with the version it comes
+from, so unchanged pages are never extracted again. The database keeps the
+index up to date: an FTS5 table on SQLite and a tsvector column on
+PostgreSQL (see the 0006_pagetext migration). Other databases match the
+words of the query with icontains, unranked.
+
+Results are ranked, highlighted, and paginated with opaque cursors on
+(rank, page id).
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import html
+import logging
+import re
+import shutil
+import subprocess
+
+from django.apps import apps
+from django.core import signing
+from django.db import connection, connections, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils.html import mark_safe
+
+
+logger = logging.getLogger(__name__)
+
+SearchHit = namedtuple("SearchHit", ["page", "rank", "snippet"])
+
+CURSOR_SALT = "books.search.cursor"
+
+# highlight markers, replaced with <mark> tags once the snippet is escaped
+START, STOP = "\x02", "\x03"
+
+# readers get the version of the page they are shown for text found in any
+# version of it
+READER_JOIN = """
+    JOIN books_page c ON c.volume_no = p.volume_no
+        AND c.page_no = p.page_no AND c.is_reader_canonical
+"""
+
+SQLITE_SEARCH = """
+    SELECT id, rank, snippet FROM (
+        SELECT {page}.id AS id,
+            -bm25(books_pagetext_fts) AS rank,
+            snippet(books_pagetext_fts, 0, %s, %s, '…', 16) AS snippet
+        FROM books_pagetext_fts
+        JOIN books_page p ON p.id = books_pagetext_fts.rowid
+        {join}
+        WHERE books_pagetext_fts MATCH %s
+    ) AS hits
+    {after}
+    ORDER BY rank DESC, id
+    LIMIT %s
+"""
+
+POSTGRESQL_SEARCH = """
+    SELECT id, rank,
+        ts_headline('simple', content, query, %s) AS snippet
+    FROM (
+        SELECT {page}.id AS id,
+            ts_rank(t.search_vector, query)::float8 AS rank,
+            t.content AS content,
+            query
+        FROM books_pagetext t
+        CROSS JOIN websearch_to_tsquery('simple', %s) AS query
+        JOIN books_page p ON p.id = t.page_id
+        {join}
+        WHERE t.search_vector @@ query
+    ) AS hits
+    {after}
+    ORDER BY rank DESC, id
+    LIMIT %s
+"""
+
+AFTER = "WHERE rank < %s OR (rank = %s AND id > %s)"
+
+_executor = None
+
+
+def is_available():
+    return shutil.which("pdftotext") is not None
+
+
+def extract_text(path):
+    result = subprocess.run(
+        ["pdftotext", "-enc", "UTF-8", path, "-"],
+        check=True,
+        capture_output=True,
+        timeout=120,
+    )
+    return result.stdout.decode("utf-8", errors="replace")
+
+
+def is_indexed(page):
+    """
+    Only typed pages hold text, scanned pages are images.
+    """
+    return page.type == page.TYPE_TYPED and bool(page.typed_text)
+
+
+def index_page(page, content=None):
+    """
+    Store the text of the current version of a page, extracting it unless
+    content is given. Returns whether the text was stored.
+    """
+    PageText = apps.get_model("books", "PageText")
+    if not is_indexed(page):
+        PageText.objects.filter(page_id=page.pk).delete()
+        return False
+    if PageText.objects.filter(page_id=page.pk, version_no=page.version_no).exists():
+        return False
+    if content is None:
+        content = extract_text(page.typed_text.path)
+    PageText.objects.update_or_create(
+        page_id=page.pk,
+        defaults={"version_no": page.version_no, "content": content},
+    )
+    return True
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1)
+    return _executor
+
+
+def _run(page_id):
+    Page = apps.get_model("books", "Page")
+    try:
+        # the page as it is now, it may have changed since it was scheduled
+        page = Page.objects.filter(pk=page_id).first()
+        if page is not None:
+            index_page(page)
+    except Exception:
+        logger.exception("Extracting the text of page %s failed", page_id)
+    finally:
+        connections.close_all()
+
+
+def schedule(page):
+    """
+    Index a page in the background, after the current transaction commits.
+    """
+    if not is_available():
+        return
+    page_id = page.pk
+
+    def submit():
+        get_executor().submit(_run, page_id)
+
+    transaction.on_commit(submit)
+
+
+def _fts5_query(query):
+    """
+    Match all the words of the query, ignoring FTS5 operators.
+    """
+    return " ".join('"{}"'.format(word) for word in re.findall(r"\w+", query))
+
+
+def _highlight(snippet):
+    return mark_safe(
+        html.escape(snippet).replace(START, "<mark>").replace(STOP, "</mark>")
+    )
+
+
+def _unranked_hits(query, is_staff, after, limit):
+    """
+    (page id, rank, snippet) rows of the pages whose text contains every
+    word of the query, by page id, for databases without full-text search.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return []
+    PageText = apps.get_model("books", "PageText")
+    Page = apps.get_model("books", "Page")
+    texts = PageText.objects.all()
+    for word in words:
+        texts = texts.filter(content__icontains=word)
+    if is_staff:
+        texts = texts.annotate(hit=F("page_id"))
+    else:
+        texts = texts.annotate(hit=Subquery(
+            Page.objects.filter(
+                volume_no=OuterRef("page__volume_no"),
+                page_no=OuterRef("page__page_no"),
+                is_reader_canonical=True,
+            ).values("pk")[:1]
+        ))
+    texts = texts.filter(hit__isnull=False)
+    if after:
+        texts = texts.filter(hit__gt=after[2])
+    pattern = re.compile("|".join(re.escape(word) for word in words), re.IGNORECASE)
+    rows = []
+    for id, content in texts.order_by("hit").values_list("hit", "content")[:limit]:
+        first = pattern.search(content)
+        start = max(first.start() - 60, 0) if first else 0
+        snippet = content[start:start + 160]
+        snippet = pattern.sub(lambda m: START + m.group(0) + STOP, snippet)
+        rows.append((id, 0.0, ("…" if start else "") + snippet))
+    return rows
+
+
+def search(query, is_staff=False, limit=20, cursor=None):
+    """
+    Pages whose text matches the query, best first.
+    Returns the hits and the cursor of the next hits, or None.
+    """
+    after = None
+    if cursor:
+        try:
+            cursor = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            cursor = None
+        if cursor and cursor["query"] == query:
+            after = (cursor["rank"], cursor["rank"], cursor["id"])
+
+    sql_format = {
+        "page": "p" if is_staff else "c",
+        "join": "" if is_staff else READER_JOIN,
+        "after": AFTER if after else "",
+    }
+    if connection.vendor == "postgresql":
+        sql = POSTGRESQL_SEARCH.format(**sql_format)
+        params = [f"StartSel={START}, StopSel={STOP}, MaxFragments=1", query]
+    elif connection.vendor == "sqlite":
+        match = _fts5_query(query)
+        if not match:
+            return [], None
+        sql = SQLITE_SEARCH.format(**sql_format)
+        params = [START, STOP, match]
+    else:
+        sql = None
+    if sql is None:
+        rows = _unranked_hits(query, is_staff, after, limit + 1)
+    else:
+        params += list(after or []) + [limit + 1]
+        with connection.cursor() as c:
+            c.execute(sql, params)
+            rows = c.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    pages = apps.get_model("books", "Page").objects.in_bulk([row[0] for row in rows])
+    hits = [
+        SearchHit(pages[id], rank, _highlight(snippet))
+        for id, rank, snippet in rows if id in pages
+    ]
+    next_cursor = None
+    if has_more:
+        id, rank, _ = rows[-1]
+        next_cursor = signing.dumps(
+            {"query": query, "rank": rank, "id": id},
+            salt=CURSOR_SALT,
+        )
+    return hits, next_cursor
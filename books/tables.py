@@ -1,35 +1,86 @@
+from django.conf import settings
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html, mark_safe
 import django_tables2 as tables
-from django.utils.html import mark_safe
-
 
+from . import previews
 from .models import Page
 
+
+# placeholders reversed into the detail URL, and replaced for every row
+DETAIL_URL_PLACEHOLDERS = ("__volume__", "__page__", "__type__")
+
+
+def render_total(table):
+    # the paginator count is cached, len(table.data) runs a COUNT query
+    count = table.paginator.count if hasattr(table, "paginator") else len(table.data)
+    return mark_safe(f"<strong>Total: {count}</strong>")
+
+
 class PageTableUser(tables.Table):
+    """
+    The rendered rows are cached by the template under fragment_key, which
+    the view sets from the user role, the filters, the sort and the page.
+    """
 
-    page_no = tables.Column(
-        footer=lambda table: mark_safe(
-            f"<strong>Total: {len(table.data)}</strong>"
-        ),
+    thumbnail = tables.Column(
+        empty_values=(), orderable=False, verbose_name="", exclude_from_export=True
     )
+    page_no = tables.Column(footer=render_total)
 
+    fragment_key = None
+    fragment_timeout = settings.PAGE_CACHE_TIMEOUT
 
     class Meta:
         model = Page
-        template_name = "django_tables2/bootstrap4.html"
+        template_name = "books/page_table.html"
         fields = ("page_no", "volume_no" )
+        sequence = ("thumbnail", "...")
         per_page = 100
         attrs = {
             "class": "table table-sortable table-sm",
             "th": {"class": "text-uppercase"},
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # previews are only rendered with pdftoppm
+        if not previews.is_available():
+            self.columns.hide("thumbnail")
+
+    @cached_property
+    def detail_url_template(self):
+        """
+        The detail URL as a format string, so that the URLs of all rows are
+        built with a single reverse().
+        """
+        url = reverse("page_detail", args=DETAIL_URL_PLACEHOLDERS)
+        url = url.replace("{", "{{").replace("}", "}}")
+        for i, placeholder in enumerate(DETAIL_URL_PLACEHOLDERS):
+            url = url.replace(placeholder, "{%d}" % i)
+        return url
+
+    def detail_url(self, record):
+        """
+        Page.get_absolute_url, without a reverse() per row.
+        """
+        return self.detail_url_template.format(
+            record.volume_no, record.page_no, record.type
+        )
+
     def render_page_no(self, record, value):
-        return mark_safe(
-        "<a href='{}'>{}</a>".format(
-            record.get_absolute_url(),
-            value
+        return format_html("<a href='{}'>{}</a>", self.detail_url(record), value)
+
+    def render_thumbnail(self, record):
+        # previews are rendered in the background after an upload, and are
+        # hidden until they exist
+        return format_html(
+            "<a href='{}'><img src='{}' alt='' height='60' loading='lazy'"
+            " onerror='this.hidden=true'></a>",
+            self.detail_url(record),
+            record.thumbnail_url(),
         )
-    )
 
 
 class PageTableStaff(PageTableUser):
@@ -1,16 +1,37 @@
+from datetime import timedelta
+import hashlib
+import json
 import os
+from io import BytesIO, StringIO
+import shutil
 from PIL import Image
 import tempfile
+import time
 from unittest import mock
+import unittest
+import zipfile
 
+from django.conf import settings
+from django.core.cache import caches
 from django.contrib.auth import get_user_model
 from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management import call_command, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.http import UnreadablePostError
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings, TestCase
 from django.urls import reverse
+from django.utils import timezone
 
+from core.storage import STALE_TEMPORARY_AGE
 from core.widgets import FileValueInput
-from .models import Page
+from . import (
+    cache, checks, cleanup, downloads, navigation, previews, search, uploads,
+    versions, volumes,
+)
+from .models import FileCleanup, Page, PageText, PageUpload, VolumeBuild
 from .forms import PageForm
 
 file_mock_text = mock.MagicMock(spec=File, name='FileMockText')
@@ -86,6 +107,16 @@ class PageErrorTests(TestCase):
         )
         self.assertContains(response, "Files of type text/plain are not supported.")
 
+        # a large file of the wrong type stops the request early
+        text = SimpleUploadedFile("page.pdf", b"text" * 100000, content_type="application/pdf")
+        with mock.patch("django.http.multipartparser.exhaust") as exhaust:
+            response = self.client.post(
+                self.url,
+                {"page_no": 3, "volume_no": 3, "scanned_text": text, "comments": "Late"},
+            )
+        exhaust.assert_not_called()
+        self.assertContains(response, "Files of type text/plain are not supported.")
+
     def test_file_upload_fails(self):
         """
         Error when wrong number of files is uploaded
@@ -131,19 +162,21 @@ class PageTests(TestCase):
         """
         Use admin to create a page
         """
+        caches["default"].clear()
         self.client.force_login(self.user)
         self.get_response = self.client.get(self.add_url)
-        with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
-            wrapped_file = File(f)
-            self.post_response = self.client.post(
-                self.add_url,
-                {
-                    "page_no":3,
-                    "volume_no":3,
-                    "typed_text":wrapped_file,
-                },
-                follow=True
-            )
+        with self.captureOnCommitCallbacks(execute=True):
+            with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
+                wrapped_file = File(f)
+                self.post_response = self.client.post(
+                    self.add_url,
+                    {
+                        "page_no":3,
+                        "volume_no":3,
+                        "typed_text":wrapped_file,
+                    },
+                    follow=True
+                )
         self.page = Page.objects.first()
         self.change_url = reverse('admin:books_page_change', args=[self.page.pk])
 
@@ -188,17 +221,18 @@ class PageTests(TestCase):
         """
 
         response = self.client.get(self.change_url)
-        with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
-            wrapped_file = File(f)
-            response = self.client.post(
-                self.change_url,
-                {
-                    "page_no":3,
-                    "volume_no":3,
-                    "typed_text":wrapped_file,
-                },
-                follow=True
-            )
+        with self.captureOnCommitCallbacks(execute=True):
+            with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
+                wrapped_file = File(f)
+                response = self.client.post(
+                    self.change_url,
+                    {
+                        "page_no":3,
+                        "volume_no":3,
+                        "typed_text":wrapped_file,
+                    },
+                    follow=True
+                )
         self.assertContains(response, 'was changed successfully.')
         # the saved file is the same
         saved_files = (os.listdir(os.path.join(dir, "volume_3", "page_3")))
@@ -208,15 +242,179 @@ class PageTests(TestCase):
         page = Page.objects.first()
         self.assertEqual(page.version_no, 2)
 
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_page_versions(self):
+        """
+        Re-uploading keeps the previous file, which can be downloaded from
+        the history until the retention policy removes it.
+        """
+        versions_dir = os.path.join(dir, versions.VERSIONS_DIRECTORY)
+        shutil.rmtree(versions_dir, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, versions_dir, ignore_errors=True)
+        with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
+            original = f.read()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                self.change_url,
+                {
+                    "page_no": 3,
+                    "volume_no": 3,
+                    "typed_text": SimpleUploadedFile("new.pdf", original + b"\n%v2"),
+                },
+            )
+        name = self.page.typed_text.name
+        # a new version that is rolled back keeps nothing
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            page = Page.objects.get(pk=self.page.pk)
+            page.version_no += 1
+            page.save()
+            raise RuntimeError
+        self.assertIsNone(versions.find(name, 2))
+
+        path, compressed = versions.find(name, 1)
+        self.assertFalse(compressed)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), original)
+
+        first = self.page.history.filter(version_no=1).earliest("history_date")
+        second = self.page.history.latest("history_date")
+        response = self.client.get(reverse("admin:books_page_history", args=[self.page.pk]))
+        self.assertContains(response, ">Download</a>")
+        download_url = reverse(
+            "admin:books_page_history_download", args=[self.page.pk, first.history_id]
+        )
+        response = self.client.get(download_url)
+        self.assertEqual(b"".join(response.streaming_content), original)
+        self.assertIn("volume_3_page_3_typed.v1.pdf", response["Content-Disposition"])
+        response = self.client.get(
+            reverse("admin:books_page_history_download", args=[self.page.pk, second.history_id])
+        )
+        self.assertEqual(b"".join(response.streaming_content), original + b"\n%v2")
+
+        out = StringIO()
+        call_command("compact_versions", "--workers=1", stdout=out)
+        self.assertIn("Deleted 0 expired versions, compressed 1", out.getvalue())
+        self.assertTrue(versions.find(name, 1)[1])
+        response = self.client.get(download_url)
+        self.assertEqual(b"".join(response.streaming_content), original)
+
+        call_command("compact_versions", "--keep=0", "--max-age=0", stdout=out)
+        self.assertIsNone(versions.find(name, 1))
+        response = self.client.get(download_url)
+        self.assertTemplateUsed(response, "404.html")
+
     @override_settings(MEDIA_ROOT=dir + '/')
     def test_delete_file_after_deleting_page(self):
         """
-        The file is deleted once the page is deleted
+        The file is deleted once the deletion of the page is committed and
+        the cleanup journal processed.
         """
+        path = os.path.join(dir, "volume_3", "page_3", "volume_3_page_3_typed.pdf")
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Page.objects.filter(pk=self.page.pk).delete()
+                raise ValueError
+        self.assertFalse(FileCleanup.objects.exists())
+
         self.page.delete()
-        self.assertFalse(os.path.isfile(os.path.join(dir, "volume_3", "page_3", "volume_3_page_3_typed.txt" )))
-        saved_files = (os.listdir(os.path.join(dir, "volume_3", "page_3")))
-        self.assertEqual(len(saved_files), 0)
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(cleanup.process(), (1, 0))
+        self.assertFalse(os.path.isfile(path))
+        self.assertFalse(FileCleanup.objects.exists())
+
+    def test_collect_media(self):
+        """
+        Files no page refers to are removed, page files and their previews
+        are kept, and so are files still being written.
+        """
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root + "/"):
+            with self.captureOnCommitCallbacks(execute=True):
+                page = Page.objects.create(
+                    volume_no=5,
+                    page_no=1,
+                    type=Page.TYPE_SCANNED,
+                    scanned_text=SimpleUploadedFile("page.pdf", b"%PDF-1.4"),
+                )
+            names = [
+                page.scanned_text.name,
+                previews.preview_name(page.scanned_text.name, 0, "thumbnail"),
+                "volume_5/page_2/volume_5_page_2_typed.pdf",
+                "volume_5/page_1/.tmp-0123-volume_5_page_1_typed.pdf",
+                previews.preview_name(page.scanned_text.name, 1, "preview") + ".part",
+            ]
+            for name in names[1:]:
+                os.makedirs(os.path.dirname(os.path.join(media_root, name)), exist_ok=True)
+                with open(os.path.join(media_root, name), "wb") as f:
+                    f.write(b"x")
+            out = StringIO()
+            call_command("collect_media", "--min-age=0", "--dry-run", stdout=out)
+            self.assertIn(names[2], out.getvalue())
+            self.assertTrue(os.path.isfile(os.path.join(media_root, names[2])))
+            call_command("collect_media", "--min-age=0", stdout=out)
+            self.assertEqual(
+                [os.path.isfile(os.path.join(media_root, name)) for name in names],
+                [True, True, False, True, True],
+            )
+            # until they are left behind
+            old = time.time() - STALE_TEMPORARY_AGE - 1
+            for name in names[3:]:
+                os.utime(os.path.join(media_root, name), (old, old))
+            self.assertEqual(cleanup.orphans(min_age=0), sorted(names[3:]))
+
+    def test_verify_media(self):
+        """
+        Missing, corrupt, mismatched and orphaned files are reported,
+        unchanged files are skipped in incremental mode.
+        """
+        with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
+            content = f.read()
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root + "/"):
+            with self.captureOnCommitCallbacks(execute=True):
+                pages = [
+                    Page.objects.create(
+                        volume_no=6,
+                        page_no=page_no,
+                        type=Page.TYPE_SCANNED,
+                        scanned_text=SimpleUploadedFile("page.pdf", content),
+                    )
+                    for page_no in range(1, 6)
+                ]
+            ok, missing, corrupt, mismatch, unrecorded = pages
+            self.assertEqual(ok.sha256, hashlib.sha256(content).hexdigest())
+            os.remove(missing.scanned_text.path)
+            with open(corrupt.scanned_text.path, "wb") as f:
+                f.write(content[:-100])
+            Page.objects.filter(pk=mismatch.pk).update(sha256="0" * 64)
+            Page.objects.filter(pk=unrecorded.pk).update(sha256="")
+            with open(os.path.join(media_root, "volume_6", "stray.pdf"), "wb") as f:
+                f.write(content)
+
+            out = StringIO()
+            # the page of setUp has its file in another MEDIA_ROOT
+            with self.assertRaisesMessage(CommandError, "4 page files failed"):
+                call_command("verify_media", "--workers=2", stdout=out)
+            results = [json.loads(line) for line in out.getvalue().splitlines()]
+            self.assertEqual(
+                {(r["status"], r.get("page")) for r in results[:-1]},
+                {
+                    ("missing", self.page.pk),
+                    ("missing", missing.pk),
+                    ("corrupt", corrupt.pk),
+                    ("mismatch", mismatch.pk),
+                    ("orphaned", None),
+                },
+            )
+            self.assertEqual(results[-1]["verified"], 1)
+            self.assertEqual(results[-1]["recorded"], 1)
+            unrecorded.refresh_from_db()
+            self.assertEqual(unrecorded.sha256, ok.sha256)
+            self.assertIsNotNone(unrecorded.checksum_verified)
+
+            out = StringIO()
+            with self.assertRaises(CommandError):
+                call_command("verify_media", "--incremental", stdout=out)
+            summary = json.loads(out.getvalue().splitlines()[-1])
+            self.assertEqual(summary["skipped"], 2)
 
     def test_admin_form(self):
         """
@@ -274,51 +472,129 @@ class PageTests(TestCase):
         # This is present only if reverting is enabled
         self.assertNotContains(response, "Choose an entry from the list below")
 
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_import_pages(self):
+        """
+        Pages are imported from a manifest with their history, invalid rows
+        are reported, and importing again skips the imported pages.
+        """
+        source = os.path.abspath("pcdl_docs/test_pdf.pdf")
+        with tempfile.TemporaryDirectory() as directory:
+            manifest = os.path.join(directory, "pages.csv")
+            with open(manifest, "w") as f:
+                f.write("volume,page,type,file\n")
+                f.write(f"7,1,scanned,{source}\n")
+                f.write(f"7,1,Typed,{source}\n")
+                f.write(f"7,2,scanned,{image_path}\n")
+                f.write(f"7,1,typed,{source}\n")
+                f.write(f"22,1,typed,{source}\n")
+                f.write("7,3,scanned,missing.pdf\n")
+            out, err = StringIO(), StringIO()
+            # files are only put in place once the pages are committed
+            with self.captureOnCommitCallbacks() as callbacks:
+                call_command("import_pages", manifest, "--workers=1", stdout=out, stderr=err)
+            self.assertFalse(os.path.exists(
+                os.path.join(dir, "volume_7/page_1/volume_7_page_1_scanned.pdf")
+            ))
+            for callback in callbacks:
+                callback()
+            self.assertEqual(os.listdir(os.path.join(dir, ".uploads")), [])
+            self.assertIn("Imported 2 pages", out.getvalue())
+            self.assertIn("Line 4: Files of type image/png", err.getvalue())
+            self.assertIn("Line 5: Duplicate of line 3.", err.getvalue())
+            self.assertIn("Line 6: The volume number must be less", err.getvalue())
+            self.assertIn("Line 7: ", err.getvalue())
+
+            scanned, typed = Page.objects.filter(volume_no=7).order_by("type")
+            self.assertEqual(scanned.scanned_text.name, "volume_7/page_1/volume_7_page_1_scanned.pdf")
+            self.assertTrue(os.path.isfile(scanned.scanned_text.path))
+            self.assertEqual(typed.version_no, 1)
+            self.assertEqual(typed.history.get().history_change_reason, "Imported")
+            self.assertTrue(scanned.is_reader_canonical)
+            self.assertIsNotNone(typed.staff_order)
+
+            out = StringIO()
+            call_command("import_pages", manifest, "--workers=1", stdout=out, stderr=StringIO())
+            self.assertIn("Imported 0 pages", out.getvalue())
+            self.assertIn("3 already there", out.getvalue())
+
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_import_pages_resumed(self):
+        """
+        Pages stored by an import interrupted before the navigation index
+        was rebuilt are numbered when the import is run again.
+        """
+        source = os.path.abspath("pcdl_docs/test_pdf.pdf")
+        with tempfile.TemporaryDirectory() as directory:
+            manifest = os.path.join(directory, "pages.csv")
+            with open(manifest, "w") as f:
+                f.write("volume,page,type,file\n")
+                f.write(f"8,1,typed,{source}\n")
+                f.write(f"8,2,scanned,{source}\n")
+            with mock.patch.object(navigation, "rebuild", side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    call_command("import_pages", manifest, "--workers=1", stdout=StringIO())
+            self.assertFalse(
+                Page.objects.filter(volume_no=8, is_reader_canonical=True).exists()
+            )
+
+            out = StringIO()
+            call_command("import_pages", manifest, "--workers=1", stdout=out)
+            self.assertIn("Imported 0 pages", out.getvalue())
+            first, second = Page.objects.filter(volume_no=8).order_by("page_no")
+            self.assertTrue(first.is_reader_canonical)
+            self.assertEqual(first.find_next_page(), second)
+            self.assertFalse(Page.objects.filter(staff_order__isnull=True).exists())
+
 
 class PageViewTests(TestCase):
 
     @classmethod
     @override_settings(MEDIA_ROOT=dir + '/')
     def setUpTestData(cls):
-        with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
-            wrapped_file = File(f)
-            cls.page1 = Page.objects.create(
-                page_no=23,
-                volume_no=12,
-                scanned_text=wrapped_file,
-            )
-        cls.page1.type = Page.TYPE_SCANNED
-        cls.page1.save()
-        with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
-            wrapped_file = File(f)
-            cls.page2 = Page.objects.create(
-                page_no=23,
-                volume_no=12,
-                typed_text=wrapped_file,
-            )
-        cls.page2.type = Page.TYPE_TYPED
-        cls.page2.save()
-        with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
-            wrapped_file = File(f)
-            cls.page3 = Page.objects.create(
-                page_no=35,
-                volume_no=12,
-                scanned_text=wrapped_file,
-            )
-        cls.page3.type = Page.TYPE_SCANNED
-        cls.page3.save()
-        with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
-            wrapped_file = File(f)
-            cls.page4 = Page.objects.create(
-                page_no=36,
-                volume_no=14,
-                scanned_text=wrapped_file,
-            )
-        cls.page4.type = Page.TYPE_SCANNED
-        cls.page4.save()
+        with cls.captureOnCommitCallbacks(execute=True):
+            with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
+                wrapped_file = File(f)
+                cls.page1 = Page.objects.create(
+                    page_no=23,
+                    volume_no=12,
+                    scanned_text=wrapped_file,
+                )
+            cls.page1.type = Page.TYPE_SCANNED
+            cls.page1.save()
+            with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
+                wrapped_file = File(f)
+                cls.page2 = Page.objects.create(
+                    page_no=23,
+                    volume_no=12,
+                    typed_text=wrapped_file,
+                )
+            cls.page2.type = Page.TYPE_TYPED
+            cls.page2.save()
+            with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
+                wrapped_file = File(f)
+                cls.page3 = Page.objects.create(
+                    page_no=35,
+                    volume_no=12,
+                    scanned_text=wrapped_file,
+                )
+            cls.page3.type = Page.TYPE_SCANNED
+            cls.page3.save()
+            with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
+                wrapped_file = File(f)
+                cls.page4 = Page.objects.create(
+                    page_no=36,
+                    volume_no=14,
+                    scanned_text=wrapped_file,
+                )
+            cls.page4.type = Page.TYPE_SCANNED
+            cls.page4.save()
         cls.superuser = get_user_model().objects.create_superuser(username="su_test")
         cls.user = get_user_model().objects.create_user(username="test")
 
+    def setUp(self):
+        caches["default"].clear()
+
     def test_page_list_view_superuser(self):
         """
         Superuser can see and filter comments, and types. They see all pages.
@@ -366,6 +642,11 @@ class PageViewTests(TestCase):
         response = self.client.get(reverse("page_list") + "?page_no=23-35")
         # correct number of results when input is right
         self.assertContains(response, "Total: 3")
+        # wide ranges and single pages are combined
+        response = self.client.get(reverse("page_list") + "?page_no=1-1000000%2C36")
+        self.assertContains(response, "Total: 4")
+        response = self.client.get(reverse("page_list") + "?page_no=23%2C36")
+        self.assertContains(response, "Total: 3")
 
     def test_page_detail_view(self):
         self.client.force_login(self.superuser)
@@ -420,3 +701,1040 @@ class PageViewTests(TestCase):
         previous_page = self.page4.find_previous_page(is_staff=True)
         self.assertEqual(previous_page, self.page3)
         self.assertEqual(previous_page, self.page4.find_previous_page())
+
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_navigation_index(self):
+        """
+        Next and previous pages are found with a single query, also after
+        pages are added or deleted, and match a full rebuild of the index.
+        """
+        with self.assertNumQueries(1):
+            self.assertEqual(self.page1.find_next_page(), self.page3)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.page4.find_previous_page(is_staff=True), self.page3)
+
+        page5 = Page.objects.create(
+            page_no=30,
+            volume_no=12,
+            type=Page.TYPE_TYPED,
+            typed_text="volume_12/page_30/volume_12_page_30_typed.pdf",
+        )
+        self.assertEqual(self.page2.find_next_page(is_staff=True), page5)
+        self.assertEqual(self.page1.find_next_page(), page5)
+        self.assertEqual(self.page3.find_previous_page(), page5)
+        page5.delete()
+        self.assertEqual(self.page1.find_next_page(), self.page3)
+        self.assertEqual(self.page3.find_previous_page(is_staff=True), self.page2)
+
+        self.assertEqual(navigation.rebuild(Page), 4)
+        start, step = 12 * navigation.VOLUME_SPAN, navigation.ORDER_STEP
+        orders = {
+            (page_no, type): (staff_order, reader_order)
+            for page_no, type, staff_order, reader_order in Page.objects.filter(
+                volume_no=12
+            ).values_list("page_no", "type", "staff_order", "reader_order")
+        }
+        self.assertEqual(orders, {
+            (23, Page.TYPE_SCANNED): (start + step, start + step),
+            (23, Page.TYPE_TYPED): (start + 2 * step, start + step),
+            (35, Page.TYPE_SCANNED): (start + 3 * step, start + 2 * step),
+        })
+        self.assertEqual(self.page1.find_next_page(is_staff=True), self.page2)
+        self.assertEqual(self.page3.find_previous_page(), self.page1)
+
+        # new pages go into the gaps of their volume, and a volume without
+        # gaps left is renumbered on its own
+        other_volume = list(Page.objects.filter(volume_no=14).values_list(
+            "pk", "staff_order", "reader_order"
+        ))
+        pages = []
+        with mock.patch.object(navigation, "rebuild", wraps=navigation.rebuild) as rebuild:
+            # halving the gap before page 35 leaves room for ten pages
+            for page_no in range(34, 23, -1):
+                pages.append(Page.objects.create(
+                    page_no=page_no,
+                    volume_no=12,
+                    type=Page.TYPE_TYPED,
+                    typed_text=f"volume_12/page_{page_no}/volume_12_page_{page_no}_typed.pdf",
+                ))
+        rebuild.assert_called_once_with(Page, volumes=[12])
+        self.assertEqual(
+            list(Page.objects.filter(volume_no=12).order_by("staff_order").values_list(
+                "page_no", flat=True
+            )),
+            [23, 23, *range(24, 36)],
+        )
+        self.assertEqual(pages[-1].find_previous_page(), self.page1)
+        self.assertEqual(pages[-1].find_next_page(), pages[-2])
+        self.assertEqual(self.page3.find_next_page(), self.page4)
+        self.assertEqual(other_volume, list(Page.objects.filter(volume_no=14).values_list(
+            "pk", "staff_order", "reader_order"
+        )))
+
+    def test_page_detail_query_count(self):
+        """
+        The page and its neighbours are fetched in a single query, whatever
+        the position of the page, and readers get the scanned version.
+        """
+        for user, args in (
+            (self.superuser, ["12", "23", "Typed"]),
+            (self.superuser, ["14", "36", "Scanned"]),
+            (self.user, ["12", "23", "Typed"]),
+            (self.user, ["12", "35", "Scanned"]),
+        ):
+            self.client.force_login(user)
+            url = reverse("page_detail", args=args)
+            # session, user, change stamp and page queries
+            with self.assertNumQueries(4):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            # the page and its neighbours come from the cache the second time
+            with self.assertNumQueries(3):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("page_detail", args=["12", "23", "Typed"]))
+        self.assertEqual(response.context["page"], self.page1)
+        self.assertIsNone(response.context["previous_page"])
+        self.assertEqual(response.context["next_page"], self.page3)
+        response = self.client.get(reverse("page_detail", args=["12", "24", "Typed"]))
+        self.assertTemplateUsed(response, "404.html")
+
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_page_table_cache(self):
+        """
+        The rendered rows are cached by role, filters, sort and page, and
+        rendered again once a page changes.
+        """
+        self.client.force_login(self.superuser)
+        url = reverse("page_list") + "?sort=-volume_no&volume_no=12"
+        response = self.client.get(url)
+        self.assertContains(response, self.page1.get_absolute_url())
+        # session, user and change stamp queries, the count and the rows
+        # are cached
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertContains(response, self.page2.get_absolute_url())
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertNotContains(response, self.page2.get_absolute_url())
+
+        self.client.force_login(self.superuser)
+        self.page2.comments = "Changed"
+        self.page2.save()
+        response = self.client.get(url)
+        self.assertContains(response, "Changed")
+        response = self.client.get(reverse("page_list") + "?volume_no=a")
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_conditional_get(self):
+        """
+        Pages that did not change since are answered with 304 Not Modified,
+        without querying pages, and the ETag depends on the user.
+        """
+        self.client.force_login(self.user)
+        url = reverse("page_detail", args=["12", "35", "Scanned"])
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        self.assertIn("no-cache", response["Cache-Control"])
+        # session, user and change stamp queries only
+        with self.assertNumQueries(3):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse("page_list"))
+        self.assertEqual(
+            self.client.get(
+                reverse("page_list"), HTTP_IF_NONE_MATCH=response["ETag"]
+            ).status_code,
+            304,
+        )
+
+        self.client.force_login(self.superuser)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.page3.comments = "Changed"
+        self.page3.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        # a change made by another process, whose cache invalidation this
+        # process does not see
+        etag = response["ETag"]
+        with mock.patch.object(cache, "invalidate"):
+            self.page3.comments = "Changed again"
+            self.page3.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_page_cache(self):
+        """
+        Page lookups are cached until a page is saved or deleted, and
+        their hits and misses are counted.
+        """
+        cache.reset_stats()
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                cache.get_with_neighbours(12, 35), (self.page1, self.page3, self.page4)
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                cache.get_with_neighbours("12", "35"), (self.page1, self.page3, self.page4)
+            )
+            self.assertEqual(cache.get_with_neighbours("12", "a"), (None, None, None))
+        self.assertIsNone(cache.get_file_version("missing.pdf"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(cache.get_file_version("missing.pdf"))
+        self.assertEqual(
+            cache.get_with_neighbours(12, 23, "Typed", is_staff=True),
+            (self.page1, self.page2, self.page3),
+        )
+
+        self.page2.comments = "Changed"
+        self.page2.save()
+        self.assertEqual(
+            cache.get_with_neighbours(12, 23, "Typed", is_staff=True)[1].comments,
+            "Changed",
+        )
+        Page.objects.filter(pk=self.page3.pk).delete()
+        self.assertEqual(
+            cache.get_with_neighbours(12, 23), (None, self.page1, self.page4)
+        )
+
+        out = StringIO()
+        call_command("cache_stats", "--reset", stdout=out)
+        self.assertIn("neighbours: 1 hits, 4 misses", out.getvalue())
+        self.assertIn("file: 1 hits, 1 misses", out.getvalue())
+        self.assertEqual(cache.stats(), {})
+
+        locmem = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        with self.settings(DEBUG=False, CACHES=locmem):
+            self.assertEqual(
+                [warning.id for warning in checks.check_shared_cache(None)], ["books.W001"]
+            )
+        with self.settings(DEBUG=True, CACHES=locmem):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_reader_canonical_flag(self):
+        """
+        Only one version of each page is shown to readers, the scanned one
+        if it exists, and the flag follows deletions.
+        """
+        self.assertEqual(
+            list(Page.objects.filter(is_reader_canonical=True)),
+            [self.page1, self.page3, self.page4],
+        )
+        Page.objects.get(pk=self.page1.pk).delete()
+        self.assertTrue(Page.objects.get(pk=self.page2.pk).is_reader_canonical)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("page_list"))
+        self.assertContains(response, "Total: 3")
+
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_page_list_count_cache(self):
+        """
+        The result count is cached per role and filters, and a page write
+        invalidates it.
+        """
+        self.client.force_login(self.user)
+        url = reverse("page_list") + "?volume_no=12"
+        response = self.client.get(url)
+        self.assertContains(response, "Total: 2")
+        # session, user and change stamp: the count and the rendered rows
+        # are cached
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertContains(response, "Total: 2")
+        self.client.force_login(self.superuser)
+        self.assertContains(self.client.get(url), "Total: 3")
+
+        Page.objects.create(
+            page_no=40,
+            volume_no=12,
+            type=Page.TYPE_SCANNED,
+            scanned_text="volume_12/page_40/volume_12_page_40_scanned.pdf",
+        )
+        self.assertContains(self.client.get(url), "Total: 4")
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(url), "Total: 3")
+
+    def test_page_list_cursor_pagination(self):
+        """
+        Cursor pagination walks the pages forwards and backwards, in the
+        supported sort orders, and falls back to page numbers otherwise.
+        """
+        self.client.force_login(self.superuser)
+        url = reverse("page_list")
+        params = {"pagination": "cursor", "per_page": 2}
+
+        def rows(response):
+            return [row.record for row in response.context["table"].page]
+
+        response = self.client.get(url, params)
+        self.assertEqual(rows(response), [self.page1, self.page2])
+        self.assertContains(response, "Total: 4")
+        self.assertContains(response, "cursor=")
+        page = response.context["table"].page
+        self.assertFalse(page.has_previous())
+        response = self.client.get(url, {**params, "cursor": page.next_cursor})
+        self.assertEqual(rows(response), [self.page3, self.page4])
+        page = response.context["table"].page
+        self.assertFalse(page.has_next())
+        response = self.client.get(url, {**params, "cursor": page.previous_cursor})
+        self.assertEqual(rows(response), [self.page1, self.page2])
+
+        response = self.client.get(url, {**params, "sort": "-volume_no"})
+        self.assertEqual(rows(response), [self.page4, self.page3])
+        page = response.context["table"].page
+        response = self.client.get(url, {**params, "sort": "-volume_no", "cursor": page.next_cursor})
+        self.assertEqual(rows(response), [self.page2, self.page1])
+        # a cursor from another sort order or a forged one starts from the top
+        response = self.client.get(url, {**params, "cursor": page.next_cursor})
+        self.assertEqual(rows(response), [self.page1, self.page2])
+        response = self.client.get(url, {**params, "cursor": "forged"})
+        self.assertEqual(rows(response), [self.page1, self.page2])
+
+        response = self.client.get(url, {**params, "sort": "page_no", "page": 2})
+        self.assertEqual(response.context["table"].page.number, 2)
+
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_page_file_view(self):
+        """
+        Files are only served to logged in users, readers only get the
+        version of the page they are shown.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
+                typed_page = Page.objects.create(
+                    page_no=35,
+                    volume_no=12,
+                    type=Page.TYPE_TYPED,
+                    typed_text=File(f),
+                )
+        scanned_url = self.page3.scanned_text.url
+        typed_url = typed_page.typed_text.url
+        response = self.client.get(scanned_url)
+        self.assertEqual(response.status_code, 302)
+
+        self.client.force_login(self.user)
+        response = self.client.get(scanned_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
+            self.assertEqual(b"".join(response.streaming_content), f.read())
+        response = self.client.get(typed_url)
+        self.assertTemplateUsed(response, "404.html")
+        response = self.client.get(settings.MEDIA_URL + "../books/models.py")
+        self.assertTemplateUsed(response, "404.html")
+
+        self.client.force_login(self.superuser)
+        response = self.client.get(typed_url)
+        self.assertEqual(response.status_code, 200)
+        with self.settings(SENDFILE_BACKEND="nginx"):
+            response = self.client.get(typed_url)
+            self.assertEqual(
+                response["X-Accel-Redirect"],
+                "/protected-media/" + typed_page.typed_text.name,
+            )
+            self.assertEqual(response.content, b"")
+        with self.settings(SENDFILE_BACKEND="apache"):
+            response = self.client.get(typed_url)
+            self.assertEqual(response["X-Sendfile"], typed_page.typed_text.path)
+
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_page_file_ranges_and_conditional_get(self):
+        """
+        Page files support byte ranges, and unchanged files are not sent
+        again.
+        """
+        self.client.force_login(self.user)
+        url = self.page3.scanned_text.url
+        with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
+            content = f.read()
+        # the ETag comes from the page row, the file is not read for it
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertEqual(
+            etag, '"{}-{}"'.format(self.page3.version_no, self.page3.sha256[:32])
+        )
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+        response = self.client.get(url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(content)}")
+        self.assertEqual(b"".join(response.streaming_content), content[10:20])
+
+        response = self.client.get(url, HTTP_RANGE="bytes=0-4,-5")
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response["Content-Type"].startswith("multipart/byteranges"))
+        body = b"".join(response.streaming_content)
+        self.assertEqual(len(body), int(response["Content-Length"]))
+        self.assertIn(content[:5], body)
+        self.assertIn(content[-5:], body)
+
+        response = self.client.get(url, HTTP_RANGE=f"bytes={len(content)}-")
+        self.assertEqual(response.status_code, 416)
+        # a stale If-Range gets the whole file
+        response = self.client.get(url, HTTP_RANGE="bytes=0-4", HTTP_IF_RANGE='"0-x"')
+        self.assertEqual(response.status_code, 200)
+        # and so does a weak one, even for the current file
+        response = self.client.get(url, HTTP_RANGE="bytes=0-4", HTTP_IF_RANGE="W/" + etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_RANGE="bytes=0-4", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+        # pages saved before checksums were recorded
+        Page.objects.filter(pk=self.page3.pk).update(sha256="")
+        caches["default"].clear()
+        response = self.client.get(url)
+        self.assertEqual(response["ETag"], '"{}"'.format(self.page3.version_no))
+
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_page_previews(self):
+        """
+        Previews are named after the page file and its version, and served
+        like the page file.
+        """
+        name = self.page3.scanned_text.name
+        with self.settings(PAGE_PREVIEW_FORMAT="WEBP"):
+            self.assertEqual(
+                previews.preview_name(name, 2, "thumbnail"),
+                name + ".v2.thumbnail.webp",
+            )
+        thumbnail = previews.preview_name(name, 2, "thumbnail")
+        self.assertEqual(previews.source_name(thumbnail), name)
+        self.assertIsNone(previews.source_name(name))
+        self.assertIsNone(previews.source_name(name + ".v2.huge.webp"))
+
+        image.save(os.path.join(dir, thumbnail), previews.preview_format())
+        self.client.force_login(self.user)
+        response = self.client.get(settings.MEDIA_URL + thumbnail)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("image/"))
+        os.remove(os.path.join(dir, thumbnail))
+
+        # the list and the detail page show the previews of what the user
+        # may see, and only load the PDF when asked
+        typed = self.page2.typed_text.name.replace("_scanned", "_typed")
+        Page.objects.filter(pk=self.page2.pk).update(typed_text=typed)
+        self.page2.refresh_from_db()
+        caches["default"].clear()
+        with mock.patch.object(previews, "is_available", return_value=False):
+            response = self.client.get(reverse("page_list"))
+            self.assertNotContains(response, "thumbnail")
+            response = self.client.get(self.page3.get_absolute_url())
+            self.assertContains(response, f'<iframe src="{self.page3.scanned_text.url}"')
+        with mock.patch.object(previews, "is_available", return_value=True):
+            response = self.client.get(reverse("page_list"))
+            self.assertContains(response, self.page3.thumbnail_url())
+            self.assertNotContains(response, self.page2.thumbnail_url())
+            response = self.client.get(self.page3.get_absolute_url())
+            self.assertContains(response, self.page3.preview_url())
+            self.assertContains(response, f'data-src="{self.page3.scanned_text.url}"')
+            preview = self.page2.preview_url()
+        path = os.path.join(dir, preview[len(settings.MEDIA_URL):])
+        image.save(path, previews.preview_format())
+        self.addCleanup(os.remove, path)
+        response = self.client.get(preview)
+        self.assertTemplateUsed(response, "404.html")
+        self.client.force_login(self.superuser)
+        response = self.client.get(preview)
+        self.assertEqual(response.status_code, 200)
+
+    @unittest.skipUnless(previews.is_available(), "pdftoppm is not installed")
+    @override_settings(MEDIA_ROOT=dir + '/')
+    def test_render_previews(self):
+        """
+        Previews of the current version are rendered, the older ones removed.
+        """
+        old_version = Page(
+            type=Page.TYPE_SCANNED,
+            version_no=self.page3.version_no - 1,
+            scanned_text=self.page3.scanned_text.name,
+        )
+        old_source, old_targets, image_format = previews.render_arguments(old_version)
+        self.assertEqual(previews.render(old_source, old_targets, image_format), 2)
+
+        source, targets, image_format = previews.render_arguments(self.page3)
+        self.assertEqual(previews.render(source, targets, image_format), 2)
+        self.assertEqual(previews.render(source, targets, image_format), 0)
+        for path in targets.values():
+            with Image.open(path) as preview:
+                self.assertLessEqual(preview.width, 800)
+            os.remove(path)
+        for path in old_targets.values():
+            self.assertFalse(os.path.isfile(path))
+
+    def test_page_search(self):
+        """
+        Typed text is searched by relevance. Readers are sent to the version
+        of the page they are shown, results are paginated with cursors.
+        """
+        self.assertTrue(search.index_page(self.page2, content="The Cabinet met <today>."))
+        self.assertFalse(search.index_page(self.page2, content="unchanged version"))
+        self.assertFalse(search.index_page(self.page3))
+        with open("pcdl_docs/test_pdf.pdf", 'rb') as f:
+            typed_page = Page.objects.create(
+                page_no=36,
+                volume_no=14,
+                type=Page.TYPE_TYPED,
+                typed_text=File(f),
+            )
+        search.index_page(typed_page, content="The cabinet cabinet minutes.")
+
+        hits, cursor = search.search("cabinet", is_staff=True)
+        self.assertEqual([hit.page for hit in hits], [typed_page, self.page2])
+        self.assertIsNone(cursor)
+        self.assertIn("<mark>Cabinet</mark>", hits[1].snippet)
+        self.assertIn("&lt;today&gt;", hits[1].snippet)
+        hits, _ = search.search("cabinet")
+        self.assertEqual([hit.page for hit in hits], [self.page4, self.page1])
+        self.assertEqual(search.search("cabinet OR")[0], [])
+        self.assertEqual(search.search('" *')[0], [])
+
+        hits, cursor = search.search("cabinet", is_staff=True, limit=1)
+        self.assertEqual([hit.page for hit in hits], [typed_page])
+        hits, cursor = search.search("cabinet", is_staff=True, limit=1, cursor=cursor)
+        self.assertEqual([hit.page for hit in hits], [self.page2])
+        self.assertIsNone(cursor)
+
+        # other databases match the words unranked, by page
+        with mock.patch.object(search.connection, "vendor", "mysql"):
+            hits, cursor = search.search("cabinet minutes", is_staff=True, limit=1)
+            self.assertEqual([hit.page for hit in hits], [typed_page])
+            self.assertIn("<mark>minutes</mark>", hits[0].snippet)
+            self.assertIsNone(cursor)
+            hits, cursor = search.search("Cabinet", limit=1)
+            self.assertEqual([hit.page for hit in hits], [self.page1])
+            hits, cursor = search.search("Cabinet", limit=1, cursor=cursor)
+            self.assertEqual([hit.page for hit in hits], [self.page4])
+            self.assertIsNone(cursor)
+
+        # saved pages are indexed in the background, not in the request
+        with mock.patch.object(search, "is_available", return_value=True), \
+                mock.patch.object(search, "get_executor") as get_executor, \
+                self.captureOnCommitCallbacks(execute=True):
+            search.schedule(self.page2)
+        get_executor.return_value.submit.assert_called_once_with(search._run, self.page2.pk)
+        Page.objects.filter(pk=self.page2.pk).update(version_no=F("version_no") + 1)
+        with mock.patch.object(search, "extract_text", return_value="New minutes"), \
+                mock.patch.object(search, "connections"):
+            search._run(self.page2.pk)
+        self.assertEqual(PageText.objects.get(page=self.page2).content, "New minutes")
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("page_search"), {"q": "minutes"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.page4.get_absolute_url())
+        self.assertContains(response, "<mark>minutes</mark>")
+
+    @override_settings(MEDIA_ROOT=dir + '/', PAGE_DOWNLOAD_CONCURRENCY=1)
+    def test_page_download(self):
+        """
+        The files of a volume, or of a range of its pages, are streamed as a
+        ZIP archive. Readers get the version of each page they are shown.
+        """
+        url = reverse("page_download")
+        with open("pcdl_docs/test_pdf.pdf", "rb") as f:
+            content = f.read()
+
+        def archive(response):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "application/zip")
+            data = b"".join(response.streaming_content)
+            response.close()
+            with zipfile.ZipFile(BytesIO(data)) as f:
+                self.assertIsNone(f.testzip())
+                return {info.filename: f.read(info) for info in f.infolist()}
+
+        self.client.force_login(self.user)
+        response = self.client.get(url, {"volume_no": 12})
+        self.assertIn('filename="volume_12.zip"', response["Content-Disposition"])
+        self.assertEqual(
+            archive(response),
+            {
+                "volume_12_page_23_scanned.pdf": content,
+                "volume_12_page_35_scanned.pdf": content,
+            },
+        )
+        response = self.client.get(url, {"volume_no": 12, "page_no": "20-30"})
+        self.assertIn('filename="volume_12_pages_20-30.zip"', response["Content-Disposition"])
+        self.assertEqual(list(archive(response)), ["volume_12_page_23_scanned.pdf"])
+        self.assertEqual(self.client.get(url, {"page_no": "23"}).status_code, 400)
+        response = self.client.get(url, {"volume_no": 12, "page_no": "40"})
+        self.assertTemplateUsed(response, "404.html")
+
+        self.client.force_login(self.superuser)
+        response = self.client.get(url, {"volume_no": 12, "page_no": "23"})
+        self.assertEqual(
+            list(archive(response)),
+            ["volume_12_page_23_scanned.pdf", "volume_12_page_23_typed.pdf"],
+        )
+
+        # the slot of an unread download is given back when it is closed
+        self.assertTrue(downloads.acquire())
+        self.assertEqual(self.client.get(url, {"volume_no": 14}).status_code, 503)
+        downloads.release()
+        response = self.client.get(url, {"volume_no": 14})
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        self.assertEqual(self.client.get(url, {"volume_no": 14}).status_code, 200)
+
+
+class ResumableUploadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser(username="test")
+        cls.create_url = reverse("admin:books_page_upload_create")
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.media_root = directory.name + "/"
+        media_root = self.settings(MEDIA_ROOT=self.media_root)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.client.force_login(self.user)
+        with open("pcdl_docs/test_pdf.pdf", "rb") as f:
+            self.content = f.read()
+
+    def create(self, field="scanned_text", length=None):
+        return self.client.post(
+            self.create_url,
+            {
+                "field": field,
+                "filename": "page.pdf",
+                "length": len(self.content) if length is None else length,
+            },
+        )
+
+    def patch(self, location, offset, data):
+        return self.client.generic(
+            "PATCH", location, data,
+            content_type="application/offset+octet-stream",
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_parts_not_shared(self):
+        """
+        dedupe_media does not link partial uploads, and writing to a part
+        that is linked elsewhere leaves the other name alone.
+        """
+        first, second = (
+            uploads.create(self.user, "scanned_text", "page.pdf", len(self.content))
+            for _ in range(2)
+        )
+        uploads.append(first, 0, BytesIO(self.content[:100]))
+        uploads.append(second, 0, BytesIO(self.content[:100]))
+        call_command("dedupe_media", "--workers=1", stdout=StringIO())
+        self.assertEqual(os.stat(uploads.part_path(first)).st_nlink, 1)
+        self.assertEqual(os.stat(uploads.part_path(second)).st_nlink, 1)
+
+        alias = os.path.join(self.media_root, "alias.pdf")
+        os.link(uploads.part_path(first), alias)
+        self.assertEqual(uploads.append(first, 100, BytesIO(self.content[100:200])), 200)
+        with open(alias, "rb") as f:
+            self.assertEqual(f.read(), self.content[:100])
+        with open(uploads.part_path(first), "rb") as f:
+            self.assertEqual(f.read(), self.content[:200])
+
+    def test_resume_after_disconnect(self):
+        """
+        The bytes received before a disconnect are kept, the upload resumes
+        from the offset HEAD reports, and finalizing saves the page.
+        """
+        response = self.client.get(reverse("admin:books_page_add"))
+        self.assertContains(response, 'data-upload-url="%s"' % self.create_url)
+        self.assertContains(response, "resumable_upload")
+        response = self.create()
+        self.assertEqual(response.status_code, 201)
+        location = response["Location"]
+        upload = PageUpload.objects.get()
+
+        class Disconnect:
+            """A request body whose connection drops after 3000 bytes."""
+            def __init__(self, data):
+                self.data = BytesIO(data)
+
+            def read(self, size):
+                if self.data.tell() >= 3000:
+                    raise UnreadablePostError("connection reset")
+                return self.data.read(min(size, 3000 - self.data.tell()))
+
+        with mock.patch("books.uploads.CHUNK_SIZE", 1000):
+            with self.assertRaises(UnreadablePostError):
+                uploads.append(upload, 0, Disconnect(self.content))
+        response = self.client.head(location)
+        self.assertEqual(response["Upload-Offset"], "3000")
+
+        response = self.patch(location, 0, self.content)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Upload-Offset"], "3000")
+        response = self.client.post(location + "finalize/", {"page_no": 5, "volume_no": 5})
+        self.assertEqual(response.status_code, 409)
+        response = self.patch(location, 3000, self.content[3000:])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response["Upload-Offset"], str(len(self.content)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                location + "finalize/",
+                {"page_no": 5, "volume_no": 5, "comments": "Resumed"},
+            )
+        self.assertEqual(response.status_code, 201)
+        page = Page.objects.get(pk=response.json()["page"])
+        self.assertEqual(page.type, Page.TYPE_SCANNED)
+        self.assertEqual(page.version_no, 1)
+        self.assertEqual(page.sha256, hashlib.sha256(self.content).hexdigest())
+        with page.scanned_text.open("rb") as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(PageUpload.objects.exists())
+        self.assertEqual(os.listdir(uploads.upload_directory()), [])
+
+        # a new version of the page
+        location = self.create()["Location"]
+        self.patch(location, 0, self.content)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                location + "finalize/", {"page": page.pk, "comments": "Again"}
+            )
+        self.assertEqual(response.json()["version_no"], 2)
+        self.assertEqual(page.history.first().history_change_reason, "Upload 2: Again")
+
+    def test_rejected_uploads(self):
+        """
+        Uploads over the size limit of their field are refused upfront,
+        uploads of the wrong type once their first bytes arrive, and an
+        invalid form keeps the upload for another try.
+        """
+        self.assertEqual(self.create(length=10240001).status_code, 413)
+        self.assertEqual(self.create(field="comments").status_code, 400)
+
+        text = b"text" * 1024
+        location = self.create(length=len(text))["Location"]
+        response = self.patch(location, 0, text)
+        self.assertEqual(response.status_code, 415)
+        self.assertContains(response, "text/plain", status_code=415)
+        self.assertFalse(PageUpload.objects.exists())
+        self.assertTemplateUsed(self.client.head(location), "404.html")
+
+        location = self.create(length=10)["Location"]
+        self.assertEqual(self.patch(location, 0, self.content[:20]).status_code, 413)
+
+        location = self.create()["Location"]
+        self.patch(location, 0, self.content)
+        response = self.client.post(location + "finalize/", {"page_no": 5, "volume_no": 30})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("volume_no", response.json()["errors"])
+        self.assertEqual(PageUpload.objects.count(), 2)
+
+        other = get_user_model().objects.create_superuser(username="other")
+        self.client.force_login(other)
+        self.assertTemplateUsed(self.client.head(location), "404.html")
+
+    def test_expire_uploads(self):
+        """
+        Uploads not continued within PAGE_UPLOAD_EXPIRY hours are removed,
+        together with stale files of interrupted uploads.
+        """
+        self.create()
+        old = PageUpload.objects.get()
+        self.create()
+        PageUpload.objects.filter(pk=old.pk).update(
+            updated=old.updated - timedelta(hours=settings.PAGE_UPLOAD_EXPIRY, seconds=1)
+        )
+        stray = os.path.join(uploads.upload_directory(), ".tmp-stray.upload.pdf")
+        open(stray, "wb").close()
+        os.utime(stray, (0, 0))
+
+        out = StringIO()
+        call_command("expire_uploads", stdout=out)
+        self.assertIn("Removed 2 uploads", out.getvalue())
+        self.assertEqual(PageUpload.objects.count(), 1)
+        self.assertEqual(
+            os.listdir(uploads.upload_directory()),
+            [PageUpload.objects.get().pk.hex + uploads.PART_SUFFIX],
+        )
+
+
+class BulkUploadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser(username="test")
+        cls.url = reverse("admin:books_page_bulk_upload")
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media_root = self.settings(MEDIA_ROOT=directory.name + "/")
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.client.force_login(self.user)
+        with open("pcdl_docs/test_pdf.pdf", "rb") as f:
+            self.content = f.read()
+
+    def test_bulk_upload(self):
+        """
+        New pages are created and existing ones get a new version, with a
+        result for every file of the archive.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            existing = Page.objects.create(
+                volume_no=3,
+                page_no=3,
+                type=Page.TYPE_SCANNED,
+                version_no=1,
+                scanned_text=SimpleUploadedFile("page.pdf", self.content),
+            )
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as f:
+            f.writestr("volume_3_page_1_scanned.pdf", self.content)
+            f.writestr("scans/volume_3_page_2_Typed.pdf", self.content)
+            f.writestr("volume_3_page_3_scanned.pdf", self.content + b"\n")
+            f.writestr("again/volume_3_page_1_scanned.pdf", self.content)
+            f.writestr("volume_3_page_4_scanned.pdf", b"text" * 1024)
+            f.writestr("notes.txt", b"notes")
+        archive.seek(0)
+        archive.name = "volume_3.zip"
+
+        response = self.client.get(reverse("admin:books_page_changelist"))
+        self.assertContains(response, self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {"archive": archive, "comments": "Volume 3"})
+        self.assertContains(response, "2 created, 1 updated, 3 failed.")
+        self.assertContains(response, "Duplicate of volume_3_page_1_scanned.pdf.")
+        self.assertContains(response, "Files of type text/plain are not supported.")
+        self.assertContains(response, "The name must be like")
+
+        pages = Page.objects.filter(volume_no=3).order_by("staff_order")
+        self.assertEqual(
+            [(page.page_no, page.type, page.version_no) for page in pages],
+            [(1, "Scanned", 1), (2, "Typed", 1), (3, "Scanned", 2)],
+        )
+        typed = pages[1]
+        self.assertEqual(typed.typed_text.name, "volume_3/page_2/volume_3_page_2_typed.pdf")
+        with typed.typed_text.open("rb") as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(typed.sha256, hashlib.sha256(self.content).hexdigest())
+        record = existing.history.first()
+        self.assertEqual(record.history_change_reason, "Upload 2: Volume 3")
+        self.assertEqual(record.history_user, self.user)
+        self.assertIsNotNone(versions.find(existing.scanned_text.name, 1))
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, ".uploads")), [])
+
+        response = self.client.post(self.url, {"archive": SimpleUploadedFile("pages.zip", b"not a zip")})
+        self.assertContains(response, "The file is not a ZIP archive.")
+
+    def test_bulk_upload_failures(self):
+        """
+        Only the volumes that got new pages are renumbered, and the files
+        that could not be saved do not stay behind.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Page.objects.create(
+                volume_no=4,
+                page_no=1,
+                type=Page.TYPE_SCANNED,
+                scanned_text=SimpleUploadedFile("page.pdf", self.content),
+            )
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as f:
+            f.writestr("volume_3_page_1_scanned.pdf", self.content)
+            f.writestr("volume_3_page_2_scanned.pdf", self.content + b"\n")
+        archive.seek(0)
+        archive.name = "volume_3.zip"
+        save = default_storage.save
+
+        def fail_second(name, content):
+            if "page_2" in name:
+                raise OSError("No space left on device")
+            return save(name, content)
+
+        with mock.patch.object(default_storage, "save", side_effect=fail_second), \
+                mock.patch.object(navigation, "rebuild", wraps=navigation.rebuild) as rebuild, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {"archive": archive})
+        self.assertContains(response, "1 created, 0 updated, 1 failed.")
+        self.assertContains(response, "No space left on device")
+        rebuild.assert_called_once_with(Page, volumes={3})
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, ".uploads")), [])
+        page = Page.objects.get(volume_no=3)
+        self.assertEqual(page.find_next_page(), other)
+
+
+@override_settings(PAGE_VOLUME_CHUNK_SIZE=2, PAGE_VOLUME_BUILD_ON_COMMIT=False)
+class VolumeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username="test")
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media_root = self.settings(MEDIA_ROOT=directory.name + "/")
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.client.force_login(self.user)
+        with open("pcdl_docs/test_pdf.pdf", "rb") as f:
+            self.content = f.read()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pages = [
+                Page.objects.create(
+                    volume_no=2,
+                    page_no=page_no,
+                    type=Page.TYPE_SCANNED,
+                    version_no=1,
+                    scanned_text=SimpleUploadedFile("page.pdf", self.content),
+                )
+                for page_no in range(1, 6)
+            ]
+
+    def merge(self, sources, target):
+        """
+        Concatenate the sources instead of merging them with pdfunite.
+        """
+        self.merged.append([os.path.basename(source) for source in sources])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            for source in sources:
+                with open(source, "rb") as s:
+                    f.write(s.read())
+
+    def volume_files(self):
+        return sorted(os.listdir(
+            os.path.join(settings.MEDIA_ROOT, volumes.volume_directory(2))
+        ))
+
+    @mock.patch("books.volumes.schedule")
+    @mock.patch("books.volumes.is_available", return_value=True)
+    @mock.patch("books.volumes.merge")
+    def test_incremental_build(self, merge, is_available, schedule):
+        """
+        A volume is merged from chunks of pages, and a new version of a page
+        only merges its chunk again. Readers' versions are merged.
+        """
+        merge.side_effect = self.merge
+        self.merged = []
+        status_url = reverse("volume_status", args=[2])
+        url = reverse("volume_file", args=[2])
+        detail_url = self.pages[0].get_absolute_url()
+        self.assertEqual(self.client.get(status_url).json()["status"], None)
+        self.assertContains(self.client.get(detail_url), url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(response.json()["up_to_date"])
+        schedule.assert_called_with(2)
+
+        # without pdfunite there is nothing to offer
+        is_available.return_value = False
+        self.assertNotContains(self.client.get(detail_url), url)
+        self.assertTemplateUsed(self.client.get(url), "404.html")
+        is_available.return_value = True
+
+        record = volumes.build(2)
+        self.assertEqual((record.status, record.pages, record.chunks), ("ready", 5, 3))
+        self.assertEqual(len(self.merged), 4)
+        self.assertEqual(len(self.merged[-1]), 3)
+        status = self.client.get(status_url).json()
+        self.assertTrue(status["up_to_date"])
+        self.assertEqual(status["url"], url)
+        response = self.client.get(url, HTTP_RANGE="bytes=0-4")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-")
+        self.assertEqual(response["Content-Range"], f"bytes 0-4/{5 * len(self.content)}")
+
+        # the typed version of a page with a scanned one changes nothing
+        with self.captureOnCommitCallbacks(execute=True):
+            Page.objects.create(
+                volume_no=2,
+                page_no=1,
+                type=Page.TYPE_TYPED,
+                typed_text=SimpleUploadedFile("page.pdf", self.content),
+            )
+        self.assertTrue(self.client.get(status_url).json()["up_to_date"])
+        self.merged = []
+        volumes.build(2)
+        self.assertEqual(self.merged, [])
+
+        page = self.pages[2]
+        with self.captureOnCommitCallbacks(execute=True):
+            page.version_no += 1
+            page.scanned_text = SimpleUploadedFile("page.pdf", self.content + b"\n")
+            page.save()
+        self.assertFalse(self.client.get(status_url).json()["up_to_date"])
+        old_files = self.volume_files()
+        record = volumes.build(2)
+        self.assertEqual(len(self.merged), 2)
+        self.assertEqual(
+            self.merged[0],
+            ["volume_2_page_3_scanned.pdf", "volume_2_page_4_scanned.pdf"],
+        )
+        self.assertEqual(len(self.merged[1]), 3)
+        files = self.volume_files()
+        self.assertEqual(len(files), 4)
+        self.assertEqual(len(set(files) - set(old_files)), 2)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response["Content-Length"]), 5 * len(self.content) + 1)
+        # unchanged pages are not read again for every request of the file
+        with mock.patch("books.volumes.plan", wraps=volumes.plan) as plan:
+            self.client.get(url, HTTP_RANGE="bytes=0-4")
+            self.client.get(url, HTTP_RANGE="bytes=5-9")
+        plan.assert_not_called()
+
+        # the last build is served while its next one fails
+        merge.side_effect = OSError("No space left on device")
+        Page.objects.filter(pk=page.pk).update(version_no=3)
+        cache.invalidate()
+        record = volumes.build(2)
+        self.assertEqual(record.status, VolumeBuild.STATUS_FAILED)
+        self.assertEqual(self.client.get(status_url).json()["error"], "No space left on device")
+        schedule.reset_mock()
+        self.assertEqual(self.client.get(url).status_code, 200)
+        # and is not tried again until the pages change, unless forced
+        schedule.assert_not_called()
+        merge.reset_mock()
+        volumes.build(2)
+        merge.assert_not_called()
+        volumes.build(2, force=True)
+        merge.assert_called()
+        Page.objects.filter(pk=page.pk).update(version_no=4)
+        cache.invalidate()
+        self.client.get(url)
+        schedule.assert_called_with(2)
+
+        # a build whose worker died is started again once it times out
+        schedule.reset_mock()
+        VolumeBuild.objects.filter(volume_no=2).update(
+            status=VolumeBuild.STATUS_BUILDING, started=timezone.now()
+        )
+        self.client.get(url)
+        schedule.assert_not_called()
+        with self.settings(PAGE_VOLUME_BUILD_TIMEOUT=0):
+            self.client.get(url)
+        schedule.assert_called_with(2)
+
+        response = self.client.get(reverse("volume_file", args=[7]))
+        self.assertTemplateUsed(response, "404.html")
+
+    @unittest.skipUnless(volumes.is_available(), "pdfunite is not installed")
+    def test_build(self):
+        """
+        pdfunite merges the pages of a volume.
+        """
+        record = volumes.build(2)
+        self.assertEqual(record.status, VolumeBuild.STATUS_READY)
+        with open(os.path.join(settings.MEDIA_ROOT, record.name), "rb") as f:
+            self.assertTrue(f.read().startswith(b"%PDF-"))
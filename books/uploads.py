@@ -0,0 +1,226 @@
+"""
+Resumable uploads of page files, in the manner of the tus protocol.
+
+An upload is created with the form field it is for and its length. Its
+bytes are then sent in any number of PATCH requests, each continuing at the
+current offset, which is the size of the partial file; after a broken
+transfer the client asks for the offset and resumes from there. Requests
+are streamed to the file in CHUNK_SIZE pieces.
+
+A complete upload is finalized through the page form, which validates it
+like any other upload and saves the page version. Partial files are kept in
+UPLOAD_DIRECTORY under MEDIA_ROOT, so storing them is a rename. Uploads not
+continued for PAGE_UPLOAD_EXPIRY hours are removed by expire_uploads.
+
+Partial files are written in place, so they must not share their content
+with other names: dedupe_media leaves UPLOAD_DIRECTORY alone, and a partial
+file linked elsewhere gets a copy of its own before it is written to.
+"""
+from datetime import timedelta
+import fcntl
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from core.files import CHUNK_SIZE
+from core.storage import STALE_TEMPORARY_AGE, TEMPORARY_PREFIX
+from core.uploadhandlers import (
+    get_validator, StoredUploadedFile, UPLOAD_DIRECTORY,
+)
+from core.validators import SNIFF_SIZE
+
+
+PART_SUFFIX = ".part"
+
+
+class UploadError(Exception):
+    """
+    A request the upload cannot take, with the HTTP status to answer.
+    """
+    status = 400
+
+    def __init__(self, message, offset=None):
+        super().__init__(message)
+        self.offset = offset
+
+
+class OffsetMismatch(UploadError):
+    status = 409
+
+
+class UploadTooLarge(UploadError):
+    status = 413
+
+
+class UnsupportedType(UploadError):
+    status = 415
+
+
+class UploadLocked(UploadError):
+    status = 423
+
+
+def upload_directory():
+    return os.path.join(settings.MEDIA_ROOT, UPLOAD_DIRECTORY)
+
+
+def part_path(upload):
+    return os.path.join(upload_directory(), upload.pk.hex + PART_SUFFIX)
+
+
+def get_offset(upload):
+    try:
+        return os.path.getsize(part_path(upload))
+    except FileNotFoundError:
+        return 0
+
+
+def create(user, field, filename, length):
+    """
+    Start an upload of length bytes for the form field.
+    """
+    PageUpload = apps.get_model("books", "PageUpload")
+    validator = get_validator(field)
+    if field not in dict(PageUpload._meta.get_field("field").choices) or validator is None:
+        raise UploadError(f"Unknown field {field!r}.")
+    if length < 1:
+        raise UploadError("The upload is empty.")
+    if validator.max_size is not None and length > validator.max_size:
+        raise UploadTooLarge(validator.size_error(length).messages[0])
+    upload = PageUpload.objects.create(
+        user=user, field=field, filename=os.path.basename(filename), length=length
+    )
+    os.makedirs(upload_directory(), exist_ok=True)
+    open(part_path(upload), "xb").close()
+    return upload
+
+
+def _unshare(path):
+    """
+    Give path a copy of its content of its own, if it is a hard link that
+    other names share, so that writing to it leaves them alone.
+    """
+    if os.stat(path).st_nlink == 1:
+        return
+    fd, temporary = tempfile.mkstemp(
+        prefix=TEMPORARY_PREFIX, dir=os.path.dirname(path)
+    )
+    try:
+        with os.fdopen(fd, "wb") as f, open(path, "rb") as source:
+            shutil.copyfileobj(source, f, CHUNK_SIZE)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def append(upload, offset, stream):
+    """
+    Write the bytes of stream to the upload at offset, which must be the
+    current one, and return the new offset. The bytes received before an
+    error or a disconnect are kept.
+    """
+    validator = get_validator(upload.field)
+    path = part_path(upload)
+    try:
+        _unshare(path)
+        f = open(path, "r+b")
+    except FileNotFoundError:
+        raise UploadError("The upload has expired.")
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadLocked("The upload is being written by another request.")
+        start = written = os.fstat(f.fileno()).st_size
+        if offset != start:
+            raise OffsetMismatch(f"The upload is at offset {start}.", start)
+        f.seek(start)
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if written + len(chunk) > upload.length:
+                    raise UploadTooLarge(
+                        f"The upload is longer than {upload.length} bytes.", written
+                    )
+                f.write(chunk)
+                written += len(chunk)
+        finally:
+            f.flush()
+            os.fsync(f.fileno())
+            upload.save(update_fields=["updated"])
+
+        if start < SNIFF_SIZE and (written >= SNIFF_SIZE or written == upload.length):
+            f.seek(0)
+            try:
+                validator.check_content_type(f.read(SNIFF_SIZE))
+            except ValidationError as e:
+                discard(upload)
+                raise UnsupportedType(e.messages[0])
+    return written
+
+
+def finalize(upload):
+    """
+    The uploaded file, for the page form. The upload has to be complete.
+    """
+    offset = get_offset(upload)
+    if offset != upload.length:
+        raise OffsetMismatch(
+            f"The upload is at offset {offset} of {upload.length}.", offset
+        )
+    return StoredUploadedFile(
+        part_path(upload),
+        upload.filename,
+        mimetypes.guess_type(upload.filename)[0],
+    )
+
+
+def discard(upload):
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def expire(now=None):
+    """
+    Remove the uploads not continued for PAGE_UPLOAD_EXPIRY hours, and the
+    stale files of interrupted uploads. Returns the number removed.
+    """
+    PageUpload = apps.get_model("books", "PageUpload")
+    now = now or timezone.now()
+    cutoff = now - timedelta(hours=settings.PAGE_UPLOAD_EXPIRY)
+    expired = list(PageUpload.objects.filter(updated__lt=cutoff))
+    for upload in expired:
+        discard(upload)
+
+    directory = upload_directory()
+    if not os.path.isdir(directory):
+        return len(expired)
+    active = {
+        pk.hex + PART_SUFFIX
+        for pk in PageUpload.objects.values_list("pk", flat=True)
+    }
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.name in active:
+            continue
+        try:
+            if time.time() - entry.stat().st_mtime > STALE_TEMPORARY_AGE:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return len(expired) + removed
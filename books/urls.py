@@ -1,8 +1,15 @@
 from django.urls import path
 
-from .views import PageListView, PageDetailView
+from .views import (
+    PageListView, PageDetailView, PageDownloadView, PageSearchView,
+    VolumeFileView, VolumeStatusView,
+)
 
 urlpatterns = [
     path('', PageListView.as_view(), name='page_list'),
+    path('search/', PageSearchView.as_view(), name='page_search'),
+    path('download/', PageDownloadView.as_view(), name='page_download'),
+    path('Volume-<int:volume>/pdf/', VolumeFileView.as_view(), name='volume_file'),
+    path('Volume-<int:volume>/pdf/status/', VolumeStatusView.as_view(), name='volume_status'),
     path('Volume-<slug:volume>/Page-<slug:page>/<slug:type>/detail/', PageDetailView.as_view(), name='page_detail'),
 ]
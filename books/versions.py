@@ -0,0 +1,160 @@
+"""
+Retention of the files of earlier versions of pages.
+
+When a page gets a new file, the file of the version it replaces is kept
+under VERSIONS_DIRECTORY, named after the file and its version number:
+
+    versions/volume_1/page_3/volume_1_page_3_scanned.pdf.v2
+
+The archive starts as a hard link to the old file, so nothing is copied
+while the upload is saved. It is made once the upload commits, before the
+storage puts the new file in place, so a rolled back upload leaves none. The compact_versions command later compresses
+archives with gzip (.v2.gz) and applies the retention policy: an archive
+is deleted once it is neither among the PAGE_VERSIONS_KEEP latest versions
+of its file nor younger than PAGE_VERSIONS_MAX_AGE days, counted from the
+upload that replaced it.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+import gzip
+import os
+import re
+import shutil
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+
+VERSIONS_DIRECTORY = "versions"
+
+ARCHIVE_RE = re.compile(r"^(?P<name>.+)\.v(?P<version_no>\d+)(?P<compressed>\.gz)?$")
+
+
+def archive_path(name, version_no, compressed=False):
+    return os.path.join(
+        settings.MEDIA_ROOT,
+        VERSIONS_DIRECTORY,
+        "{}.v{}{}".format(name, version_no, ".gz" if compressed else ""),
+    )
+
+
+def archive(name, version_no):
+    """
+    Keep the file name as the given version, before it is replaced.
+    """
+    source = os.path.join(settings.MEDIA_ROOT, name)
+    target = archive_path(name, version_no)
+    if not name or not os.path.isfile(source) or find(name, version_no):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def archive_on_commit(name, version_no):
+    """
+    Archive the file name as the given version once the current
+    transaction commits.
+    """
+    transaction.on_commit(lambda: archive(name, version_no))
+
+
+def find(name, version_no):
+    """
+    Path of an archived version and whether it is compressed, or None.
+    """
+    for compressed in (False, True):
+        path = archive_path(name, version_no, compressed)
+        if os.path.isfile(path):
+            return path, compressed
+    return None
+
+
+def open_version(name, version_no):
+    """
+    Binary file object with the content of an archived version, or None.
+    """
+    found = find(name, version_no)
+    if found is None:
+        return None
+    path, compressed = found
+    return gzip.open(path, "rb") if compressed else open(path, "rb")
+
+
+def compress(path):
+    """
+    Replace an archive with its gzip-compressed copy.
+    Returns the number of bytes saved.
+    """
+    target = path + ".gz"
+    temporary = target + ".tmp"
+    with open(path, "rb") as source, gzip.open(temporary, "wb") as f:
+        shutil.copyfileobj(source, f)
+    os.replace(temporary, target)
+    size = os.stat(path)
+    os.remove(path)
+    # a hard link shared with a live file frees nothing
+    saved = size.st_size if size.st_nlink == 1 else 0
+    return saved - os.path.getsize(target)
+
+
+def archives():
+    """
+    The archived versions of every file, as {name: {version_no: path}}.
+    """
+    root = os.path.join(settings.MEDIA_ROOT, VERSIONS_DIRECTORY)
+    found = defaultdict(dict)
+    for directory, _, files in os.walk(root):
+        for file in files:
+            match = ARCHIVE_RE.match(file)
+            if not match:
+                continue
+            relative = os.path.relpath(directory, root)
+            name = os.path.normpath(os.path.join(relative, match["name"])).replace(os.sep, "/")
+            found[name][int(match["version_no"])] = os.path.join(directory, file)
+    return found
+
+
+def replaced_at(history, name):
+    """
+    When each version of the file name was replaced by the next upload,
+    according to the history of the pages, as {version_no: datetime}.
+    """
+    uploads = dict(
+        history.filter(Q(scanned_text=name) | Q(typed_text=name))
+        .values_list("version_no")
+        .annotate(uploaded=Min("history_date"))
+    )
+    dates = {}
+    for version_no in uploads:
+        later = [date for v, date in uploads.items() if v > version_no]
+        if later:
+            dates[version_no] = min(later)
+    return dates
+
+
+def expired(history, keep=None, max_age=None, now=None):
+    """
+    Paths of the archives the retention policy gives up, and of the ones
+    it keeps.
+    """
+    keep = settings.PAGE_VERSIONS_KEEP if keep is None else keep
+    max_age = settings.PAGE_VERSIONS_MAX_AGE if max_age is None else max_age
+    cutoff = (now or timezone.now()) - timedelta(days=max_age)
+    remove, retain = [], []
+    for name, versions in archives().items():
+        dates = replaced_at(history, name)
+        for rank, version_no in enumerate(sorted(versions, reverse=True)):
+            path = versions[version_no]
+            date = dates.get(version_no) or datetime.fromtimestamp(
+                os.path.getmtime(path), tz=dt_timezone.utc
+            )
+            if rank < keep or date > cutoff:
+                retain.append(path)
+            else:
+                remove.append(path)
+    return remove, retain
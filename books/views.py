@@ -1,15 +1,75 @@
+import hashlib
+
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import Max
+from django_filters.constants import EMPTY_VALUES
 from django_filters.views import FilterView
-from django.http import Http404
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, JsonResponse,
+    StreamingHttpResponse,
+)
+from django.middleware.csrf import get_token
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from django_tables2 import SingleTableMixin
+from django.views.generic import TemplateView, View
 from django.views.generic.detail import DetailView
 
+from core.filters import parse_page_ranges
+from core.sendfile import sendfile
+
+from . import cache, downloads, previews, search, volumes
 from .filters import PageFilterStaff, PageFilterUser
-from .models import Page
+from .models import Page, VolumeBuild
+from .pagination import CachedCountPaginator, CursorPaginator
 from .tables import PageTableStaff, PageTableUser
 
 
-class PageListView(LoginRequiredMixin, SingleTableMixin, FilterView):
+class ConditionalGetMixin:
+    """
+    Answer conditional GET requests with 304 Not Modified while no page has
+    changed, without rendering or querying pages. The HTML also shows the
+    user's name, role and CSRF token, so the ETag depends on them too.
+
+    The change stamp is read from the page history on every request, not
+    from the cache: a process-local cache would keep answering 304 after
+    another process changed a page.
+    """
+
+    def get_last_modified(self, request, *args, **kwargs):
+        if not hasattr(self, "_last_changed"):
+            self._last_changed = Page.history.aggregate(
+                changed=Max("history_date")
+            )["changed"]
+        return self._last_changed
+
+    def get_etag(self, request, *args, **kwargs):
+        changed = self.get_last_modified(request)
+        user = request.user
+        parts = (
+            changed and changed.isoformat(),
+            user.pk,
+            user.username,
+            user.is_staff,
+            # sets the CSRF cookie the page will use, if there is none yet
+            get_token(request) and request.META.get("CSRF_COOKIE"),
+        )
+        return hashlib.md5(repr(parts).encode()).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        get = condition(
+            etag_func=self.get_etag, last_modified_func=self.get_last_modified
+        )(super().get)
+        response = get(request, *args, **kwargs)
+        # browsers revalidate every time instead of guessing a lifetime
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class PageListView(
+    LoginRequiredMixin, ConditionalGetMixin, SingleTableMixin, FilterView
+):
     model = Page
     context_object_name = "page_list"
     template_name = "books/page_list.html"
@@ -20,8 +80,77 @@ class PageListView(LoginRequiredMixin, SingleTableMixin, FilterView):
     def get_filterset_class(self, **kwargs):
         return PageFilterStaff if self.request.user.is_staff else PageFilterUser
 
+    def get_filter_key(self):
+        """
+        Identify the result set by the user role and the normalized filters.
+        """
+        form = self.filterset.form
+        if not form.is_valid():
+            return None
+        filters = []
+        for name, value in sorted(form.cleaned_data.items()):
+            if value in EMPTY_VALUES:
+                continue
+            if isinstance(value, list):
+                value = sorted(v.strip() for v in value)
+            filters.append((name, str(value)))
+        return ("staff" if self.request.user.is_staff else "reader", tuple(filters))
+
+    def get_fragment_key(self, table):
+        """
+        Identify the rendered rows of the table by the result set, the sort
+        and the page; None when the filters are invalid.
+        """
+        filter_key = self.get_filter_key()
+        paginator = getattr(table, "paginator", None)
+        if filter_key is None or paginator is None:
+            return None
+        return cache.make_key(
+            "table",
+            filter_key,
+            tuple(str(order) for order in table.order_by or ()),
+            paginator.per_page,
+            getattr(table.page, "number", None),
+            getattr(paginator, "cursor", None),
+        )
+
+    def get_table(self, **kwargs):
+        table = super().get_table(**kwargs)
+        table.fragment_key = self.get_fragment_key(table)
+        return table
+
+    def uses_cursor_pagination(self):
+        """
+        Cursor pagination is opted into with ?pagination=cursor, and used
+        for the sort orders an index supports; the others fall back to
+        page numbers.
+        """
+        return (
+            self.request.GET.get("pagination") == "cursor"
+            and CursorPaginator.supports(self.request.GET.get("sort") or None)
+        )
+
+    def get_table_kwargs(self):
+        if self.uses_cursor_pagination():
+            return {"template_name": "books/cursor_table.html"}
+        return {}
 
-class PageDetailView(LoginRequiredMixin, DetailView):
+    def get_table_pagination(self, table):
+        # the footer total and the paginator share one cached count
+        paginate = {
+            "paginator_class": CachedCountPaginator,
+            "count_key": self.get_filter_key(),
+        }
+        if self.uses_cursor_pagination():
+            paginate.update(
+                paginator_class=CursorPaginator,
+                sort=self.request.GET.get("sort") or None,
+                cursor=self.request.GET.get("cursor"),
+            )
+        return paginate
+
+
+class PageDetailView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
     model = Page
     context_object_name = "page"
     template_name = "books/page_detail.html"
@@ -36,43 +165,144 @@ class PageDetailView(LoginRequiredMixin, DetailView):
         page_slug = self.kwargs.get(self.page_slug_url_kwarg)
         volume_slug = self.kwargs.get(self.volume_slug_url_kwarg)
         type_slug = self.kwargs.get(self.type_slug_url_kwarg)
-        queryset = Page.objects.filter(
-            **{
-                self.page_slug_field: page_slug,
-                self.volume_slug_field: volume_slug
-            }
-        )
-        if not self.request.user.is_staff:
-            try:
-                obj = queryset.filter(type=Page.TYPE_SCANNED).get()
-            except queryset.model.DoesNotExist:
-                try:
-                    obj = queryset.filter(type=Page.TYPE_TYPED).get()
-                except queryset.model.DoesNotExist:
-                    raise Http404(
-                        "No %(verbose_name)s found matching the query"
-                        % {"verbose_name": queryset.model._meta.verbose_name}
-                    )
+        # readers get the scanned text if it exists, staff the exact type
+        if queryset is None:
+            get_with_neighbours = cache.get_with_neighbours
         else:
-            try:
-                obj = queryset.filter(type=type_slug).get()
-            except queryset.model.DoesNotExist:
-                raise Http404(
-                    "No %(verbose_name)s found matching the query"
-                    % {"verbose_name": queryset.model._meta.verbose_name}
-                )
+            get_with_neighbours = queryset.get_with_neighbours
+        self.previous_page, obj, self.next_page = get_with_neighbours(
+            volume_slug, page_slug, type_slug, is_staff=self.request.user.is_staff
+        )
+        if obj is None:
+            raise Http404(
+                "No %(verbose_name)s found matching the query"
+                % {"verbose_name": self.model._meta.verbose_name}
+            )
         return obj
 
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data()
-        page = context["page"]
-        context["next_page"] = (
-            page.find_next_page(is_staff=True) if self.request.user.is_staff
-                else page.find_next_page()
+        context["next_page"] = self.next_page
+        context["previous_page"] = self.previous_page
+        context["volume_file"] = volumes.is_available()
+        return context
+
+
+class PageSearchView(LoginRequiredMixin, TemplateView):
+    """
+    Full-text search over the text of typed pages. Readers are shown the
+    version of each matching page they see in the page list.
+    """
+    template_name = "books/page_search.html"
+    paginate_by = 20
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get("q", "").strip()
+        hits, next_cursor = [], None
+        if query:
+            hits, next_cursor = search.search(
+                query,
+                is_staff=self.request.user.is_staff,
+                limit=self.paginate_by,
+                cursor=self.request.GET.get("cursor"),
+            )
+        context.update(query=query, hits=hits, next_cursor=next_cursor)
+        return context
+
+
+class PageFileView(LoginRequiredMixin, View):
+    """
+    Serve the files of pages and their previews. Readers only get the
+    version of a page they are shown in the page list, staff any version.
+    """
+
+    def get(self, request, path):
+        name = previews.source_name(path) or path
+        version = cache.get_file_version(name, is_staff=request.user.is_staff)
+        if version is None:
+            raise Http404("No such file")
+        # the checksum is recorded on upload; pages saved before it was
+        # are told apart by their version alone
+        version_no, sha256 = version
+        etag = '"{}-{}"'.format(version_no, sha256[:32]) if sha256 else '"{}"'.format(version_no)
+        return sendfile(request, path, etag=etag)
+
+
+class PageDownloadView(LoginRequiredMixin, View):
+    """
+    Stream a ZIP archive of the files of a volume, or of the pages of it
+    given with the filters of the page list, e.g.
+    ?volume_no=3&page_no=1-20,35. Readers get the version of each page they
+    are shown in the page list, staff every version.
+    """
+
+    def get(self, request):
+        if request.user.is_staff:
+            filterset_class = PageFilterStaff
+        else:
+            filterset_class = PageFilterUser
+        filterset = filterset_class(
+            data=request.GET, queryset=Page.objects.all(), request=request
         )
-        context["previous_page"] = (
-            page.find_previous_page(is_staff=True) if self.request.user.is_staff
-                else page.find_previous_page()
+        form = filterset.form
+        if not form.is_valid() or form.cleaned_data.get("volume_no") is None:
+            return HttpResponseBadRequest("Choose a volume and, optionally, pages.")
+        pages = filterset.qs
+        if not pages.exists():
+            raise Http404("No pages match the query")
+
+        if not downloads.acquire():
+            response = HttpResponse(
+                "Too many downloads are running, please try again shortly.",
+                status=503,
+            )
+            response["Retry-After"] = "30"
+            return response
+        try:
+            stream = downloads.download_pages(pages)
+        except Exception:
+            downloads.release()
+            raise
+        response = StreamingHttpResponse(stream, content_type="application/zip")
+        name = downloads.archive_name(
+            form.cleaned_data["volume_no"],
+            parse_page_ranges(form.cleaned_data.get("page_no") or []),
         )
-        return context
+        response["Content-Disposition"] = f'attachment; filename="{name}"'
+        return response
+
+
+class VolumeFileView(LoginRequiredMixin, View):
+    """
+    Serve the merged PDF of a volume. While a new build runs, the previous
+    one is served; a volume that was never built is built first, if
+    pdfunite is installed.
+    """
+
+    def get(self, request, volume):
+        build = VolumeBuild.objects.filter(volume_no=volume).first()
+        can_build = volumes.is_available()
+        if can_build and volumes.should_build(volume, build):
+            volumes.schedule(volume)
+        if build is None or not build.name:
+            if not can_build or not Page.objects.filter(volume_no=volume).exists():
+                raise Http404("No such volume")
+            response = JsonResponse(volumes.status(volume), status=202)
+            response["Retry-After"] = "10"
+            return response
+        # volume_<volume_no>.<key>.pdf
+        etag = '"{}"'.format(build.name.rsplit(".", 2)[1])
+        return sendfile(request, build.name, etag=etag)
+
+
+class VolumeStatusView(LoginRequiredMixin, View):
+    """
+    The state of the merged PDF of a volume, as JSON.
+    """
+
+    def get(self, request, volume):
+        status = volumes.status(volume)
+        status["url"] = reverse("volume_file", args=[volume]) if status["available"] else None
+        return JsonResponse(status)
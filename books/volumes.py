@@ -0,0 +1,302 @@
+"""
+Merged PDFs of whole volumes, in reading order.
+
+The merged PDF of a volume holds the pages readers are shown, the scanned
+version of a page if there is one and the typed version otherwise, so that
+a volume can be read without loading every page on its own. It is served
+with byte ranges like the page files.
+
+Volumes are merged with pdfunite (poppler-utils) in chunks of
+PAGE_VOLUME_CHUNK_SIZE page numbers. A chunk is named after the versions
+of its pages, so after a page changes only its chunk is merged again, and
+the volume is then put together from the chunks. The files are kept under
+VOLUME_DIRECTORY in MEDIA_ROOT, e.g. for volume 3:
+
+    .volumes/volume_3/chunk_<key>.pdf
+    .volumes/volume_3/volume_3.<key>.pdf
+
+The latest merged PDF is served until the next build replaces it; the
+files of earlier builds are removed then.
+
+Builds run in a background thread once a change to a volume commits, when
+PAGE_VOLUME_BUILD_ON_COMMIT is set, and with the build_volumes command.
+VolumeBuild records their progress. A failed build is not tried again in
+the background until the pages of the volume change; a build still
+running after PAGE_VOLUME_BUILD_TIMEOUT seconds is taken for one whose
+worker died, and started again.
+
+Without pdfunite no volumes are built.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from core.storage import TEMPORARY_PREFIX
+from . import cache
+
+
+logger = logging.getLogger(__name__)
+
+VOLUME_DIRECTORY = ".volumes"
+
+Chunk = namedtuple("Chunk", ["key", "names"])
+
+_executor = None
+_lock = threading.Lock()
+_scheduled = set()
+
+
+def is_available():
+    return shutil.which("pdfunite") is not None
+
+
+def volume_directory(volume_no):
+    return os.path.join(VOLUME_DIRECTORY, f"volume_{volume_no}")
+
+
+def chunk_name(volume_no, key):
+    return os.path.join(volume_directory(volume_no), f"chunk_{key}.pdf")
+
+
+def volume_name(volume_no, key):
+    return os.path.join(volume_directory(volume_no), f"volume_{volume_no}.{key}.pdf")
+
+
+def _key(parts):
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+
+def plan(volume_no, chunk_size=None):
+    """
+    The chunks of the volume, in reading order, and the key of the volume.
+    Returns ([], None) for a volume without pages.
+    """
+    Page = apps.get_model("books", "Page")
+    chunk_size = chunk_size or settings.PAGE_VOLUME_CHUNK_SIZE
+    rows = (
+        Page.objects.filter(volume_no=volume_no, is_reader_canonical=True)
+        .order_by("reader_order")
+        .values_list("page_no", "version_no", "sha256", "scanned_text", "typed_text")
+    )
+    groups = {}
+    for page_no, version_no, sha256, scanned, typed in rows:
+        groups.setdefault((page_no - 1) // chunk_size, []).append(
+            (page_no, version_no, sha256, scanned or typed)
+        )
+    chunks = [
+        Chunk(_key(pages), [name for *_, name in pages])
+        for _, pages in sorted(groups.items())
+    ]
+    if not chunks:
+        return [], None
+    return chunks, _key([chunk.key for chunk in chunks])
+
+
+def merge(sources, target):
+    """
+    Merge the PDFs sources, absolute paths, into target. The target only
+    appears once it is complete.
+    """
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    fd, partial = tempfile.mkstemp(prefix=TEMPORARY_PREFIX, suffix=".part", dir=directory)
+    os.close(fd)
+    try:
+        if len(sources) == 1:
+            shutil.copyfile(sources[0], partial)
+        else:
+            subprocess.run(
+                ["pdfunite", *sources, partial],
+                check=True,
+                capture_output=True,
+                timeout=600,
+            )
+        os.replace(partial, target)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def _remove_stale(volume_no, keep):
+    directory = os.path.join(settings.MEDIA_ROOT, volume_directory(volume_no))
+    if not os.path.isdir(directory):
+        return
+    keep = {os.path.basename(name) for name in keep}
+    for entry in os.scandir(directory):
+        if entry.name not in keep and not entry.name.startswith(TEMPORARY_PREFIX):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def current_key(volume_no):
+    """
+    The key of the volume as its pages are now, cached until a page
+    changes.
+    """
+    return cache.lookup("volume", (volume_no,), lambda: plan(volume_no)[1])
+
+
+def should_build(volume_no, record=None):
+    """
+    Whether the volume needs a build: it was never built, its pages changed
+    since, its file is missing, or its build stalled. Builds that are
+    running, or that failed for the same pages, are left alone. record is
+    its VolumeBuild, if any.
+    """
+    VolumeBuild = apps.get_model("books", "VolumeBuild")
+    key = current_key(volume_no)
+    if key is None:
+        return False
+    if record is None:
+        return True
+    if record.status == VolumeBuild.STATUS_BUILDING:
+        timeout = getattr(settings, "PAGE_VOLUME_BUILD_TIMEOUT", 3600)
+        return record.started is None or (
+            timezone.now() - record.started
+        ).total_seconds() > timeout
+    if record.key != key:
+        return True
+    return record.status == VolumeBuild.STATUS_READY and not os.path.isfile(
+        os.path.join(settings.MEDIA_ROOT, volume_name(volume_no, key))
+    )
+
+
+def build(volume_no, force=False):
+    """
+    Merge the chunks of the volume that changed, and the volume from its
+    chunks, unless it is up to date, or failed for the same pages before
+    and force is not set. Returns the VolumeBuild, or None if the volume
+    has no pages.
+    """
+    VolumeBuild = apps.get_model("books", "VolumeBuild")
+    chunks, key = plan(volume_no)
+    if key is None:
+        VolumeBuild.objects.filter(volume_no=volume_no).delete()
+        shutil.rmtree(
+            os.path.join(settings.MEDIA_ROOT, volume_directory(volume_no)),
+            ignore_errors=True,
+        )
+        return None
+
+    record, _ = VolumeBuild.objects.get_or_create(
+        volume_no=volume_no, defaults={"status": VolumeBuild.STATUS_BUILDING}
+    )
+    name = volume_name(volume_no, key)
+    target = os.path.join(settings.MEDIA_ROOT, name)
+    if record.key == key and record.status == VolumeBuild.STATUS_READY and os.path.isfile(target):
+        return record
+    if record.key == key and record.status == VolumeBuild.STATUS_FAILED and not force:
+        return record
+
+    record.status = VolumeBuild.STATUS_BUILDING
+    record.key = key
+    record.pages = sum(len(chunk.names) for chunk in chunks)
+    record.chunks = len(chunks)
+    record.chunks_built = 0
+    record.error = ""
+    record.started = timezone.now()
+    record.save()
+    chunk_paths = []
+    try:
+        for chunk in chunks:
+            path = os.path.join(settings.MEDIA_ROOT, chunk_name(volume_no, chunk.key))
+            if not os.path.isfile(path):
+                merge(
+                    [os.path.join(settings.MEDIA_ROOT, name) for name in chunk.names],
+                    path,
+                )
+            chunk_paths.append(path)
+            record.chunks_built += 1
+            VolumeBuild.objects.filter(pk=record.pk).update(
+                chunks_built=record.chunks_built
+            )
+        merge(chunk_paths, target)
+    except (OSError, subprocess.SubprocessError) as e:
+        stderr = getattr(e, "stderr", None)
+        record.status = VolumeBuild.STATUS_FAILED
+        record.error = stderr.decode(errors="replace").strip() if stderr else str(e)
+        record.finished = timezone.now()
+        record.save()
+        logger.error("Building volume %s failed: %s", volume_no, record.error)
+        return record
+
+    record.status = VolumeBuild.STATUS_READY
+    record.name = name
+    record.finished = timezone.now()
+    record.save()
+    _remove_stale(volume_no, chunk_paths + [target])
+    return record
+
+
+def status(volume_no):
+    """
+    The state of the merged PDF of the volume, for the build status API.
+    """
+    VolumeBuild = apps.get_model("books", "VolumeBuild")
+    record = VolumeBuild.objects.filter(volume_no=volume_no).first()
+    if record is None:
+        record = VolumeBuild(volume_no=volume_no)
+    _, key = plan(volume_no)
+    return {
+        "volume_no": volume_no,
+        "status": record.status or None,
+        "up_to_date": key == (
+            record.key if record.status == VolumeBuild.STATUS_READY else None
+        ),
+        "available": bool(record.name),
+        "pages": record.pages,
+        "chunks": record.chunks,
+        "chunks_built": record.chunks_built,
+        "started": record.started and record.started.isoformat(),
+        "finished": record.finished and record.finished.isoformat(),
+        "error": record.error,
+    }
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1)
+    return _executor
+
+
+def _run(volume_no):
+    with _lock:
+        _scheduled.discard(volume_no)
+    try:
+        build(volume_no)
+    except Exception:
+        logger.exception("Building volume %s failed", volume_no)
+    finally:
+        connections.close_all()
+
+
+def schedule(volume_no):
+    """
+    Build the volume in the background once the current transaction
+    commits. Saving many pages of a volume schedules a single build.
+    """
+    if not is_available() or not getattr(settings, "PAGE_VOLUME_BUILD_ON_COMMIT", True):
+        return
+
+    def submit():
+        with _lock:
+            if volume_no in _scheduled:
+                return
+            _scheduled.add(volume_no)
+        get_executor().submit(_run, volume_no)
+
+    transaction.on_commit(submit)
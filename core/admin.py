@@ -2,6 +2,10 @@ from django.db.models import OuterRef, F, Count, Subquery
 from django.conf import settings
 from django.contrib import admin
 from django.contrib.admin.utils import unquote
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.urls import path, reverse
+from django.utils.html import format_html
 from django.utils.encoding import force_str
 from django.utils.text import capfirst
 from simple_history.admin import SimpleHistoryAdmin
@@ -15,6 +19,54 @@ USER_NATURAL_KEY = tuple(key.lower() for key in settings.AUTH_USER_MODEL.split("
 
 class CustomHistoryAdmin(SimpleHistoryAdmin):
 
+    def get_urls(self):
+        opts = self.model._meta
+        return [
+            path(
+                "<path:object_id>/history/<int:history_id>/download/",
+                self.admin_site.admin_view(self.history_download_view),
+                name="%s_%s_history_download" % (opts.app_label, opts.model_name),
+            ),
+        ] + super().get_urls()
+
+    def history_download_url(self, record):
+        opts = self.model._meta
+        return reverse(
+            "admin:%s_%s_history_download" % (opts.app_label, opts.model_name),
+            args=[record.pk, record.history_id],
+            current_app=self.admin_site.name,
+        )
+
+    def download(self, record):
+        """
+        History column linking to the file of a historical record.
+        """
+        if not self.has_history_file(record):
+            return ""
+        return format_html('<a href="{}">Download</a>', self.history_download_url(record))
+
+    def has_history_file(self, record):
+        return False
+
+    def history_file_response(self, request, record):
+        """
+        Response sending the file of a historical record, to be implemented
+        by the admins of models with files.
+        """
+        raise Http404("No file for this record")
+
+    def history_download_view(self, request, object_id, history_id):
+        history = getattr(self.model, self.model._meta.simple_history_manager_attribute)
+        try:
+            record = history.get(
+                **{self.model._meta.pk.attname: unquote(object_id), "history_id": history_id}
+            )
+        except history.model.DoesNotExist:
+            raise Http404("No such record")
+        if not self.has_change_permission(request, record.instance):
+            raise PermissionDenied
+        return self.history_file_response(request, record)
+
     def history_view(self, request, object_id, extra_context=None):
         """The 'history' admin view for this model."""
         request.current_app = self.admin_site.name
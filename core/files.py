@@ -0,0 +1,58 @@
+import hashlib
+import os
+
+from django.core.cache import cache
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def sha256_file(path, chunk_size=CHUNK_SIZE):
+    """
+    SHA-256 hex digest of a file, read in chunks of constant size.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+PDF_HEADER = b"%PDF-"
+
+PDF_TRAILER = b"%%EOF"
+
+# where the end-of-file marker of a PDF is looked for
+PDF_TRAILER_WINDOW = 1024
+
+
+def inspect_pdf(path, chunk_size=CHUNK_SIZE):
+    """
+    SHA-256 hex digest of a file, and whether it looks like a whole PDF:
+    it starts with the PDF header and has an end-of-file marker in its
+    last kilobyte, which truncated files lack. One pass, constant memory.
+    """
+    digest = hashlib.sha256()
+    head = tail = b""
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+            if len(head) < len(PDF_HEADER):
+                head += chunk[:len(PDF_HEADER) - len(head)]
+            tail = (tail + chunk)[-PDF_TRAILER_WINDOW:]
+    return digest.hexdigest(), head == PDF_HEADER and PDF_TRAILER in tail
+
+
+def cached_sha256(path):
+    """
+    SHA-256 of a file, cached until the file is modified.
+    """
+    stat = os.stat(path)
+    key = "core:sha256:{}".format(
+        hashlib.md5(f"{path}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+    )
+    digest = cache.get(key)
+    if digest is None:
+        digest = sha256_file(path)
+        cache.set(key, digest, timeout=None)
+    return digest
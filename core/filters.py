@@ -1,3 +1,4 @@
+from django.db.models import Q
 from django.forms import Field
 from django_filters import Filter
 from django_filters.widgets import CSVWidget
@@ -6,6 +7,30 @@ from django_filters.constants import EMPTY_VALUES
 from core.validators import validate_page_filter
 
 
+def parse_page_ranges(values):
+    """
+    Turn page numbers and ranges, e.g. ["5", "10-14", "12-20"], into sorted,
+    non overlapping (start, end) intervals: [(5, 5), (10, 20)].
+    Ranges ending before they start are ignored.
+    """
+    intervals = []
+    for v in values:
+        start, _, end = v.strip().partition('-')
+        start = int(start)
+        end = int(end) if end else start
+        if start <= end:
+            intervals.append((start, end))
+    intervals.sort()
+
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
 class PageRangeField(Field):
 
     widget = CSVWidget(attrs={"class":"form-control"})
@@ -14,21 +39,28 @@ class PageRangeField(Field):
 
 
 class PageRangeFilter(Filter):
+    """
+    Filter on page numbers and ranges, e.g. "5, 10-14, 35".
+    Ranges become BETWEEN conditions and single pages a single IN condition,
+    so the query grows with the number of values, not with the page count.
+    """
 
     field_class = PageRangeField
 
     def filter(self, qs, value):
         if value in EMPTY_VALUES:
             return qs
-        value_list = []
-        for v in value:
-            v = v.strip()
-            if '-' not in v:
-                value_list.append(int(v))
-            else:
-                start = int(v.split('-')[0])
-                end = int(v.split('-')[1]) + 1
-                value_list.extend(range(start, end))
-
-        qs = super().filter(qs, value_list)
+        intervals = parse_page_ranges(value)
+        if not intervals:
+            return qs.none()
+
+        pages = [start for start, end in intervals if start == end]
+        query = Q(**{f"{self.field_name}__in": pages}) if pages else Q()
+        for start, end in intervals:
+            if start != end:
+                query |= Q(**{f"{self.field_name}__range": (start, end)})
+
+        qs = self.get_method(qs)(query)
+        if self.distinct:
+            qs = qs.distinct()
         return qs
@@ -0,0 +1,212 @@
+"""
+Send files from MEDIA_ROOT once a view has checked the permissions.
+
+With SENDFILE_BACKEND set, the bytes are sent by the front-end server:
+"nginx" answers with an X-Accel-Redirect to SENDFILE_URL, an internal
+location aliased to MEDIA_ROOT, and "apache" with an X-Sendfile header
+(mod_xsendfile). Otherwise Django streams the file itself, with support for
+byte ranges.
+
+Either way, conditional requests are answered here with a 304 when the
+ETag or the modification date match.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from core.files import CHUNK_SIZE
+
+
+# more ranges than this are answered with the whole file
+MAX_RANGES = 20
+
+RANGE_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def media_path(name):
+    """
+    Absolute path of a file in MEDIA_ROOT, refusing paths outside of it.
+    """
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404("No such file")
+    if not os.path.isfile(path):
+        raise Http404("No such file")
+    return path
+
+
+def parse_range_header(header, size):
+    """
+    Parse a "bytes=0-499,-500" Range header into (first, last) byte
+    positions, both included.
+
+    Returns None when the header should be ignored, i.e. it is malformed or
+    asks for too many ranges, and an empty list when no range is
+    satisfiable.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or not ranges:
+        return None
+    specs = ranges.split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+    result = []
+    for spec in specs:
+        match = RANGE_RE.match(spec)
+        if not match or match.groups() == ("", ""):
+            return None
+        first, last = match.groups()
+        if first == "":
+            # suffix range: the last bytes of the file
+            length = int(last)
+            if length and size:
+                result.append((max(size - length, 0), size - 1))
+            continue
+        first = int(first)
+        if last != "" and int(last) < first:
+            return None
+        if first >= size:
+            continue
+        last = size - 1 if last == "" else min(int(last), size - 1)
+        result.append((first, last))
+    return result
+
+
+def _read_range(path, first, last, chunk_size=CHUNK_SIZE):
+    with open(path, "rb") as f:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _range_response(request, path, size, content_type, etag, last_modified):
+    """
+    Partial response for the Range header of the request, or None to send
+    the whole file.
+    """
+    header = request.META.get("HTTP_RANGE")
+    if not header or request.method not in ("GET", "HEAD"):
+        return None
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range:
+        if if_range.startswith(("\"", "W/")):
+            # only strong validators match (RFC 7233, section 3.2)
+            if if_range.startswith("W/") or if_range != etag:
+                return None
+        elif parse_http_date_safe(if_range) != int(last_modified):
+            return None
+    ranges = parse_range_header(header, size)
+    if ranges is None:
+        return None
+    if not ranges:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if len(ranges) == 1:
+        first, last = ranges[0]
+        response = StreamingHttpResponse(
+            _read_range(path, first, last), status=206, content_type=content_type
+        )
+        response["Content-Range"] = f"bytes {first}-{last}/{size}"
+        response["Content-Length"] = str(last - first + 1)
+        return response
+
+    boundary = uuid.uuid4().hex
+    headers = [
+        (
+            f"--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {first}-{last}/{size}\r\n\r\n"
+        ).encode()
+        for first, last in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+
+    def parts():
+        for i, (first, last) in enumerate(ranges):
+            yield (b"\r\n" if i else b"") + headers[i]
+            yield from _read_range(path, first, last)
+        yield closing
+
+    length = (
+        sum(len(h) for h in headers) + 2 * (len(ranges) - 1)
+        + sum(last - first + 1 for first, last in ranges) + len(closing)
+    )
+    response = StreamingHttpResponse(
+        parts(),
+        status=206,
+        content_type=f"multipart/byteranges; boundary={boundary}",
+    )
+    response["Content-Length"] = str(length)
+    return response
+
+
+def sendfile(request, name, as_attachment=False, etag=None):
+    """
+    Response sending the file name, relative to MEDIA_ROOT.
+    etag should be a strong, quoted entity tag identifying its content.
+    """
+    path = media_path(name)
+    backend = getattr(settings, "SENDFILE_BACKEND", "")
+    stat = os.stat(path)
+    content_type, encoding = mimetypes.guess_type(path)
+    content_type = content_type or "application/octet-stream"
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    # byte ranges of an encoded file would be ranges of the encoded bytes,
+    # sent without their encoding
+    if response is None and not backend and not encoding:
+        response = _range_response(
+            request, path, stat.st_size, content_type, etag, stat.st_mtime
+        )
+    if response is None:
+        if not backend:
+            response = FileResponse(
+                open(path, "rb"),
+                as_attachment=as_attachment,
+                content_type=content_type,
+            )
+        else:
+            response = HttpResponse(content_type=content_type)
+            if backend == "nginx":
+                response["X-Accel-Redirect"] = quote(
+                    settings.SENDFILE_URL + name.lstrip("/")
+                )
+            elif backend == "apache":
+                response["X-Sendfile"] = path
+            else:
+                raise ImproperlyConfigured(
+                    "SENDFILE_BACKEND must be 'nginx', 'apache' or empty."
+                )
+            disposition = "attachment" if as_attachment else "inline"
+            response["Content-Disposition"] = "{}; filename=\"{}\"".format(
+                disposition, os.path.basename(path)
+            )
+        if encoding:
+            response["Content-Encoding"] = encoding
+
+    if etag:
+        response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Accept-Ranges"] = "none" if encoding else "bytes"
+    # cached by the browser, but checked with the server before reuse
+    response["Cache-Control"] = "private, no-cache"
+    return response
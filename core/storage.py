@@ -0,0 +1,235 @@
+"""
+Storages for media files.
+
+AtomicFileSystemStorage never exposes a missing or partial file: a file is
+written to a temporary file in the directory of its target, and renamed
+over the target once the database transaction commits. Until then readers
+get the previous file. If the transaction rolls back, the previous file
+stays and the temporary one is removed when the request finishes.
+
+ContentAddressedStorage also stores every distinct content once, as a blob
+named after its SHA-256 under BLOB_DIRECTORY. The names files are saved
+under are hard links to their blob: they remain ordinary, human-readable
+paths that the web server and sendfile serve as before, while identical
+files share their bytes on disk. The link count of a blob is its reference count, and a blob nothing
+links to any more is garbage.
+
+MEDIA_ROOT has to be on a file system that supports hard links. Backups
+should preserve them (rsync -H, tar), or each alias is copied in full.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+from django.core.files.storage import FileSystemStorage
+from django.core.signals import request_finished
+from django.db import connections, transaction
+from django.dispatch import receiver
+
+from .files import cached_sha256
+
+
+BLOB_DIRECTORY = ".blobs"
+
+TEMPORARY_PREFIX = ".tmp-"
+
+# temporary files older than this were left by interrupted writes
+STALE_TEMPORARY_AGE = 3600
+
+# temporary files waiting for their transaction, per thread
+_pending = threading.local()
+
+
+def _pending_replacements():
+    if not hasattr(_pending, "files"):
+        _pending.files = {}
+    return _pending.files
+
+
+def discard_rolled_back():
+    """
+    Remove the temporary files of this thread whose replacement is no
+    longer scheduled, i.e. whose transaction rolled back.
+    """
+    pending = _pending_replacements()
+    if not pending:
+        return
+    scheduled = {
+        id(callback)
+        for connection in connections.all()
+        for _, callback in connection.run_on_commit
+    }
+    for temporary, callback in list(pending.items()):
+        if id(callback) not in scheduled:
+            del pending[temporary]
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+
+@receiver(request_finished)
+def discard_rolled_back_files(sender, **kwargs):
+    discard_rolled_back()
+
+
+class AtomicFileSystemStorage(FileSystemStorage):
+    """
+    Files are replaced in place, atomically, once the transaction commits.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # the file is replaced, not saved next to the existing one
+        return name
+
+    def temporary_name(self, name):
+        directory, file = os.path.split(name)
+        return os.path.join(directory, f"{TEMPORARY_PREFIX}{uuid4().hex}-{file}")
+
+    def _save(self, name, content):
+        discard_rolled_back()
+        temporary = super()._save(self.temporary_name(name), content)
+        self.replace_on_commit(self.path(temporary), self.path(name))
+        return str(name).replace("\\", "/")
+
+    def replace_on_commit(self, temporary, full_path):
+        pending = _pending_replacements()
+
+        def replace():
+            pending.pop(temporary, None)
+            os.replace(temporary, full_path)
+            # renaming a hard link over another link to the same file does
+            # nothing, which happens when identical content is saved again
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+        pending[temporary] = replace
+        transaction.on_commit(replace)
+
+
+class ContentAddressedStorage(AtomicFileSystemStorage):
+
+    def blob_path(self, digest):
+        return os.path.join(self.location, BLOB_DIRECTORY, digest[:2], digest[2:])
+
+    def _save(self, name, content):
+        discard_rolled_back()
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # the validators leave the hash of uploads on them, so the content
+        # of a known file is not even written
+        digest = getattr(content, "sha256", None)
+        if digest is None or not os.path.exists(self.blob_path(digest)):
+            digest = self._write_blob(content)
+        temporary = self.path(self.temporary_name(name))
+        try:
+            os.link(self.blob_path(digest), temporary)
+        except FileNotFoundError:
+            # the blob was collected in the meantime
+            digest = self._write_blob(content)
+            os.link(self.blob_path(digest), temporary)
+        self.replace_on_commit(temporary, full_path)
+        return str(name).replace("\\", "/")
+
+    def _write_blob(self, content):
+        root = os.path.join(self.location, BLOB_DIRECTORY)
+        os.makedirs(root, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=root, prefix=TEMPORARY_PREFIX)
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, "wb") as f:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+            digest = digest.hexdigest()
+            blob = self.blob_path(digest)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            if os.path.exists(blob):
+                os.remove(temporary)
+            else:
+                if self.file_permissions_mode is not None:
+                    os.chmod(temporary, self.file_permissions_mode)
+                os.replace(temporary, blob)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return digest
+
+    def link(self, digest, full_path):
+        """
+        Make full_path an alias of a blob, atomically replacing the file
+        that may be there.
+        """
+        temporary = os.path.join(
+            os.path.dirname(full_path), f"{TEMPORARY_PREFIX}{uuid4().hex}"
+        )
+        os.link(self.blob_path(digest), temporary)
+        try:
+            os.replace(temporary, full_path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def adopt(self, full_path, digest):
+        """
+        Turn an existing file into an alias of the blob of its content.
+        Returns the number of bytes freed.
+        """
+        blob = self.blob_path(digest)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            try:
+                os.link(full_path, blob)
+                return 0
+            except FileExistsError:
+                pass
+        if os.path.samefile(blob, full_path):
+            return 0
+        stat = os.stat(full_path)
+        self.link(digest, full_path)
+        return stat.st_size if stat.st_nlink == 1 else 0
+
+    def references(self, name):
+        """
+        The number of names sharing the content of the given one.
+        """
+        return os.stat(self.path(name)).st_nlink - 1
+
+    def delete(self, name):
+        full_path = self.path(name)
+        digest = cached_sha256(full_path) if os.path.isfile(full_path) else None
+        super().delete(name)
+        if digest:
+            self._collect(self.blob_path(digest))
+
+    def _collect(self, blob):
+        try:
+            if os.stat(blob).st_nlink == 1:
+                os.remove(blob)
+        except FileNotFoundError:
+            pass
+
+    def collect_garbage(self):
+        """
+        Remove the blobs no name refers to, and the leftovers of
+        interrupted writes. Returns the number of files removed.
+        """
+        root = os.path.join(self.location, BLOB_DIRECTORY)
+        removed = 0
+        for directory, _, files in os.walk(root):
+            for file in files:
+                path = os.path.join(directory, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if file.startswith(TEMPORARY_PREFIX):
+                    if time.time() - stat.st_mtime > STALE_TEMPORARY_AGE:
+                        os.remove(path)
+                        removed += 1
+                elif stat.st_nlink == 1:
+                    self._collect(path)
+                    removed += 1
+        return removed
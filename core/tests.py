@@ -1,6 +1,26 @@
-from django.test import SimpleTestCase
+import hashlib
+from io import StringIO
+import os
+import tempfile
+import threading
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopFutureHandlers, StopUpload
+from django.core.management import call_command
+from django.core.signals import request_finished
+from django.db import transaction
+from django.test import override_settings, RequestFactory, SimpleTestCase, TestCase
 from django.urls import reverse, resolve
 
+from .files import CHUNK_SIZE
+from .filters import parse_page_ranges
+from .storage import AtomicFileSystemStorage, ContentAddressedStorage
+from .uploadhandlers import StreamingUploadHandler, UPLOAD_DIRECTORY
+from .sendfile import MAX_RANGES, parse_range_header, sendfile
+from .validators import FileValidator, MAX_PAGE_FILTER_VALUES, validate_page_filter
 from .views import HomeView
 
 class HomePageTests(SimpleTestCase):
@@ -24,3 +44,291 @@ class HomePageTests(SimpleTestCase):
             view.func.__name__,
             HomeView.as_view().__name__
         )
+
+
+class PageRangeTests(SimpleTestCase):
+
+    def test_parse_page_ranges(self):
+        """
+        Values are merged into sorted intervals, without expanding ranges.
+        """
+        self.assertEqual(
+            parse_page_ranges(["35", " 10-14", "12-20", "5", "21", "8-6"]),
+            [(5, 5), (10, 21), (35, 35)],
+        )
+        self.assertEqual(parse_page_ranges(["1-1000000000"]), [(1, 1000000000)])
+
+    def test_validate_page_filter(self):
+        """
+        The number of values is bounded, the width of ranges is not.
+        """
+        self.assertEqual(validate_page_filter(["1-999999999"]), ["1-999999999"])
+        values = [str(v) for v in range(MAX_PAGE_FILTER_VALUES + 1)]
+        with self.assertRaisesMessage(ValidationError, "Give at most"):
+            validate_page_filter(values)
+        with self.assertRaisesMessage(ValidationError, "Values must be a range"):
+            validate_page_filter(["1" * 30])
+
+
+class FileValidatorTests(SimpleTestCase):
+
+    def test_file_validator(self):
+        """
+        The type is sniffed from the head of the file and its hash is
+        attached to it. Files that are too large are not read at all.
+        """
+        with open("pcdl_docs/test_pdf.pdf", "rb") as f:
+            content = f.read()
+        validator = FileValidator(max_size=len(content), content_types=("application/pdf",))
+        upload = SimpleUploadedFile("page.pdf", content)
+        validator(upload)
+        self.assertEqual(upload.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(upload.file.sha256, upload.sha256)
+        self.assertEqual(upload.read(), content)
+
+        upload = SimpleUploadedFile("page.pdf", content + b"x")
+        with mock.patch.object(upload, "chunks") as chunks:
+            with self.assertRaisesMessage(ValidationError, "Ensure this file size"):
+                validator(upload)
+            chunks.assert_not_called()
+
+        upload = SimpleUploadedFile("page.pdf", b"text" * (CHUNK_SIZE // 4 + 1))
+        with self.assertRaisesMessage(ValidationError, "text/plain"):
+            FileValidator(content_types=("application/pdf",))(upload)
+        self.assertFalse(hasattr(upload, "sha256"))
+
+
+class StreamingUploadHandlerTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = directory.name
+        media_root = override_settings(MEDIA_ROOT=self.location)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        with open("pcdl_docs/test_pdf.pdf", "rb") as f:
+            self.content = f.read()
+
+    def upload(self, field_name, chunks, request=None):
+        handler = StreamingUploadHandler(request or RequestFactory().post("/"))
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file(field_name, "page.pdf", "application/pdf", None)
+        for chunk in chunks:
+            self.assertIsNone(handler.receive_data_chunk(chunk, 0))
+        upload = handler.file_complete(sum(map(len, chunks)))
+        self.addCleanup(upload.close)
+        return handler, upload
+
+    def aborted_upload(self, field_name, chunks):
+        """
+        Send chunks until the handler stops the request, and return the
+        handler, the rejected upload and the number of chunks it read.
+        """
+        request = RequestFactory().post("/")
+        handler = StreamingUploadHandler(request)
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file(field_name, "page.pdf", "application/pdf", None)
+        for read, chunk in enumerate(chunks, 1):
+            try:
+                handler.receive_data_chunk(chunk, 0)
+            except StopUpload as e:
+                self.assertTrue(e.connection_reset)
+                return handler, request.rejected_uploads[field_name], read
+        self.fail("The upload was not stopped.")
+
+    def uploads(self):
+        return os.listdir(os.path.join(self.location, UPLOAD_DIRECTORY))
+
+    def test_valid_upload(self):
+        """
+        Valid files are hashed as they arrive, written under MEDIA_ROOT,
+        and not read again by the validator.
+        """
+        handler, upload = self.upload(
+            "scanned_text", [self.content[:3000], self.content[3000:]]
+        )
+        self.assertEqual(upload.sha256, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(os.path.dirname(upload.temporary_file_path()),
+                         os.path.join(self.location, UPLOAD_DIRECTORY))
+        with mock.patch.object(upload, "chunks") as chunks:
+            handler.validator(upload)
+            chunks.assert_not_called()
+        self.assertEqual(upload.read(), self.content)
+        # other fields are left to the next handlers
+        handler = StreamingUploadHandler(RequestFactory().post("/"))
+        handler.new_file("avatar", "avatar.png", "image/png", None)
+        self.assertEqual(handler.receive_data_chunk(b"data", 0), b"data")
+        self.assertIsNone(handler.file_complete(4))
+
+    def test_rejected_upload(self):
+        """
+        Files of the wrong type or too large stop the request as soon as
+        that is known, and the validator raises the error.
+        """
+        text = b"text" * 1024
+        handler, upload, read = self.aborted_upload("scanned_text", [text, text, text])
+        self.assertEqual(read, 1)
+        self.assertTrue(handler.file.closed)
+        self.assertEqual(self.uploads(), [])
+        with self.assertRaisesMessage(ValidationError, "text/plain"):
+            handler.validator(upload)
+
+        chunk = self.content.ljust(500 * 1024, b"\0")
+        handler, upload, read = self.aborted_upload("typed_text", [chunk] * 100)
+        self.assertEqual(read, 3)
+        self.assertTrue(handler.file.closed)
+        self.assertEqual(self.uploads(), [])
+        with self.assertRaisesMessage(ValidationError, "Your file size is 1.5"):
+            handler.validator(upload)
+
+        # files shorter than the sniffed head are checked once complete
+        handler, upload = self.upload("scanned_text", [b"text"])
+        self.assertEqual(self.uploads(), [])
+        with self.assertRaisesMessage(ValidationError, "text/plain"):
+            handler.validator(upload)
+
+
+class AtomicFileSystemStorageTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = directory.name
+        self.storage = AtomicFileSystemStorage(location=self.location)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.storage.save("page.pdf", ContentFile(b"old"))
+
+    def read(self):
+        with self.storage.open("page.pdf") as f:
+            return f.read()
+
+    def test_file_replaced_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.storage.save("page.pdf", ContentFile(b"new")), "page.pdf")
+            # readers get the previous file until the transaction commits
+            self.assertEqual(self.read(), b"old")
+        self.assertEqual(self.read(), b"new")
+        self.assertEqual(os.listdir(self.location), ["page.pdf"])
+
+    def test_rolled_back_save(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.storage.save("page.pdf", ContentFile(b"new"))
+                raise ValueError
+        request_finished.send(sender=None)
+        self.assertEqual(os.listdir(self.location), ["page.pdf"])
+        self.assertEqual(self.read(), b"old")
+
+    def test_concurrent_reads(self):
+        """
+        Readers always get a whole file while it is replaced.
+        """
+        contents = {b"a" * 1024 * 1024, b"b" * 1024 * 1024}
+        errors = []
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                try:
+                    content = self.read()
+                except OSError as e:
+                    errors.append(e)
+                    continue
+                if content not in contents and content != b"old":
+                    errors.append(len(content))
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            for content in sorted(contents) * 20:
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.storage.save("page.pdf", ContentFile(content))
+        finally:
+            done.set()
+            reader.join()
+        self.assertEqual(errors, [])
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = directory.name
+        self.storage = ContentAddressedStorage(location=self.location)
+
+    def test_identical_files_share_a_blob(self):
+        first = self.storage.save("a/first.pdf", ContentFile(b"%PDF-1.4 same"))
+        second = self.storage.save("b/second.pdf", ContentFile(b"%PDF-1.4 same"))
+        other = self.storage.save("b/other.pdf", ContentFile(b"%PDF-1.4 other"))
+        self.assertTrue(os.path.samefile(self.storage.path(first), self.storage.path(second)))
+        self.assertEqual(self.storage.references(first), 2)
+        self.assertEqual(self.storage.references(other), 1)
+        with self.storage.open(second) as f:
+            self.assertEqual(f.read(), b"%PDF-1.4 same")
+
+        blob = self.storage.blob_path(hashlib.sha256(b"%PDF-1.4 same").hexdigest())
+        self.storage.delete(first)
+        self.assertTrue(os.path.isfile(blob))
+        self.storage.delete(second)
+        self.assertFalse(os.path.exists(blob))
+
+        # files removed without the storage leave their blob unused
+        os.remove(self.storage.path(other))
+        self.assertEqual(self.storage.collect_garbage(), 1)
+        self.assertEqual(self.storage.collect_garbage(), 0)
+
+    def test_dedupe_media(self):
+        for name in ("a.pdf", "b.pdf", "c/d.pdf"):
+            path = os.path.join(self.location, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(b"%PDF-1.4 same" * 100)
+        out = StringIO()
+        with self.settings(MEDIA_ROOT=self.location):
+            call_command("dedupe_media", "--dry-run", "--workers=1", stdout=out)
+            self.assertIn("2.5\xa0KB can be freed", out.getvalue())
+            self.assertEqual(os.stat(os.path.join(self.location, "a.pdf")).st_nlink, 1)
+            call_command("dedupe_media", "--workers=1", stdout=out)
+        self.assertIn("Converted 3 files, 2.5\xa0KB freed", out.getvalue())
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.location, "a.pdf"), os.path.join(self.location, "c/d.pdf")
+        ))
+        self.assertEqual(os.stat(os.path.join(self.location, "a.pdf")).st_nlink, 4)
+
+
+class RangeHeaderTests(SimpleTestCase):
+
+    def test_parse_range_header(self):
+        self.assertEqual(parse_range_header("bytes=0-99", 1000), [(0, 99)])
+        self.assertEqual(
+            parse_range_header("bytes=0-0, -100, 900-", 1000),
+            [(0, 0), (900, 999), (900, 999)],
+        )
+        self.assertEqual(parse_range_header("bytes=500-5000", 1000), [(500, 999)])
+        # unsatisfiable
+        self.assertEqual(parse_range_header("bytes=1000-", 1000), [])
+        # ignored
+        self.assertIsNone(parse_range_header("bytes=10-5", 1000))
+        self.assertIsNone(parse_range_header("items=0-5", 1000))
+        self.assertIsNone(parse_range_header("bytes=a-5", 1000))
+        self.assertIsNone(
+            parse_range_header("bytes=" + ",".join(["0-1"] * (MAX_RANGES + 1)), 1000)
+        )
+
+    def test_encoded_file(self):
+        """
+        Files sent with a Content-Encoding are always sent whole.
+        """
+        with tempfile.TemporaryDirectory() as media_root, \
+                self.settings(MEDIA_ROOT=media_root, SENDFILE_BACKEND=""):
+            with open(os.path.join(media_root, "page.pdf.gz"), "wb") as f:
+                f.write(b"x" * 100)
+            request = RequestFactory().get("/", HTTP_RANGE="bytes=0-4")
+            response = sendfile(request, "page.pdf.gz", etag='"1"')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertEqual(response["Accept-Ranges"], "none")
+            self.assertEqual(len(b"".join(response.streaming_content)), 100)
+            response.close()
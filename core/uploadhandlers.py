@@ -0,0 +1,187 @@
+"""
+Upload handlers.
+
+StreamingUploadHandler validates the files of the form fields listed in
+STREAMING_UPLOAD_FIELDS while they arrive, with the FileValidator of the
+model field they are saved to: the type is sniffed from the first bytes,
+the size counted, and the content hashed as the chunks come in. Valid files
+are written to UPLOAD_DIRECTORY under MEDIA_ROOT, on the file system of
+their final location, so that storing them is a rename.
+
+An upload that turns out too large or of the wrong type while it arrives
+stops the request with StopUpload(connection_reset=True): the rest of the
+body is not read, and neither are the form fields that follow the file.
+The upload is then left out of request.FILES; uploaded_files() puts it
+back as a RejectedUploadedFile, so that the form reports the error of the
+validator as usual.
+"""
+import hashlib
+from io import BytesIO
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import temp as tempfile
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import (
+    FileUploadHandler, StopFutureHandlers, StopUpload,
+)
+
+from .storage import TEMPORARY_PREFIX
+from .validators import FileValidator, SNIFF_SIZE
+
+
+UPLOAD_DIRECTORY = ".uploads"
+
+
+def get_validator(field_name):
+    """
+    The FileValidator of the model field the form field is saved to, or None.
+    """
+    path = settings.STREAMING_UPLOAD_FIELDS.get(field_name)
+    if path is None:
+        return None
+    app_label, model_name, name = path.split(".")
+    field = apps.get_model(app_label, model_name)._meta.get_field(name)
+    return next(
+        (v for v in field.validators if isinstance(v, FileValidator)), None
+    )
+
+
+def uploaded_files(request):
+    """
+    request.FILES, with the uploads that stopped the request added back.
+    """
+    files = request.FILES
+    for field_name, upload in getattr(request, "rejected_uploads", {}).items():
+        files.setdefault(field_name, upload)
+    return files
+
+
+class MediaUploadedFile(TemporaryUploadedFile):
+    """
+    A file uploaded to a temporary file in UPLOAD_DIRECTORY.
+    """
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        _, ext = os.path.splitext(name)
+        directory = os.path.join(settings.MEDIA_ROOT, UPLOAD_DIRECTORY)
+        os.makedirs(directory, exist_ok=True)
+        file = tempfile.NamedTemporaryFile(
+            prefix=TEMPORARY_PREFIX, suffix=".upload" + ext, dir=directory
+        )
+        UploadedFile.__init__(
+            self, file, name, content_type, size, charset, content_type_extra
+        )
+
+
+class StoredUploadedFile(UploadedFile):
+    """
+    A file that was uploaded to path before the request, e.g. in chunks.
+    Storages move it into place like a temporary upload.
+    """
+
+    def __init__(self, path, name, content_type=None, charset=None):
+        super().__init__(
+            open(path, "rb"), name, content_type, os.path.getsize(path), charset
+        )
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+class RejectedUploadedFile(UploadedFile):
+    """
+    An empty stand-in for an upload that failed validation, carrying the
+    error for the validator to raise.
+    """
+
+    def __init__(self, name, content_type, size, charset, error):
+        super().__init__(BytesIO(), name, content_type, size, charset)
+        self.upload_error = error
+
+
+class StreamingUploadHandler(FileUploadHandler):
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.validator = get_validator(field_name)
+        if self.validator is None:
+            return
+        self.file = MediaUploadedFile(
+            self.file_name, self.content_type, 0, self.charset,
+            self.content_type_extra,
+        )
+        self.digest = hashlib.sha256()
+        self.head = b""
+        self.size = 0
+        self.error = None
+        raise StopFutureHandlers()
+
+    def reject(self, error=None):
+        """
+        Stop writing the file. Without an error, it is too large.
+        """
+        self.error = error
+        self.file.close()
+
+    def rejected_file(self):
+        error = self.error or self.validator.size_error(self.size)
+        return RejectedUploadedFile(
+            self.file_name, self.content_type, self.size, self.charset, error
+        )
+
+    def abort(self, error=None):
+        """
+        Reject the file and stop reading the request.
+        """
+        self.reject(error)
+        if not hasattr(self.request, "rejected_uploads"):
+            self.request.rejected_uploads = {}
+        self.request.rejected_uploads[self.field_name] = self.rejected_file()
+        raise StopUpload(connection_reset=True)
+
+    def sniff(self):
+        try:
+            self.validator.check_content_type(self.head)
+        except ValidationError as e:
+            return e
+        return None
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.validator is None:
+            return raw_data
+        self.size += len(raw_data)
+        max_size = self.validator.max_size
+        if max_size is not None and self.size > max_size:
+            self.abort()
+        if self.validator.content_types and len(self.head) < SNIFF_SIZE:
+            self.head += raw_data[:SNIFF_SIZE - len(self.head)]
+            if len(self.head) >= SNIFF_SIZE:
+                error = self.sniff()
+                if error is not None:
+                    self.abort(error)
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.validator is None:
+            return None
+        if self.validator.content_types and len(self.head) < SNIFF_SIZE:
+            # files shorter than SNIFF_SIZE have arrived in full already
+            error = self.sniff()
+            if error is not None:
+                self.reject(error)
+                return self.rejected_file()
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.file.file.sha256 = self.digest.hexdigest()
+        self.file.validated_by = self.validator
+        return self.file
+
+    def upload_interrupted(self):
+        if getattr(self, "validator", None) is not None:
+            self.file.close()
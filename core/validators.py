@@ -1,3 +1,5 @@
+from contextlib import suppress
+import hashlib
 import magic
 import re
 
@@ -5,9 +7,24 @@ from django.core.exceptions import ValidationError
 from django.template.defaultfilters import filesizeformat
 from django.utils.deconstruct import deconstructible
 
+from .files import CHUNK_SIZE
+
+
+# libmagic identifies PDF and image files from their first bytes
+SNIFF_SIZE = 2048
+
 
 @deconstructible
 class FileValidator(object):
+    """
+    Validate the size and the type of a file in one pass over its chunks,
+    in constant memory. The size is checked before anything is read, and
+    the type from the first SNIFF_SIZE bytes.
+
+    The SHA-256 hex digest of valid files is set as their sha256
+    attribute, and on the underlying file object, which is what storages
+    are handed when the file is saved.
+    """
     error_messages = {
      'max_size': ("Ensure this file size is not greater than %(max_size)s."
                   " Your file size is %(size)s."),
@@ -19,22 +36,53 @@ class FileValidator(object):
         self.content_types = content_types
 
     def __call__(self, data):
+        # uploads that StreamingUploadHandler already checked
+        upload = getattr(data, "file", None)
+        for checked in (data, upload):
+            if getattr(checked, "upload_error", None) is not None:
+                raise checked.upload_error
+            if getattr(checked, "validated_by", None) == self:
+                data.sha256 = checked.sha256
+                with suppress(AttributeError):
+                    upload.sha256 = checked.sha256
+                return
+
         if self.max_size is not None and data.size > self.max_size:
-            params = {
-                'max_size': filesizeformat(self.max_size),
-                'size': filesizeformat(data.size),
-            }
-            raise ValidationError(self.error_messages['max_size'],
-                                   'max_size', params)
-
-        if self.content_types:
-            content_type = magic.from_buffer(data.read(), mime=True)
-            data.seek(0)
-
-            if content_type not in self.content_types:
-                params = { 'content_type': content_type }
-                raise ValidationError(self.error_messages['content_type'],
-                                   'content_type', params)
+            raise self.size_error(data.size)
+
+        digest = hashlib.sha256()
+        head = b""
+        sniffed = not self.content_types
+        for chunk in data.chunks(CHUNK_SIZE):
+            digest.update(chunk)
+            if not sniffed:
+                head += chunk[:SNIFF_SIZE - len(head)]
+                if len(head) >= SNIFF_SIZE:
+                    self.check_content_type(head)
+                    sniffed = True
+        if not sniffed:
+            self.check_content_type(head)
+        data.seek(0)
+
+        data.sha256 = digest.hexdigest()
+        # plain file objects do not take attributes
+        with suppress(AttributeError):
+            data.file.sha256 = data.sha256
+
+    def size_error(self, size):
+        params = {
+            'max_size': filesizeformat(self.max_size),
+            'size': filesizeformat(size),
+        }
+        return ValidationError(self.error_messages['max_size'],
+                               'max_size', params)
+
+    def check_content_type(self, head):
+        content_type = magic.from_buffer(head, mime=True)
+        if content_type not in self.content_types:
+            params = { 'content_type': content_type }
+            raise ValidationError(self.error_messages['content_type'],
+                               'content_type', params)
 
     def __eq__(self, other):
         return (
@@ -43,11 +91,21 @@ class FileValidator(object):
             self.content_types == other.content_types
         )
 
+MAX_PAGE_FILTER_VALUES = 50
+
+
 def validate_page_filter(value):
 
     assert value is None or isinstance(value, list)
 
-    possible_value_re = re.compile("^\d+(-\d+)?$")
+    if len(value) > MAX_PAGE_FILTER_VALUES:
+        raise ValidationError(
+            "Give at most %(max)s page numbers or ranges.",
+            code="max_values",
+            params={"max": MAX_PAGE_FILTER_VALUES},
+        )
+
+    possible_value_re = re.compile("^\d{1,9}(-\d{1,9})?$")
     valid_values = True
 
     for v in value:
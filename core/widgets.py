@@ -1,9 +1,17 @@
 from django.forms import ClearableFileInput, FileInput
 
 class FileValueInput(FileInput):
+    """
+    File input showing the current file. Given a data-upload-url attribute,
+    the file is sent in resumable chunks there before the form is submitted
+    (see static/js/resumable_upload.js).
+    """
     template_name = "widgets/file_value_input.html"
     # atts = {"disabled": ''}
 
+    class Media:
+        js = ["js/resumable_upload.js"]
+
     def is_initial(self, value):
         """
         Return whether value is considered to be initial value.
@@ -102,6 +102,21 @@ DATABASES = {
     ),
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# e.g. locmem://, file:///var/tmp/pcdl or redis://redis:6379/1
+# Saving a page invalidates the cached page data through the cache, so all
+# processes have to share it: locmem:// is only correct when the site runs
+# in a single process (check --deploy warns about it).
+
+CACHES = {
+    "default": env.dj_cache_url("CACHE_URL", default="locmem://"),
+}
+
+# Page lookups are cached for at most PAGE_CACHE_TIMEOUT seconds; saving or
+# deleting a page invalidates them at once.
+PAGE_CACHE_TIMEOUT = env.int("PCDL_PAGE_CACHE_TIMEOUT", default=60 * 60)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -167,6 +182,76 @@ MEDIA_URL = "/media/"
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Uploads replace the files of pages atomically once they are committed.
+# Set to "core.storage.ContentAddressedStorage" to also store identical
+# media files once; convert an existing MEDIA_ROOT with dedupe_media.
+DEFAULT_FILE_STORAGE = env(
+    "PCDL_FILE_STORAGE", default="core.storage.AtomicFileSystemStorage"
+)
+
+# Media files are served by Django after checking the user, and handed to
+# the front-end server when one is configured: "nginx" (X-Accel-Redirect to
+# the internal location SENDFILE_URL) or "apache" (X-Sendfile).
+SENDFILE_BACKEND = env("PCDL_SENDFILE_BACKEND", default="")
+
+SENDFILE_URL = env("PCDL_SENDFILE_URL", default="/protected-media/")
+
+# Page previews, rendered with pdftoppm (poppler-utils) when it is installed.
+# The format is WEBP or JPEG, by default WEBP if Pillow supports it.
+PAGE_PREVIEW_FORMAT = env("PCDL_PAGE_PREVIEW_FORMAT", default="")
+
+PAGE_PREVIEW_WORKERS = env.int("PCDL_PAGE_PREVIEW_WORKERS", default=2)
+
+# Files of replaced page versions are kept under MEDIA_ROOT/versions/ and
+# compacted by the compact_versions command, which deletes those that are
+# neither among the latest PAGE_VERSIONS_KEEP versions of a page nor were
+# replaced less than PAGE_VERSIONS_MAX_AGE days ago.
+PAGE_VERSIONS_KEEP = env.int("PCDL_PAGE_VERSIONS_KEEP", default=10)
+
+PAGE_VERSIONS_MAX_AGE = env.int("PCDL_PAGE_VERSIONS_MAX_AGE", default=365)
+
+# The files of deleted pages are removed by a background thread once the
+# deletion commits. Without it, run the process_file_cleanup command.
+MEDIA_CLEANUP_ON_COMMIT = env.bool("PCDL_MEDIA_CLEANUP_ON_COMMIT", default=True)
+
+# Uploads of these form fields are validated while they arrive, with the
+# FileValidator of the model field they are saved to, and written under
+# MEDIA_ROOT so that saving them is a rename.
+STREAMING_UPLOAD_FIELDS = {
+    "scanned_text": "books.Page.scanned_text",
+    "typed_text": "books.Page.typed_text",
+}
+
+FILE_UPLOAD_HANDLERS = [
+    "core.uploadhandlers.StreamingUploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
+# Threads validating the files of a bulk upload in the admin.
+PAGE_BULK_UPLOAD_WORKERS = env.int("PCDL_PAGE_BULK_UPLOAD_WORKERS", default=4)
+
+# Resumable uploads not continued for PAGE_UPLOAD_EXPIRY hours are removed
+# by the expire_uploads command.
+PAGE_UPLOAD_EXPIRY = env.int("PCDL_PAGE_UPLOAD_EXPIRY", default=24)
+
+# ZIP downloads of pages hold a worker while they are sent, so each process
+# streams at most PAGE_DOWNLOAD_CONCURRENCY of them at once.
+PAGE_DOWNLOAD_CONCURRENCY = env.int("PCDL_PAGE_DOWNLOAD_CONCURRENCY", default=2)
+
+# Merged PDFs of volumes are built with pdfunite (poppler-utils) in chunks of
+# PAGE_VOLUME_CHUNK_SIZE page numbers, so that a change to a page only merges
+# its chunk again.
+PAGE_VOLUME_CHUNK_SIZE = env.int("PCDL_PAGE_VOLUME_CHUNK_SIZE", default=50)
+
+# Volumes are built by a background thread once a change to their pages
+# commits. Without it, run the build_volumes command.
+PAGE_VOLUME_BUILD_ON_COMMIT = env.bool("PCDL_PAGE_VOLUME_BUILD_ON_COMMIT", default=True)
+
+# A build still running after PAGE_VOLUME_BUILD_TIMEOUT seconds is taken for
+# one whose worker died, and started again when the volume is requested.
+PAGE_VOLUME_BUILD_TIMEOUT = env.int("PCDL_PAGE_VOLUME_BUILD_TIMEOUT", default=3600)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
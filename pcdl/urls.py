@@ -1,7 +1,8 @@
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
+
+from books.views import PageFileView
 
 urlpatterns = [
     # Django admin
@@ -13,9 +14,14 @@ urlpatterns = [
     # Core
     path('', include('core.urls')),
     path('pcdl/content/', include('books.urls')),
-] + static(
-    settings.MEDIA_URL, document_root=settings.MEDIA_ROOT
-)
+
+    # Media, only for logged in users
+    re_path(
+        r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'),
+        PageFileView.as_view(),
+        name='media',
+    ),
+]
 
 if settings.DEBUG:
     import debug_toolbar
@@ -0,0 +1,176 @@
+// Resumable uploads for FileValueInput widgets with a data-upload-url.
+//
+// When the form is submitted, the selected file is sent in chunks to the
+// upload URL of the admin (see books/uploads.py). A failed chunk is retried
+// from the offset the server reports, and an upload interrupted by a reload
+// resumes where it stopped. The form fields are then posted to the finalize
+// URL, which validates the file and saves the page like a regular submit.
+(function () {
+  "use strict";
+
+  const CHUNK_SIZE = 1024 * 1024;
+  const RETRIES = 8;
+
+  function csrfToken(form) {
+    const input = form.querySelector("input[name=csrfmiddlewaretoken]");
+    return input ? input.value : "";
+  }
+
+  function storageKey(input, file) {
+    return ["upload", input.name, file.name, file.size, file.lastModified].join(":");
+  }
+
+  function sleep(ms) {
+    return new Promise((resolve) => setTimeout(resolve, ms));
+  }
+
+  async function request(url, options) {
+    const response = await fetch(url, Object.assign({ credentials: "same-origin" }, options));
+    if (response.status >= 500) {
+      throw new Error(response.status + " " + response.statusText);
+    }
+    return response;
+  }
+
+  async function offsetOf(location, token) {
+    const response = await request(location, {
+      method: "HEAD",
+      headers: { "X-CSRFToken": token },
+    });
+    return response.ok ? parseInt(response.headers.get("Upload-Offset"), 10) : null;
+  }
+
+  async function create(input, file, token) {
+    const data = new FormData();
+    data.append("field", input.name);
+    data.append("filename", file.name);
+    data.append("length", file.size);
+    const response = await request(input.dataset.uploadUrl, {
+      method: "POST",
+      headers: { "X-CSRFToken": token },
+      body: data,
+    });
+    if (response.status !== 201) {
+      throw new Error(await response.text());
+    }
+    return response.headers.get("Location");
+  }
+
+  async function send(input, file, token, progress) {
+    const key = storageKey(input, file);
+    let location = localStorage.getItem(key);
+    let offset = location ? await offsetOf(location, token) : null;
+    if (offset === null) {
+      location = await create(input, file, token);
+      localStorage.setItem(key, location);
+      offset = 0;
+    }
+    let failures = 0;
+    while (offset < file.size) {
+      progress(offset / file.size);
+      try {
+        const response = await request(location, {
+          method: "PATCH",
+          headers: {
+            "X-CSRFToken": token,
+            "Upload-Offset": offset,
+            "Content-Type": "application/offset+octet-stream",
+          },
+          body: file.slice(offset, offset + CHUNK_SIZE),
+        });
+        if (response.status === 204 || response.status === 409) {
+          offset = parseInt(response.headers.get("Upload-Offset"), 10);
+          failures = 0;
+          continue;
+        }
+        localStorage.removeItem(key);
+        throw new Error(await response.text());
+      } catch (error) {
+        if (error.name !== "TypeError" && !/^5\d\d /.test(error.message)) {
+          throw error;
+        }
+        // the connection dropped: ask where to resume
+        if (++failures > RETRIES) {
+          throw error;
+        }
+        await sleep(Math.min(1000 * 2 ** failures, 30000));
+        const resumed = await offsetOf(location, token).catch(() => null);
+        if (resumed !== null) {
+          offset = resumed;
+        }
+      }
+    }
+    progress(1);
+    return { key: key, location: location };
+  }
+
+  function showErrors(form, errors) {
+    let list = form.querySelector(".resumable-upload-errors");
+    if (!list) {
+      list = document.createElement("ul");
+      list.className = "errorlist resumable-upload-errors";
+      form.prepend(list);
+    }
+    list.replaceChildren();
+    for (const message of errors) {
+      const item = document.createElement("li");
+      item.textContent = message;
+      list.append(item);
+    }
+  }
+
+  async function submit(form, input, file) {
+    const token = csrfToken(form);
+    const status = document.createElement("span");
+    input.after(status);
+    const upload = await send(input, file, token, (done) => {
+      status.textContent = " " + Math.floor(done * 100) + "%";
+    });
+    const data = new FormData(form);
+    for (const other of form.querySelectorAll("input[type=file]")) {
+      data.delete(other.name);
+    }
+    if (input.dataset.page) {
+      data.append("page", input.dataset.page);
+    }
+    const response = await request(upload.location + "finalize/", {
+      method: "POST",
+      headers: { "X-CSRFToken": token },
+      body: data,
+    });
+    const result = await response.json();
+    if (response.status === 201) {
+      localStorage.removeItem(upload.key);
+      window.location = result.url;
+      return;
+    }
+    status.remove();
+    showErrors(
+      form,
+      Object.values(result.errors).flat().map((error) => error.message)
+    );
+  }
+
+  document.addEventListener("DOMContentLoaded", () => {
+    for (const input of document.querySelectorAll("input[type=file][data-upload-url]")) {
+      const form = input.form;
+      if (!form || form.dataset.resumableUpload) {
+        continue;
+      }
+      form.dataset.resumableUpload = "on";
+      form.addEventListener("submit", (event) => {
+        const selected = Array.from(
+          form.querySelectorAll("input[type=file][data-upload-url]")
+        ).filter((field) => field.files.length);
+        // no file, or both files: the form reports it as usual
+        if (selected.length !== 1) {
+          return;
+        }
+        event.preventDefault();
+        submit(form, selected[0], selected[0].files[0]).catch((error) => {
+          showErrors(form, [error.message]);
+        });
+      });
+    }
+  });
+})();